@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures time of listing paths to copy on a large tree (by default 200k files)
+
+    python benchmarks/walker_benchmark.py [files_number]
+"""
+import os
+import sys
+import time
+
+from path import tempdir
+
+from mrunner.utils.utils import get_paths_to_copy, get_paths_digest
+
+
+def create_tree(root, files_number, files_per_dir=100):
+    for idx in range(files_number):
+        directory = root / 'src' / 'd{}'.format(idx // files_per_dir // 50) / 'd{}'.format(idx // files_per_dir)
+        if idx % files_per_dir == 0:
+            directory.makedirs_p()
+        with open(directory / 'f{}.py'.format(idx), 'w') as f:
+            f.write(str(idx))
+    # some ignored (and pruned) paths
+    (root / 'data').makedirs_p()
+    for idx in range(1000):
+        with open(root / 'data' / 'sample{}.bin'.format(idx), 'w') as f:
+            f.write(str(idx))
+    with open(root / '.gitignore', 'w') as f:
+        f.write('data/\n*.pyc\n')
+    # an excluded subdirectory, so directories on its path have to be expanded
+    (root / 'src' / 'd0' / 'd0' / '__pycache__').makedirs_p()
+
+
+def main(files_number):
+    with tempdir() as tmp:
+        start = time.time()
+        create_tree(tmp, files_number)
+        print('created {} files in {:.2f}s'.format(files_number, time.time() - start))
+        os.chdir(tmp)
+
+        start = time.time()
+        paths = get_paths_to_copy(exclude=['.git', 'src/d0/d0/__pycache__'])
+        print('get_paths_to_copy: {} paths in {:.3f}s'.format(len(paths), time.time() - start))
+
+        start = time.time()
+        get_paths_to_copy(exclude=['.git', 'src/d0/d0/__pycache__'])
+        print('get_paths_to_copy (memoized): {:.6f}s'.format(time.time() - start))
+
+        start = time.time()
+        get_paths_digest(paths)
+        print('get_paths_digest: {:.3f}s'.format(time.time() - start))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import importlib
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+# backends are imported only when their backend_type is used - they pull heavy dependencies
+# (kubernetes client, docker, paramiko); additional backends may be registered by other packages
+# with entry points in this group (ex. `lsf = my_package.backend:LsfBackend`)
+BACKENDS_ENTRY_POINT_GROUP = 'mrunner.backends'
+BUILTIN_BACKENDS = {
+    'kubernetes': 'mrunner.backends.k8s:KubernetesBackend',
+    'local': 'mrunner.backends.local:LocalBackend',
+    'slurm': 'mrunner.backends.slurm:SlurmBackend',
+}
+
+
+def _load_object(reference):
+    module_name, object_name = reference.split(':')
+    return getattr(importlib.import_module(module_name), object_name)
+
+
+def _find_entry_point(backend_type):
+    from importlib import metadata
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        entry_points = entry_points.select(group=BACKENDS_ENTRY_POINT_GROUP)
+    else:
+        entry_points = entry_points.get(BACKENDS_ENTRY_POINT_GROUP, [])
+    return next((entry_point for entry_point in entry_points if entry_point.name == backend_type), None)
+
+
+def get_backend_class(backend_type):
+    """Returns (imports) backend class for given backend_type"""
+    if backend_type in BUILTIN_BACKENDS:
+        return _load_object(BUILTIN_BACKENDS[backend_type])
+
+    entry_point = _find_entry_point(backend_type)
+    if entry_point is None:
+        raise ValueError('Unknown backend type: {} (available: {})'.format(
+            backend_type, ', '.join(sorted(BUILTIN_BACKENDS))))
+    LOGGER.debug('Loading {} backend from {}'.format(backend_type, entry_point.value))
+    return entry_point.load()
@@ -1,21 +1,43 @@
 # -*- coding: utf-8 -*-
 import logging
 import re
+import shlex
+import threading
+from collections import Counter
 
 import attr
 from kubernetes import client, config
+from kubernetes.client.rest import ApiException
+from path import Path
 
 from mrunner.experiment import COMMON_EXPERIMENT_MANDATORY_FIELDS, COMMON_EXPERIMENT_OPTIONAL_FIELDS
-from mrunner.utils.docker_engine import DockerEngine
-from mrunner.utils.utils import make_attr_class, filter_only_attr
+from mrunner.utils.docker_engine import DockerEngine, rewrite_paths
+from mrunner.utils.journal import PENDING, RUNNING, DONE, FAILED
+from mrunner.utils.k8s_watch import JobsWatcher
+from mrunner.utils.neptune import NeptuneToken
+from mrunner.utils.utils import make_attr_class, filter_only_attr, get_paths_to_copy, shell_export
 
 LOGGER = logging.getLogger(__name__)
 
+NEPTUNE_CONFIG_ENV = 'MRUNNER_NEPTUNE_CONFIG'
+# jobs (and their pods) created by mrunner are labeled, so states of all of them are listed with single call
+MANAGED_BY_LABELS = {'app.kubernetes.io/managed-by': 'mrunner'}
+MANAGED_BY_LABEL_SELECTOR = ','.join('{}={}'.format(k, v) for k, v in MANAGED_BY_LABELS.items())
+
 
 def _generate_project_namespace(args):
     return re.sub(r'[ .,_-]+', '-', args.project)
 
 
+def tracked_states(tracker):
+    """{job id: state} of jobs tracked by JobsTracker; tasks of finished sweep which never got pods are failed"""
+    states = {job_id: DONE if result.returncode == 0 else FAILED for job_id, result in tracker.results.items()}
+    for job_id, phase in tracker.phases.items():
+        if job_id not in states:
+            states[job_id] = RUNNING if phase == 'Running' else PENDING
+    return states
+
+
 def _extract_cmd_without_params(args):
     cmd = args.cmd.command
     if args.cmd and ' -- ' in args.cmd.command:
@@ -42,6 +64,9 @@ EXPERIMENT_OPTIONAL_FIELDS = [
     ('cmd_without_params', dict(init=False, default=attr.Factory(_extract_cmd_without_params, takes_self=True))),
     ('params', dict(init=False, default=attr.Factory(_extract_params, takes_self=True))),
     ('default_pvc_size', dict(default='')),
+    ('rebuild', dict(default=False)),  # build (and push) image even if it is found in build cache
+    ('base_image_refresh', dict(default=24 * 3600)),  # how often (in seconds) base image is pulled
+    ('buildkit', dict(default=False)),  # build with BuildKit (pip cache is kept between builds)
     ('namespace', dict(init=False, default=attr.Factory(_generate_project_namespace, takes_self=True))),
 ]
 
@@ -52,8 +77,11 @@ ExperimentRunOnKubernetes = make_attr_class('ExperimentRunOnKubernetes', EXPERIM
 
 class Job(client.V1Job):
     RESOURCE_NAME_MAP = {'cpu': 'cpu', 'mem': 'memory', 'gpu': 'nvidia.com/gpu', 'tpu': 'cloud-tpus.google.com/v2'}
+    TASKS_MOUNT_PATH = '/etc/mrunner/tasks'
 
-    def __init__(self, image, experiment):
+    def __init__(self, image, experiment, tasks_count=None, parallelism=None):
+        """For sweeps pass number of tasks - Indexed Job with one completion per task is created; tasks are read
+        from ConfigMap named after job"""
         from mrunner.utils.namesgenerator import get_random_name
 
         experiment_name = re.sub(r'[ ,.\-_:;]+', '-', experiment.name)
@@ -69,16 +97,40 @@ class Job(client.V1Job):
         vol = client.V1Volume(name=internal_volume_name,
                               persistent_volume_claim=client.V1PersistentVolumeClaimVolumeSource(
                                   claim_name=KubernetesBackend.NFS_PVC_NAME))
-        ctr = client.V1Container(name=name, image=image, args=experiment.params,
-                                 volume_mounts=[client.V1VolumeMount(mount_path=experiment.storage_dir,
-                                                                     name=internal_volume_name)],
+        volumes = [vol]
+        volume_mounts = [client.V1VolumeMount(mount_path=experiment.storage_dir, name=internal_volume_name)]
+        command, args = None, experiment.params
+        if experiment.generated_neptune_config:
+            # generated neptune config is not part of (shared) image; it is written just before experiment start
+            envs[NEPTUNE_CONFIG_ENV] = Path(experiment.generated_neptune_config).text()
+            config_path = str(Path(experiment.cwd).relpathto(experiment.generated_neptune_config))
+            command = ['sh', '-c', 'mkdir -p "$(dirname "$0")" && printf "%s" "${}" > "$0" && exec "$@"'.format(
+                NEPTUNE_CONFIG_ENV), config_path] + rewrite_paths(experiment.cwd, experiment.cmd_without_params)
+        if tasks_count:
+            # each pod runs command of its task (env and command line are in task script)
+            tasks_volume_name = 'experiment-tasks'
+            volumes.append(client.V1Volume(name=tasks_volume_name, config_map=client.V1ConfigMapVolumeSource(
+                name=name)))
+            volume_mounts.append(client.V1VolumeMount(mount_path=self.TASKS_MOUNT_PATH, name=tasks_volume_name,
+                                                      read_only=True))
+            command, args = ['sh', '-c', '. {}/"$JOB_COMPLETION_INDEX"'.format(self.TASKS_MOUNT_PATH)], None
+            envs = {}
+
+        ctr = client.V1Container(name=name, image=image, command=command, args=args,
+                                 volume_mounts=volume_mounts,
                                  resources=client.V1ResourceRequirements(
                                      limits={k: v for k, v in resources.items()}),
                                  env=[client.V1EnvVar(name=k, value=v) for k, v in envs.items()])
-        pod_spec = client.V1PodSpec(restart_policy='Never', containers=[ctr], volumes=[vol])
-        pod_template = client.V1PodTemplateSpec(spec=pod_spec)
-        job_spec = client.V1JobSpec(template=pod_template, backoff_limit=0)  # , active_deadline_seconds=100)
-        super(Job, self).__init__(metadata=client.V1ObjectMeta(name=name), spec=job_spec)
+        pod_spec = client.V1PodSpec(restart_policy='Never', containers=[ctr], volumes=volumes)
+        pod_template = client.V1PodTemplateSpec(metadata=client.V1ObjectMeta(labels=MANAGED_BY_LABELS),
+                                                spec=pod_spec)
+        if tasks_count:
+            # failed tasks are retried; sweep fails after as many failures as there are tasks
+            job_spec = client.V1JobSpec(template=pod_template, completion_mode='Indexed', completions=tasks_count,
+                                        parallelism=parallelism or tasks_count, backoff_limit=tasks_count)
+        else:
+            job_spec = client.V1JobSpec(template=pod_template, backoff_limit=0)  # , active_deadline_seconds=100)
+        super(Job, self).__init__(metadata=client.V1ObjectMeta(name=name, labels=MANAGED_BY_LABELS), spec=job_spec)
 
     def _map_resources(self, resource_name, resource_qty):
         name = self.RESOURCE_NAME_MAP[resource_name]
@@ -93,6 +145,38 @@ class Job(client.V1Job):
         return re.sub(r'[ .,_=-]+', '-', arg)
 
 
+class TasksConfigMap(client.V1ConfigMap):
+    """
+    Per-sweep table of tasks of Indexed Job; key is completion index, value - shell script (env and command);
+    generated neptune configs are stored under their (content hash based) file names, each one once
+    """
+    MAX_SIZE = 1000 * 1000  # ConfigMap size is limited to 1MiB
+
+    def __init__(self, name, experiments):
+        data = {}
+        for index, experiment in enumerate(experiments):
+            envs = experiment.env.copy()
+            envs.update(experiment.cmd.env if experiment.cmd else {})
+            exports = [shell_export(k, v) for k, v in sorted(envs.items())]
+            argv = rewrite_paths(experiment.cwd, experiment.cmd_without_params) + experiment.params
+            command = ' '.join(shlex.quote(arg) for arg in argv)
+            setup = []
+            if experiment.generated_neptune_config:
+                config_key = str(Path(experiment.generated_neptune_config).name)
+                config_path = shlex.quote(str(Path(experiment.cwd).relpathto(experiment.generated_neptune_config)))
+                if config_key not in data:
+                    data[config_key] = Path(experiment.generated_neptune_config).text()
+                setup = ['mkdir -p "$(dirname {path})" && cp {tasks_dir}/{key} {path};'.format(
+                    path=config_path, tasks_dir=Job.TASKS_MOUNT_PATH, key=config_key)]
+            data[str(index)] = ' '.join(exports + setup + ['exec', command])
+
+        size = sum(len(k) + len(v) for k, v in data.items())
+        if size > self.MAX_SIZE:
+            raise ValueError('Sweep description is too large ({} bytes) to submit as single job; '
+                             'split it into smaller ones'.format(size))
+        super(TasksConfigMap, self).__init__(metadata=client.V1ObjectMeta(name=name), data=data)
+
+
 class StandardPVC(client.V1PersistentVolumeClaim):
 
     def __init__(self, name, size, access_mode):
@@ -174,29 +258,137 @@ class NFSPvc(client.V1PersistentVolumeClaim):
         super(NFSPvc, self).__init__(metadata=client.V1ObjectMeta(name=name), spec=pvc_spec)
 
 
+KubernetesDeployment = attr.make_class('KubernetesDeployment', ['experiment', 'built_image', 'image'], frozen=True)
+
+
 class KubernetesBackend(object):
+    # experiments submitted as single Indexed Job shall share image and job spec
+    ARRAY_COMMON_FIELDS = ['project', 'registry_url', 'base_image', 'requirements', 'cwd', 'exclude', 'paths_to_copy',
+                           'resources', 'storage_dir', 'default_pvc_size']
     DEFAULT_STORAGE_PVC_SIZE = '40G'
     DEFAULT_STORAGE_PVC_NAME = 'storage'
     NFS_PVC_NAME = 'nfs'
 
     def __init__(self):
+        # backend is session scoped - clients are created and cluster configuration is ensured once per session
         self._check_env()
         config.load_kube_config()
+        _, active_context = config.list_kube_config_contexts()
+        self.cluster_name = active_context['context']['cluster']
         self.core_api = client.CoreV1Api()
         self.batch_api = client.BatchV1Api()
         self.apps_api = client.AppsV1Api()
+        self.docker_engine = DockerEngine()
 
-    def run(self, experiment):
-        experiment = ExperimentRunOnKubernetes(**filter_only_attr(ExperimentRunOnKubernetes, experiment))
-        image = DockerEngine().build_and_publish_image(experiment=experiment)
+        self._lock = threading.Lock()
+        self._projects_locks = {}
+        self._configured_projects = set()
+        self._submitted_jobs = []
+        self.api_calls = Counter()  # number of API server calls by verb
+        get_paths_to_copy.cache_clear()  # listings of code are memoized within backend session
 
-        self.configure_namespace(experiment)
-        self.configure_storage_for_project(experiment)
+    @staticmethod
+    def get_neptune_token(experiment):
+        """Neptune token used by experiments on cluster (it is baked into image)"""
+        return NeptuneToken()
 
-        for experiment in [experiment, ]:
-            job = Job(image, experiment)
-            job_name = job.to_dict()['metadata']['name']
-            self._ensure_resource('job', experiment.namespace, job_name, job)
+    @staticmethod
+    def query_states(context, job_ids):
+        """Returns {job id: state} of given jobs (namespace/job or namespace/job/index for sweep tasks); pods
+        are listed with single call per namespace. Failed sweep task is reported as failed only once its job is
+        finished (till then it may be retried); jobs without pods are not reported, unless their sweep is finished"""
+        config.load_kube_config()
+        tracker = JobsWatcher(client.CoreV1Api(), client.BatchV1Api(), MANAGED_BY_LABEL_SELECTOR).snapshot(job_ids)
+        return tracked_states(tracker)
+
+    def run(self, experiment):
+        return self.submit(self.upload(self.package(experiment)))
+
+    def package(self, experiment):
+        """Builds docker image with experiment code"""
+        experiment = ExperimentRunOnKubernetes(**filter_only_attr(ExperimentRunOnKubernetes, experiment))
+        built_image = self.docker_engine.build_image(experiment=experiment)
+        return KubernetesDeployment(experiment=experiment, built_image=built_image, image=None)
+
+    def upload(self, deployment):
+        image = self.docker_engine.publish_image(deployment.built_image)
+        return attr.evolve(deployment, built_image=None, image=image)
+
+    def submit(self, deployment):
+        experiment = deployment.experiment
+        self.configure_project(experiment)
+
+        job = Job(deployment.image, experiment)
+        job_name = job.metadata.name
+        self._ensure_resource('job', experiment.namespace, job_name, job)
+        LOGGER.debug('Kubernetes API calls so far: {}'.format(dict(self.api_calls)))
+        job_id = '{}/{}'.format(experiment.namespace, job_name)
+        with self._lock:
+            self._submitted_jobs.append(job_id)
+        return job_id
+
+    def run_array(self, experiments, parallelism=None):
+        """Submits whole sweep as single Indexed Job; image is built once and experiments are described
+        by per-sweep ConfigMap. Returns ids (namespace/job/index) of experiments"""
+        if not experiments:
+            return []
+        # image is built for (not converted) experiment as in package-upload-submit path
+        first_experiment = experiments[0]
+        experiments = [ExperimentRunOnKubernetes(**filter_only_attr(ExperimentRunOnKubernetes, e))
+                       for e in experiments]
+
+        for field in self.ARRAY_COMMON_FIELDS:
+            values = {str(getattr(e, field)) for e in experiments}
+            if len(values) > 1:
+                raise ValueError('Experiments submitted as indexed job shall have same "{}" (got: {})'.format(
+                    field, ', '.join(sorted(values))))
+
+        # experiments share image; generated neptune configs are passed in tasks ConfigMap
+        deployment = self.upload(self.package(first_experiment))
+        sweep = deployment.experiment
+        self.configure_project(sweep)
+
+        job = Job(deployment.image, sweep, tasks_count=len(experiments), parallelism=parallelism)
+        job_name = job.metadata.name
+        self._ensure_resource('cm', sweep.namespace, job_name, TasksConfigMap(job_name, experiments))
+        # existing job (ex. created by retried request) is read, so tasks are owned by it anyway
+        _, created_job = self._ensure_resource('job', sweep.namespace, job_name, job, fetch=True)
+
+        # remove tasks together with job
+        owner = client.V1OwnerReference(api_version='batch/v1', kind='Job', name=job_name,
+                                        uid=created_job.metadata.uid)
+        self._call('patch', self.core_api.patch_namespaced_config_map, name=job_name, namespace=sweep.namespace,
+                   body={'metadata': {'ownerReferences': [self.core_api.api_client.sanitize_for_serialization(owner)]}})
+        LOGGER.info('Submitted {} experiments as indexed job {}'.format(len(experiments), job_name))
+        LOGGER.debug('Kubernetes API calls so far: {}'.format(dict(self.api_calls)))
+        job_ids = ['{}/{}/{}'.format(sweep.namespace, job_name, index) for index in range(len(experiments))]
+        with self._lock:
+            self._submitted_jobs.extend(job_ids)
+        return job_ids
+
+    def wait(self, job_ids=None, timeout=None):
+        """Waits for given jobs (by default all submitted in backend session) without polling - pods of all of
+        them are tracked with single watch stream. Returns JobResult (exit code and timing) of each job finished
+        before timeout (in seconds)"""
+        with self._lock:
+            job_ids = list(job_ids if job_ids is not None else self._submitted_jobs)
+        if not job_ids:
+            return []
+        results = JobsWatcher(self.core_api, self.batch_api, MANAGED_BY_LABEL_SELECTOR).wait(job_ids, timeout=timeout)
+        failed = [r for r in results.values() if r.returncode != 0]
+        LOGGER.info('{} experiments finished ({} failed)'.format(len(results), len(failed)))
+        return [results[job_id] for job_id in job_ids if job_id in results]
+
+    def configure_project(self, experiment):
+        """Ensures project namespace and storage; done only once per (cluster, namespace) in backend session"""
+        key = (self.cluster_name, experiment.namespace)
+        with self._lock:
+            lock = self._projects_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._configured_projects:
+                self.configure_namespace(experiment)
+                self.configure_storage_for_project(experiment)
+                self._configured_projects.add(key)
 
     def configure_namespace(self, experiment):
         namespace = client.V1Namespace(metadata=client.V1ObjectMeta(name=experiment.namespace))
@@ -213,58 +405,59 @@ class KubernetesBackend(object):
                                           access_mode="ReadWriteOnce"))
         self._ensure_resource('dep', experiment.namespace, nfs_svc_name,
                               NFSDeployment(name=nfs_svc_name, storage_pvc=self.DEFAULT_STORAGE_PVC_NAME))
-        _, nfs_svc = self._ensure_resource('svc', experiment.namespace, nfs_svc_name, NFSSvc(name=nfs_svc_name))
+        _, nfs_svc = self._ensure_resource('svc', experiment.namespace, nfs_svc_name, NFSSvc(name=nfs_svc_name),
+                                           fetch=True)
 
         nfs_svc_ip = nfs_svc.spec.cluster_ip
-        _, nfs_pv = self._ensure_resource('pv', None, nfs_pv_name, NFSPv(nfs_pv_name, nfs_svc_ip))
+        _, nfs_pv = self._ensure_resource('pv', None, nfs_pv_name, NFSPv(nfs_pv_name, nfs_svc_ip), fetch=True)
         if nfs_pv.spec.nfs.server != nfs_svc_ip:
-            nfs_pv.spec.source.server = nfs_svc_ip
-            self.core_api.patch_persistent_volume(nfs_pv_name, nfs_pv)
-            LOGGER.warning('pv/{}: patched NFS server ip (current={})', nfs_pv_name, nfs_svc_ip)
+            # PV spec is immutable, so it can't be updated in place
+            LOGGER.warning('pv/{name} refers to NFS server {old} while its service ip is {new}; delete it '
+                           '(kubectl delete pv {name}) to have it recreated'.format(
+                               name=nfs_pv_name, old=nfs_pv.spec.nfs.server, new=nfs_svc_ip))
         self._ensure_resource('pvc', experiment.namespace, self.NFS_PVC_NAME, NFSPvc(name=self.NFS_PVC_NAME))
 
-    def _ensure_resource(self, resource_type, namespace, name, resource_body):
-        list_kwargs = {'field_selector': 'metadata.name={}'.format(name)}
-        create_kwargs = {'body': resource_body}
-
-        if namespace:
-            list_kwargs['namespace'] = namespace
-            create_kwargs['namespace'] = namespace
-
-        list_fun, create_fun = {
-            'dep': (self.apps_api.list_namespaced_deployment, self.apps_api.create_namespaced_deployment),
-            'job': (self.batch_api.list_namespaced_job, self.batch_api.create_namespaced_job),
-            'namespace': (self.core_api.list_namespace, self.core_api.create_namespace),
-            'pod': (self.core_api.list_namespaced_pod, self.core_api.create_namespaced_pod),
-            'pv': (self.core_api.list_persistent_volume, self.core_api.create_persistent_volume),
-            'pvc': (self.core_api.list_namespaced_persistent_volume_claim,
-                    self.core_api.create_namespaced_persistent_volume_claim),
-            'svc': (self.core_api.list_namespaced_service, self.core_api.create_namespaced_service),
-        }[resource_type]
-        response = list_fun(**list_kwargs)
-        if not response.items:
-            resource = create_fun(**create_kwargs)
+    def _ensure_resource(self, resource_type, namespace, name, resource_body, fetch=False):
+        """Creates resource optimistically; if it already exists (409 Conflict) existing resource is read
+        only when fetch is set. Returns (existed, resource) pair."""
+        kwargs = {'namespace': namespace} if namespace else {}
+        create_fun, read_fun = self._resource_api(resource_type)
+
+        try:
+            resource = self._call('create', create_fun, body=resource_body, **kwargs)
             LOGGER.debug('{}/{} created ({})'.format(resource_type, name, resource.to_str()))
-        else:
-            resource = response.items[0]
-            LOGGER.debug('{}/{} exists'.format(resource_type, name))
-        return bool(response.items), resource
+            return False, resource
+        except ApiException as e:
+            if e.status != 409:
+                raise
+
+        LOGGER.debug('{}/{} exists'.format(resource_type, name))
+        resource = self._call('read', read_fun, name=name, **kwargs) if fetch else None
+        return True, resource
+
+    def _resource_api(self, resource_type):
+        return {
+            'dep': (self.apps_api.create_namespaced_deployment, self.apps_api.read_namespaced_deployment),
+            'job': (self.batch_api.create_namespaced_job, self.batch_api.read_namespaced_job),
+            'namespace': (self.core_api.create_namespace, self.core_api.read_namespace),
+            'pod': (self.core_api.create_namespaced_pod, self.core_api.read_namespaced_pod),
+            'pv': (self.core_api.create_persistent_volume, self.core_api.read_persistent_volume),
+            'pvc': (self.core_api.create_namespaced_persistent_volume_claim,
+                    self.core_api.read_namespaced_persistent_volume_claim),
+            'svc': (self.core_api.create_namespaced_service, self.core_api.read_namespaced_service),
+            'cm': (self.core_api.create_namespaced_config_map, self.core_api.read_namespaced_config_map),
+        }[resource_type]
+
+    def _call(self, verb, fun, **kwargs):
+        with self._lock:
+            self.api_calls[verb] += 1
+        return fun(**kwargs)
 
     @staticmethod
     def _check_env():
-        import subprocess
-
-        try:
-            from subprocess import DEVNULL  # py3k
-        except ImportError:
-            import os
-            DEVNULL = open(os.devnull, 'wb')
+        from shutil import which
 
-        result = 0
         for cmd, link in [('kubectl', 'https://kubernetes.io/docs/tasks/tools/install-kubectl'),
                           ('gcloud', 'https://cloud.google.com/sdk/docs/quickstarts')]:
-            try:
-                subprocess.call(cmd, stdout=DEVNULL, stderr=DEVNULL)
-            except OSError:
+            if not which(cmd):
                 raise RuntimeError('Missing {} cmd. Please install and setup it first: {}'.format(cmd, link))
-        return result
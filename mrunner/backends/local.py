@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+
+import attr
+from path import Path
+
+from mrunner.experiment import COMMON_EXPERIMENT_MANDATORY_FIELDS, COMMON_EXPERIMENT_OPTIONAL_FIELDS
+from mrunner.utils.namesgenerator import id_generator
+from mrunner.utils.neptune import NeptuneToken
+from mrunner.utils.process_pool import ProcessPool, ResourceSlots
+from mrunner.utils.utils import make_attr_class, filter_only_attr, parse_size
+
+LOGGER = logging.getLogger(__name__)
+
+EXPERIMENT_DIR_RANDOM_SUFIX_SIZE = 10
+DEFAULT_CPU_REQUEST = 1
+
+
+def generate_experiment_dir(experiment):
+    experiment_subdir = '{name}_{random_id}'.format(name=experiment.name,
+                                                    random_id=id_generator(EXPERIMENT_DIR_RANDOM_SUFIX_SIZE))
+    return Path(experiment.storage_dir) / experiment.project / experiment_subdir
+
+
+def _total_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+EXPERIMENT_OPTIONAL_FIELDS = [
+    ('experiment_dir', dict(default=attr.Factory(generate_experiment_dir, takes_self=True))),
+    ('max_cpus', dict(default=None)),  # resources of machine shared by experiments (by default: all of them)
+    ('max_mem', dict(default=None)),
+    ('forkserver_preload', dict(default=None, type=list)),  # modules imported once by forkserver (ex. [numpy])
+]
+
+EXPERIMENT_FIELDS = COMMON_EXPERIMENT_MANDATORY_FIELDS + COMMON_EXPERIMENT_OPTIONAL_FIELDS + EXPERIMENT_OPTIONAL_FIELDS
+
+ExperimentRunLocally = make_attr_class('ExperimentRunLocally', EXPERIMENT_FIELDS, frozen=True)
+
+LocalDeployment = attr.make_class('LocalDeployment', ['experiment'], frozen=True)
+
+
+class LocalBackend(object):
+    """Runs experiments on local machine, concurrently as long as there are free cpu and mem slots
+    (requested with `resources` key); output of experiment is written into experiment_dir"""
+    LOG_FILE_NAME = 'output.log'
+
+    def __init__(self):
+        # pool is created with configuration of first experiment
+        self._lock = threading.Lock()
+        self._slots = None
+        self._pool = None
+
+    @staticmethod
+    def get_neptune_token(experiment):
+        """Neptune token used by experiments (they are run on this machine)"""
+        return NeptuneToken()
+
+    def run(self, experiment):
+        return self.submit(self.upload(self.package(experiment)))
+
+    def package(self, experiment):
+        experiment = ExperimentRunLocally(**filter_only_attr(ExperimentRunLocally, experiment))
+        experiment.experiment_dir.makedirs_p()
+        return LocalDeployment(experiment=experiment)
+
+    def upload(self, deployment):
+        # experiments are run from current directory
+        return deployment
+
+    def submit(self, deployment):
+        """Starts experiment as soon as there are free resources for it (blocks till then)"""
+        experiment = deployment.experiment
+        env = experiment.cmd.env.copy() if experiment.cmd else {}
+        env.update(experiment.env)
+        env = {k: os.path.expandvars(str(v)) for k, v in env.items()}
+
+        log_path = experiment.experiment_dir / self.LOG_FILE_NAME
+        pool = self._get_pool(experiment)
+        resources = self._get_resources(experiment)
+        if 'tasks' in self._slots.capacity:
+            resources['tasks'] = 1
+        pool.submit(name=str(experiment.experiment_dir.name), command=experiment.cmd.command, env=env,
+                    cwd=experiment.cwd, log_path=log_path, resources=resources)
+        return experiment.experiment_dir
+
+    def run_array(self, experiments, parallelism=None):
+        """Runs all experiments (use wait to wait for them); parallelism limits number of concurrently run ones"""
+        experiments_dirs = []
+        for experiment in experiments:
+            deployment = self.upload(self.package(experiment))
+            self._get_pool(deployment.experiment, parallelism=parallelism)
+            experiments_dirs.append(self.submit(deployment))
+        return experiments_dirs
+
+    def wait(self):
+        """Waits for all submitted experiments; returns their results"""
+        results = self._pool.wait() if self._pool else []
+        failed = [r for r in results if r.returncode != 0]
+        LOGGER.info('{} experiments finished ({} failed)'.format(len(results), len(failed)))
+        return results
+
+    def _get_pool(self, experiment, parallelism=None):
+        with self._lock:
+            if self._pool is None:
+                capacity = dict(cpu=int(experiment.max_cpus or os.cpu_count()),
+                                mem=parse_size(experiment.max_mem) or _total_memory())
+                if parallelism:
+                    capacity['tasks'] = parallelism
+                slots = ResourceSlots(**capacity)
+                LOGGER.info('Running experiments locally using {} cpus and {:.1f}GB of memory'.format(
+                    slots.capacity['cpu'], slots.capacity['mem'] / 2. ** 30))
+                self._slots = slots
+                self._pool = ProcessPool(slots, preload=experiment.forkserver_preload)
+            return self._pool
+
+    @staticmethod
+    def _get_resources(experiment):
+        resources = experiment.resources
+        return {'cpu': int(resources.get('cpu', DEFAULT_CPU_REQUEST)), 'mem': parse_size(resources.get('mem', 0))}
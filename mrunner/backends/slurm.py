@@ -1,22 +1,22 @@
 # -*- coding: utf-8 -*-
 import logging
+import re
 import socket
-import tarfile
-import tempfile
+import threading
 
 import attr
-from fabric.api import run as fabric_run
-from fabric.context_managers import cd
-from fabric.contrib.project import rsync_project
-from fabric.state import env
 from paramiko.agent import Agent
 from path import Path
 
 from mrunner.experiment import COMMON_EXPERIMENT_MANDATORY_FIELDS, COMMON_EXPERIMENT_OPTIONAL_FIELDS
 from mrunner.plgrid import PLGRID_USERNAME, PLGRID_HOST, PLGRID_TESTING_PARTITION
+from mrunner.utils.archive import ArchiveCodec, stream_archive
+from mrunner.utils.journal import PENDING, RUNNING, DONE, FAILED
 from mrunner.utils.namesgenerator import id_generator
 from mrunner.utils.neptune import NeptuneToken
-from mrunner.utils.utils import GeneratedTemplateFile, get_paths_to_copy, make_attr_class, filter_only_attr
+from mrunner.utils.ssh import get_transport
+from mrunner.utils.utils import GeneratedTemplateFile, PathToDump, get_code_paths, get_paths_to_copy, \
+    get_paths_digest, make_attr_class, filter_only_attr, shell_export
 
 LOGGER = logging.getLogger(__name__)
 RECOMMENDED_CPUS_NUMBER = 4
@@ -61,7 +61,10 @@ EXPERIMENT_OPTIONAL_FIELDS = [
     ('modules_to_load', dict(default=attr.Factory(list), type=list)),
     ('after_module_load_cmd', dict(default='')),
     ('cmd_type', dict(default='srun')),
-    ('requirements_file', dict(default=(None)))
+    ('requirements_file', dict(default=(None))),
+    ('force_upload', dict(default=False)),  # upload code even if it is already in cache
+    ('archive_codec', dict(default='auto')),  # none, gzip[:level], zstd[:level[:threads]] or auto
+    ('link_speed', dict(default=None)),  # in Mbit/s; used to choose archive codec
 ]
 
 EXPERIMENT_FIELDS = COMMON_EXPERIMENT_MANDATORY_FIELDS + EXPERIMENT_MANDATORY_FIELDS + \
@@ -69,20 +72,56 @@ EXPERIMENT_FIELDS = COMMON_EXPERIMENT_MANDATORY_FIELDS + EXPERIMENT_MANDATORY_FI
 
 ExperimentRunOnSlurm = make_attr_class('ExperimentRunOnSlurm', EXPERIMENT_FIELDS, frozen=True)
 
+# fields which shall be same for all experiments submitted as single job array
+ARRAY_COMMON_FIELDS = ['slurm_url', 'project', 'user_id', 'venv', 'partition', 'account', 'time', 'ntasks',
+                       'resources', 'modules_to_load', 'after_module_load_cmd', 'requirements_file']
+ARRAY_TASKS_FILE_NAME = 'mrunner_tasks.sh'
+SBATCH_JOB_ID_RE = re.compile(r'Submitted batch job (\d+)')
+# sacct reports not yet started array tasks as single record, ex. 123_[4-7,9%2]
+SACCT_ARRAY_RE = re.compile(r'^(\d+)_\[([\d,\-]+)(?:%\d+)?\]$')
+# jobs held for requeue, suspended or stopped are not finished; states which are not known here are not reported
+# (jobs stay in their last recorded, not final state and are queried again)
+SLURM_STATES = {'PENDING': PENDING, 'REQUEUED': PENDING, 'REQUEUE_HOLD': PENDING, 'REQUEUE_FED': PENDING,
+                'SPECIAL_EXIT': PENDING, 'PREEMPTED': PENDING, 'CONFIGURING': PENDING, 'RESIZING': PENDING,
+                'RUNNING': RUNNING, 'COMPLETING': RUNNING, 'SUSPENDED': RUNNING, 'STOPPED': RUNNING,
+                'STAGE_OUT': RUNNING, 'SIGNALING': RUNNING,
+                'COMPLETED': DONE,
+                'FAILED': FAILED, 'CANCELLED': FAILED, 'TIMEOUT': FAILED, 'NODE_FAIL': FAILED, 'OUT_OF_MEMORY': FAILED,
+                'BOOT_FAIL': FAILED, 'DEADLINE': FAILED, 'REVOKED': FAILED}
+CODE_CACHE_SUBDIR = '.cache'
+
+
+def _merge_env(experiment):
+    env = experiment.cmd.env.copy() if experiment.cmd else {}
+    env.update(experiment.env)
+    return {k: str(v) for k, v in env.items()}
+
+
+def _remote_config_path(experiment, config):
+    """Path of generated neptune config in experiment directory (it is placed there relative to cwd)"""
+    return Path(config).relpath(experiment.cwd)
+
+
+def _experiment_command(experiment):
+    """Command run from experiment directory - generated neptune config is given with path relative to it"""
+    command = experiment.cmd.command
+    config = experiment.generated_neptune_config
+    if config and Path(config).isabs():
+        command = command.replace('--config {}'.format(config),
+                                  '--config {}'.format(_remote_config_path(experiment, config)))
+    return command
+
 
 class ExperimentScript(GeneratedTemplateFile):
     DEFAULT_SLURM_EXPERIMENT_SCRIPT_TEMPLATE = 'slurm_experiment.sh.jinja2'
 
-    def __init__(self, experiment):
-        # merge env vars
-        env = experiment.cmd.env.copy() if experiment.cmd else {}
-        env.update(experiment.env)
-        env = {k: str(v) for k, v in env.items()}
-
-        experiment = attr.evolve(experiment, env=env, experiment_scratch_dir=experiment.experiment_scratch_dir)
+    def __init__(self, experiment, **kwargs):
+        experiment = attr.evolve(experiment, env=_merge_env(experiment),
+                                 experiment_scratch_dir=experiment.experiment_scratch_dir)
 
         super(ExperimentScript, self).__init__(template_filename=self.DEFAULT_SLURM_EXPERIMENT_SCRIPT_TEMPLATE,
-                                               experiment=experiment)
+                                               experiment=experiment, command=_experiment_command(experiment),
+                                               **kwargs)
         self.experiment = experiment
         self.path.chmod('a+x')
 
@@ -92,11 +131,70 @@ class ExperimentScript(GeneratedTemplateFile):
         return '{}.sh'.format(e.experiment_scratch_dir.relpath(e.project_scratch_dir))
 
 
+class ArrayExperimentScript(ExperimentScript):
+    """Job array script; each array task picks its row from tasks table by SLURM_ARRAY_TASK_ID"""
+    DEFAULT_SLURM_EXPERIMENT_SCRIPT_TEMPLATE = 'slurm_array_experiment.sh.jinja2'
+
+    def __init__(self, experiment, tasks_file_name):
+        super(ArrayExperimentScript, self).__init__(experiment, tasks_file_name=tasks_file_name)
+
+
+def _parse_job_id(sbatch_output):
+    """Extracts job id from sbatch output (None for srun, which doesn't report it)"""
+    match = SBATCH_JOB_ID_RE.search(sbatch_output or '')
+    return match.group(1) if match else None
+
+
+def parse_job_states(output):
+    """Parses `sacct -P -o JobID,State` (or `squeue -o '%i|%T'`) output into {job id: state}"""
+    states = {}
+    for line in output.splitlines():
+        if '|' not in line:
+            continue
+        job_id, slurm_state = line.strip().split('|')[:2]
+        # ex. 'CANCELLED by 123'
+        slurm_state = slurm_state.split(' ')[0].rstrip('+')
+        if slurm_state not in SLURM_STATES:
+            LOGGER.debug('Unknown state {} of slurm job {}'.format(slurm_state, job_id))
+            continue
+        state = SLURM_STATES[slurm_state]
+        match = SACCT_ARRAY_RE.match(job_id)
+        if not match:
+            states[job_id] = state
+            continue
+        for tasks_range in match.group(2).split(','):
+            first, _, last = tasks_range.partition('-')
+            for task_id in range(int(first), int(last or first) + 1):
+                states['{}_{}'.format(match.group(1), task_id)] = state
+    return states
+
+
+def array_tasks_configs(experiments):
+    """Generated neptune configs of array tasks placed in their directories (named by task index) relative to cwd,
+    as they are referred by tasks commands"""
+    configs = []
+    for index, experiment in enumerate(experiments):
+        config = experiment.generated_neptune_config
+        if config:
+            configs.append(PathToDump(Path(config), Path(str(index)) / _remote_config_path(experiment, config)))
+    return configs
+
+
+def render_array_tasks(experiments):
+    """Per-sweep table with one shell line (env and command) per array task"""
+    lines = []
+    for experiment in experiments:
+        exports = [shell_export(k, v) for k, v in sorted(_merge_env(experiment).items())]
+        lines.append(' '.join(exports + [_experiment_command(experiment)]))
+    return '\n'.join(lines + ['']).encode(encoding='utf-8')
+
+
 class SlurmWrappersCmd(object):
 
-    def __init__(self, experiment, script_path):
+    def __init__(self, experiment, script_path, array=None):
         self._experiment = experiment
         self._script_path = script_path
+        self._array = array
 
     @property
     def command(self):
@@ -115,11 +213,15 @@ class SlurmWrappersCmd(object):
             elif default:
                 cmd_items += [option, default]
 
-        default_log_path = self._experiment.experiment_scratch_dir / 'slurm.log' if self._cmd == 'sbatch' else None
+        # array tasks are run in their own directories (named by task index)
+        log_name = '%a/slurm.log' if self._array else 'slurm.log'
+        default_log_path = self._experiment.experiment_scratch_dir / log_name if self._cmd == 'sbatch' else None
         _extend_cmd_items(cmd_items, '-A', 'account')
         _extend_cmd_items(cmd_items, '-o', 'log_output_path', default_log_path)  # output
         _extend_cmd_items(cmd_items, '-p', 'partition')
         _extend_cmd_items(cmd_items, '-t', 'time')
+        if self._array:
+            cmd_items += ['--array', self._array]
 
         cmd_items += self._resources_items()
         cmd_items += [self._script_path]
@@ -184,67 +286,212 @@ class SlurmNeptuneToken(NeptuneToken):
         super(SlurmNeptuneToken, self).__init__(profile=profile_name)
 
 
+SlurmDeployment = attr.make_class('SlurmDeployment', ['experiment', 'paths_to_dump', 'code_digest', 'script_path'],
+                                  frozen=True)
+
+
 class SlurmBackend(object):
 
-    def run(self, experiment):
+    def __init__(self):
         assert Agent().get_keys(), "Add your private key to ssh agent using 'ssh-add' command"
+        self._lock = threading.Lock()
+        self._code_digests = {}
+        self._cached_code_dirs = {}  # remote cache dir -> lock guarding its upload
+        self._uploaded_code_dirs = set()
+        self._remote_zstd = {}  # slurm url -> is zstd available there
+        get_paths_to_copy.cache_clear()  # listings of code are memoized within backend session
 
-        # configure fabric
-        slurm_url = experiment.pop('slurm_url', '{}@{}'.format(PLGRID_USERNAME, PLGRID_HOST))
-        env['host_string'] = slurm_url
-        slurm_scratch_dir = experiment['storage_dir']
-        experiment = ExperimentRunOnSlurm(slurm_scratch_dir=slurm_scratch_dir, slurm_url=slurm_url,
-                                          **filter_only_attr(ExperimentRunOnSlurm, experiment))
-        LOGGER.debug('Configuration: {}'.format(experiment))
+    @staticmethod
+    def get_neptune_token(experiment):
+        """Neptune token used by experiments on cluster"""
+        return SlurmNeptuneToken(experiment)
 
+    @staticmethod
+    def query_states(context, job_ids):
+        """Returns {job id: state} of given jobs (and array tasks); all are queried with single sacct call"""
+        slurm_url = context.get('slurm_url', '{}@{}'.format(PLGRID_USERNAME, PLGRID_HOST))
+        jobs = ','.join(sorted({job_id.split('_')[0] for job_id in job_ids}))
+        transport = get_transport(slurm_url)
+        try:
+            output = transport.run('sacct -n -X -P -o JobID,State -j {}'.format(jobs))
+        except RuntimeError as e:
+            # accounting may be disabled on cluster; squeue knows only about not finished jobs
+            LOGGER.debug('sacct failed ({}); falling back to squeue'.format(e))
+            output = transport.run("squeue -h -r -o '%i|%T' -j {}".format(jobs))
+        states = parse_job_states(output)
+        return {job_id: states[job_id] for job_id in job_ids if job_id in states}
+
+    def run(self, experiment):
+        return self.submit(self.upload(self.package(experiment)))
+
+    def package(self, experiment):
+        """Prepares experiment configuration and computes content hash of code to deploy"""
+        experiment = self._create_experiment(experiment)
+        paths_to_dump, code_digest = self._get_code(experiment)
+        return SlurmDeployment(experiment=experiment, paths_to_dump=paths_to_dump, code_digest=code_digest,
+                               script_path=None)
+
+    def upload(self, deployment):
+        experiment = deployment.experiment
         self.ensure_directories(experiment)
         self.deploy_neptune_token(experiment=experiment)
-        script_path = self.deploy_code(experiment)
+        script_path = self.deploy_code(experiment, deployment.paths_to_dump, deployment.code_digest)
+        return attr.evolve(deployment, paths_to_dump=None, script_path=script_path)
+
+    def submit(self, deployment):
+        experiment = deployment.experiment
         SCmd = {'sbatch': SBatchWrapperCmd, 'srun': SRunWrapperCmd}[experiment.cmd_type]
-        cmd = SCmd(experiment=experiment, script_path=script_path)
-        self._fabric_run(cmd.command)
+        cmd = SCmd(experiment=experiment, script_path=deployment.script_path)
+        return _parse_job_id(self._run(experiment, cmd.command))
+
+    def run_array(self, experiments, parallelism=None):
+        """Submits whole sweep as single job array; code is uploaded once and experiments are described
+        by per-sweep tasks table. Returns slurm ids (<job id>_<task id>) of experiments"""
+        experiments = [self._create_experiment(experiment) for experiment in experiments]
+        if not experiments:
+            return []
+
+        # experiments share scratch directory, script and sbatch options of first one; each one is run in its own
+        # subdirectory of it
+        sweep = attr.evolve(experiments[0], cmd_type='sbatch')
+        for field in ARRAY_COMMON_FIELDS:
+            values = {str(getattr(e, field)) for e in experiments}
+            if len(values) > 1:
+                raise ValueError('Experiments submitted as job array shall have same "{}" (got: {})'.format(
+                    field, ', '.join(sorted(values))))
+
+        self.ensure_directories(sweep)
+        self.deploy_neptune_token(experiment=sweep)
+        paths_to_dump, code_digest = self._get_code(sweep)
+        script_path = self.deploy_code(sweep, paths_to_dump, code_digest, tasks=experiments)
+
+        array = '0-{}'.format(len(experiments) - 1)
+        if parallelism:
+            array += '%{}'.format(parallelism)
+        cmd = SBatchWrapperCmd(experiment=sweep, script_path=script_path, array=array)
+        LOGGER.info('Submitting {} experiments as job array'.format(len(experiments)))
+        job_id = _parse_job_id(self._run(sweep, cmd.command))
+        return ['{}_{}'.format(job_id, index) if job_id else None for index in range(len(experiments))]
 
     def ensure_directories(self, experiment):
-        self._ensure_dir(experiment.experiment_scratch_dir)
-        self._ensure_dir(experiment.storage_dir)
-
-    def deploy_code(self, experiment):
-        paths_to_dump = get_paths_to_copy(exclude=experiment.exclude, paths_to_copy=experiment.paths_to_copy)
-        with tempfile.NamedTemporaryFile(suffix='.tar.gz') as temp_file:
-            # archive all files
-            with tarfile.open(temp_file.name, 'w:gz') as tar_file:
-                for p in paths_to_dump:
-                    LOGGER.debug('Adding "{}" to deployment archive'.format(p.rel_remote_path))
-                    tar_file.add(p.local_path, arcname=p.rel_remote_path)
-
-            # upload archive to cluster and extract
-            self._put(temp_file.name, experiment.experiment_scratch_dir)
-            with cd(experiment.experiment_scratch_dir):
-                archive_remote_path = experiment.experiment_scratch_dir / Path(temp_file.name).name
-                self._fabric_run('tar xf {tar_filename} && rm {tar_filename}'.format(tar_filename=archive_remote_path))
-
-        # create and upload experiment script
-        script = ExperimentScript(experiment)
+        self._ensure_dir(experiment, experiment.experiment_scratch_dir, experiment.storage_dir)
+
+    def deploy_code(self, experiment, paths_to_dump, code_digest, tasks=None):
+        cached_code_dir = self.deploy_code_to_cache(experiment, paths_to_dump, code_digest)
+
+        # hard link cached code into experiment directory (or directories of array tasks) - no data is copied
+        experiment_dir = experiment.experiment_scratch_dir
+        config = experiment.generated_neptune_config if not tasks else None
+        remote_config = experiment_dir / _remote_config_path(experiment, config) if config else None
+        if tasks:
+            self._run(experiment, 'for i in $(seq 0 {last}); do mkdir -p {dst}/$i && cp -al {src}/. {dst}/$i/; '
+                                  'done'.format(last=len(tasks) - 1, src=cached_code_dir, dst=experiment_dir))
+        else:
+            self._run(experiment, 'cp -al {src}/. {dst}/{mkdir_config_dir}'.format(
+                src=cached_code_dir, dst=experiment_dir,
+                mkdir_config_dir=' && mkdir -p {}'.format(remote_config.parent) if config else ''))
+
+        # generated neptune configs are not part of code, thus upload them separately
+        if tasks:
+            self.deploy_tasks_bundle(experiment, tasks)
+            script = ArrayExperimentScript(experiment, tasks_file_name=ARRAY_TASKS_FILE_NAME)
+        else:
+            if config:
+                self._put(experiment, config, remote_config)
+            script = ExperimentScript(experiment)
         remote_script_path = experiment.project_scratch_dir / script.script_name
-        self._put(script.path, remote_script_path)
+        self._put(experiment, script.path, remote_script_path)
 
         return remote_script_path
 
+    def deploy_tasks_bundle(self, experiment, tasks):
+        """Ships tasks table together with generated neptune configs of sweep as single archive"""
+        configs = array_tasks_configs(tasks)
+        codec = self._get_archive_codec(experiment)
+        tasks_table = render_array_tasks(tasks)
+        LOGGER.debug('Uploading tasks table with {} neptune configs'.format(len(configs)))
+        get_transport(experiment.slurm_url).stream(
+            codec.extract_cmd(experiment.experiment_scratch_dir),
+            lambda fileobj: stream_archive(configs, fileobj, codec, files={ARRAY_TASKS_FILE_NAME: tasks_table}))
+
+    def deploy_code_to_cache(self, experiment, paths_to_dump, code_digest):
+        """Uploads code into content addressed cache in project scratch dir (only if it is not already there)"""
+        cache_dir = experiment.project_scratch_dir / CODE_CACHE_SUBDIR
+        cached_code_dir = cache_dir / code_digest
+        cache_key = (experiment.slurm_url, cached_code_dir)
+        with self._lock:
+            lock = self._cached_code_dirs.setdefault(cache_key, threading.Lock())
+
+        with lock:
+            if cache_key in self._uploaded_code_dirs:
+                return cached_code_dir
+
+            if not experiment.force_upload and \
+                    self._run(experiment, 'test -d {} && echo 1 || echo 0'.format(cached_code_dir)) == '1':
+                LOGGER.debug('Code {} found in cache'.format(code_digest))
+            else:
+                LOGGER.debug('Uploading code {} to cache'.format(code_digest))
+                upload_dir = cache_dir / '{}.{}'.format(code_digest, id_generator(6))
+                codec = self._get_archive_codec(experiment)
+                get_transport(experiment.slurm_url).stream(
+                    codec.extract_cmd(upload_dir), lambda fileobj: stream_archive(paths_to_dump, fileobj, codec))
+                # files are shared between experiments (hard links), so protect them from modification;
+                # if same code was concurrently uploaded by other mrunner process - just use it
+                replace_cmd = 'rm -rf {dst} && mv -T {src} {dst}' if experiment.force_upload else \
+                    '{{ mv -T {src} {dst} 2>/dev/null || rm -rf {src}; }}'
+                self._run(experiment, ' && '.join(['find {src} -type f -exec chmod a-w {{}} +', replace_cmd]).format(
+                    src=upload_dir, dst=cached_code_dir))
+            self._uploaded_code_dirs.add(cache_key)
+        return cached_code_dir
+
+    def _get_archive_codec(self, experiment):
+        def _remote_zstd():
+            # checked once per cluster
+            if experiment.slurm_url not in self._remote_zstd:
+                self._remote_zstd[experiment.slurm_url] = \
+                    self._run(experiment, 'command -v zstd >/dev/null && echo 1 || echo 0') == '1'
+            return self._remote_zstd[experiment.slurm_url]
+
+        return ArchiveCodec.parse(experiment.archive_codec, link_speed=experiment.link_speed, remote_zstd=_remote_zstd)
+
+    def _get_code(self, experiment):
+        paths_to_dump = get_code_paths(exclude=experiment.exclude,
+                                       generated_neptune_config=experiment.generated_neptune_config,
+                                       paths_to_copy=experiment.paths_to_copy, max_files=experiment.max_files_to_copy,
+                                       max_size=experiment.max_size_to_copy)
+
+        key = frozenset(paths_to_dump)
+        with self._lock:
+            code_digest = experiment.code_digest or self._code_digests.get(key)
+        if code_digest is None:
+            code_digest = get_paths_digest(paths_to_dump)
+            with self._lock:
+                self._code_digests[key] = code_digest
+        return paths_to_dump, code_digest
+
+    @staticmethod
+    def _create_experiment(experiment):
+        slurm_url = experiment.pop('slurm_url', '{}@{}'.format(PLGRID_USERNAME, PLGRID_HOST))
+        slurm_scratch_dir = experiment['storage_dir']
+        experiment = ExperimentRunOnSlurm(slurm_scratch_dir=slurm_scratch_dir, slurm_url=slurm_url,
+                                          **filter_only_attr(ExperimentRunOnSlurm, experiment))
+        LOGGER.debug('Configuration: {}'.format(experiment))
+        return experiment
+
     def deploy_neptune_token(self, experiment):
         if experiment.local_neptune_token:
             remote_token = SlurmNeptuneToken(experiment=experiment)
-            self._ensure_dir(remote_token.path.parent)
-            self._put(experiment.local_neptune_token.path, remote_token.path)
+            self._ensure_dir(experiment, remote_token.path.parent)
+            self._put(experiment, experiment.local_neptune_token.path, remote_token.path)
 
     @staticmethod
-    def _put(local_path, remote_path, quiet=True):
-        quiet_kwargs = {'ssh_opts': '-q', 'extra_opts': '-q'} if quiet else {}
-        rsync_project(remote_path, local_path, **quiet_kwargs)
+    def _put(experiment, local_path, remote_path, quiet=True):
+        get_transport(experiment.slurm_url).put(local_path, remote_path, quiet=quiet)
 
     @staticmethod
-    def _ensure_dir(directory_path):
-        SlurmBackend._fabric_run('mkdir -p {path}'.format(path=directory_path))
+    def _ensure_dir(experiment, *directories_paths):
+        SlurmBackend._run(experiment, 'mkdir -p {paths}'.format(paths=' '.join(directories_paths)))
 
     @staticmethod
-    def _fabric_run(cmd):
-        return fabric_run(cmd)
+    def _run(experiment, cmd):
+        return get_transport(experiment.slurm_url).run(cmd)
@@ -6,6 +6,7 @@ import click
 import six
 import yaml
 
+from mrunner.backends import BUILTIN_BACKENDS
 from mrunner.utils.utils import make_attr_class
 
 AVAILABLE_RESOURCES = ['cpu', 'mem', 'gpu', 'tpu']
@@ -58,7 +59,7 @@ def context(ctx):
 @context.command(name='add')
 @click.option('--name', required=True, help='Remote context name')
 @click.option('--backend_type', required=True,
-              type=click.Choice(['kubernetes', 'slurm']), help='Type of backend')
+              type=click.Choice(sorted(BUILTIN_BACKENDS)), help='Type of backend')
 @click.option('--storage', default=None, help='Storage path to which neptune will copy source code')
 @click.option('--resources', default=None,
               help='Resource to request (ex. "mem=2G cpu=4"; available types: {})'.format(
@@ -1,92 +1,71 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import argparse
+import itertools
 import random
 import re
 
 import sys
 
+from mrunner.sweep import Grid, IndexPermutation
 from mrunner.utils.utils import parse_argv
 
-# NOTE(maciek): Code is copied from jobman: https://github.com/crmne/jobman
-def generate_combination(repl):
-    if repl == []:
-        return []
-    else:
-        res = []
-        x = repl[0]
-        res1 = generate_combination(repl[1:])
-        for y in x:
-            if res1 == []:
-                res.append([y])
-            else:
-                res.extend([[y] + r for r in res1])
-        return res
-
-
-def generate_commands(sp):
-    # Find replacement lists in the arguments
-    repl = []
-    p = re.compile('\{\{\S*?\}\}')
-    for arg in sp:
-        reg = p.findall(arg)
-        if len(reg) == 1:
-            reg = p.search(arg)
-            curargs = reg.group()[2:-2].split(",")
-            newcurargs = []
-            for curarg in curargs:
-                new = p.sub(curarg, arg)
-                newcurargs.append(new)
-            repl.append(newcurargs)
-        elif len(reg) > 1:
-            s = p.split(arg)
-            tmp = []
-            for i in range(len(reg)):
-                if s[i]:
-                    tmp.append(s[i])
-                tmp.append(reg[i][2:-2].split(","))
-            i += 1
-            if s[i]:
-                tmp.append(s[i])
-            repl.append(generate_combination(tmp, ''))
-        else:
-            repl.append([arg])
-
-    argscombination = generate_combination(repl)
-    args_modif = generate_combination([x for x in repl if len(x) > 1])
-
-    return (argscombination, args_modif)
-
-
-def my_generate_commands(argv, repeat=1):
-    result = []
-    res = generate_commands(argv[1:])
-    for command, choice in zip(res[0], res[1]):
-        command_str = ' '.join(command)
-        result.append(command_str)
-    result = repeat * result
-
-    return result
+# NOTE(maciek): Idea is copied from jobman: https://github.com/crmne/jobman
+PLACEHOLDER_RE = re.compile(r'\{\{\S*?\}\}')
+
+
+def expand_argument(arg):
+    """Returns all alternatives of argument with {{a,b,...}} placeholders (several placeholders in single
+    argument are expanded to all combinations of their values)"""
+    placeholders = PLACEHOLDER_RE.findall(arg)
+    if not placeholders:
+        return [arg]
+    literals = PLACEHOLDER_RE.split(arg)
+    alternatives = []
+    for values in itertools.product(*[placeholder[2:-2].split(',') for placeholder in placeholders]):
+        parts = [literals[0]]
+        for value, literal in zip(values, literals[1:]):
+            parts.extend([value, literal])
+        alternatives.append(''.join(parts))
+    return alternatives
+
+
+def generate_commands(args, repeat=1, shuffle=False, limit=None, seed=None):
+    """Lazily yields commands for all combinations of arguments alternatives
+
+    Commands are addressed by index in (virtual) product of alternatives, thus neither repeat nor shuffle
+    (pseudo random permutation of indexes) materialize them.
+    """
+    if not args:
+        return
+    grid = Grid({idx: expand_argument(arg) for idx, arg in enumerate(args)})
+    total = len(grid) * repeat
+    indexes = range(total)
+    if shuffle:
+        indexes = IndexPermutation(total, seed=random.getrandbits(32) if seed is None else seed)
+    if limit is not None:
+        indexes = itertools.islice(indexes, limit)
+
+    for index in indexes:
+        point = grid.point(index % len(grid))
+        yield ' '.join(point[idx] for idx in range(len(args)))
+
 
 def main():
 
     parser = argparse.ArgumentParser(description='Generate commands', fromfile_prefix_chars='@')
     parser.add_argument('--repeat', type=int, default=1, help='Repeat commands')
     parser.add_argument('--shuffle', action='store_true', help='Shuffle commands')
+    parser.add_argument('--seed', type=int, help='Seed used to shuffle commands')
     parser.add_argument('--limit', type=int, help='Limit number of commands')
 
     args, proper_args = parse_argv(parser, sys.argv)
 
-    commands = my_generate_commands(proper_args, repeat=args.repeat)
-    if args.shuffle:
-        random.shuffle(commands)
-    if args.limit is not None:
-        commands = commands[:args.limit]
-
-    if len(commands) == 0:
-        commands = [' '.join(argv)]
-
-    print('\n'.join(commands))
+    # commands are printed as soon as they are generated, so they may be consumed by ex. `xargs -P`
+    for command in generate_commands(proper_args, repeat=args.repeat, shuffle=args.shuffle, limit=args.limit,
+                                     seed=args.seed):
+        sys.stdout.write(command + '\n')
+        sys.stdout.flush()
     return 0
 
 
@@ -3,14 +3,14 @@
 
 import logging
 
+import attr
 import click
 from path import Path
 
-from mrunner.backends.k8s import KubernetesBackend
-from mrunner.backends.slurm import SlurmBackend, SlurmNeptuneToken
+from mrunner.backends import get_backend_class
 from mrunner.cli.config import ConfigParser, context as context_cli
-from mrunner.experiment import generate_experiments, get_experiments_spec_handle
-from mrunner.utils.neptune import NeptuneWrapperCmd, NeptuneToken, NEPTUNE_LOCAL_VERSION
+from mrunner.utils.pipeline import Pipeline, Stage
+from mrunner.utils.utils import chunks, ThroughputMeter
 
 LOGGER = logging.getLogger(__name__)
 
@@ -74,11 +74,42 @@ def cli(ctx, debug, config, context):
 @click.option('--tags', multiple=True, help='Additional tags')
 @click.option('--requirements_file', type=click.Path(), help='Path to requirements file')
 @click.option('--base_image', help='Base docker image used in experiment')
+@click.option('--parallel', default=1, type=click.IntRange(min=1),
+              help='Number of experiments packaged, uploaded and submitted concurrently')
+@click.option('--array', is_flag=True,
+              help='Submit all experiments as single job (slurm job array or kubernetes Indexed Job; '
+                   'local backend waits for them)')
+@click.option('--array_parallelism', default=None, type=click.IntRange(min=1),
+              help='Maximal number of concurrently running tasks of job array')
+@click.option('--chunk_size', default=None, type=click.IntRange(min=1),
+              help='Maximal number of experiments submitted as single job array (with --array)')
+@click.option('--force_upload', is_flag=True, help='Upload code even if it is already cached on cluster (slurm only)')
+@click.option('--resume', is_flag=True,
+              help='Submit only experiments which were not submitted yet (according to local journal)')
+@click.option('--dedupe', is_flag=True, help='Skip identical experiments within sweep')
+@click.option('--wait', is_flag=True,
+              help='Wait till submitted experiments are finished and fail if any of them failed '
+                   '(local backend always waits)')
+@click.option('--rebuild', is_flag=True,
+              help='Pull base image and build docker image even if it is found in build cache (kubernetes only)')
 @click.argument('script')
 @click.argument('params', nargs=-1)
 @click.pass_context
-def run(ctx, neptune, spec, tags, requirements_file, base_image, script, params):
-    """Run experiment"""
+def run(ctx, neptune, spec, tags, requirements_file, base_image, parallel, array, array_parallelism, chunk_size,
+        force_upload, resume, dedupe, wait, rebuild, script, params):
+    """Run experiment
+
+    SCRIPT is experiment script, python experiments descriptor (with spec function) or `-` - then experiments
+    are read from stdin, one json object per line (ex. {"project": "p", "name": "n", "script": "train.py",
+    "parameters": {"lr": 0.1}})."""
+    # neptune and backends are imported only when experiments are run (see mrunner.backends)
+    from mrunner.experiment import generate_experiments, get_experiments_spec_handle, STDIN_SCRIPT
+    from mrunner.utils.journal import SubmissionJournal, JOURNAL_FILE_NAME, experiment_key, DONE, FAILED
+    from mrunner.utils.neptune import NeptuneWrapperCmd, NeptuneToken, NEPTUNE_LOCAL_VERSION
+    from mrunner.utils.utils import get_code_paths, get_paths_to_copy, get_paths_digest
+
+    # files may have changed since previous run in this process
+    get_paths_to_copy.cache_clear()
 
     context = ctx.obj['context']
 
@@ -88,7 +119,7 @@ def run(ctx, neptune, spec, tags, requirements_file, base_image, script, params)
         raise click.ClickException('Provide docker base image')
     if context['backend_type'] == 'kubernetes' and not requirements_file:
         raise click.ClickException('Provide requirements.txt file')
-    script_has_spec = get_experiments_spec_handle(script, spec) is not None
+    script_has_spec = script == STDIN_SCRIPT or get_experiments_spec_handle(script, spec) is not None
     neptune_support = context.get('neptune', None) or neptune
     if neptune_support and not neptune and not script_has_spec:
         raise click.ClickException('Neptune support is enabled in context '
@@ -100,60 +131,178 @@ def run(ctx, neptune, spec, tags, requirements_file, base_image, script, params)
         # TODO: implement it if possible
         raise click.ClickException('Currentlu doesn\'t support experiments without neptune')
 
+    def _prepare_experiment(neptune_path, experiment):
+        experiment.update({'base_image': base_image, 'requirements': requirements, 'force_upload': force_upload,
+                           'rebuild': rebuild})
+        if neptune_dir:
+            experiment['generated_neptune_config'] = neptune_path
+
+        if neptune_support:
+            cmd = ' '.join([experiment.pop('script')] + list(params))
+            # tags from neptune.yaml will be extracted by neptune
+            additional_tags = context.get('tags', []) + list(tags)
+
+            remote_neptune_token = None
+            if NEPTUNE_LOCAL_VERSION.version[0] == 2:
+                experiment['local_neptune_token'] = NeptuneToken()
+                assert experiment['local_neptune_token'].path.expanduser().exists(), \
+                    'Login to neptune first with `neptune account login` command'
+
+                remote_neptune_token = get_backend_class(experiment['backend_type']).get_neptune_token(experiment)
+
+            neptune_profile_name = remote_neptune_token.profile_name if remote_neptune_token else None
+            experiment['cmd'] = NeptuneWrapperCmd(cmd=cmd, experiment_config_path=neptune_path,
+                                                  neptune_storage=context['storage_dir'],
+                                                  paths_to_dump=None,
+                                                  additional_tags=additional_tags,
+                                                  neptune_profile=neptune_profile_name)
+            experiment.setdefault('paths_to_copy', [])
+        else:
+            # TODO: implement no neptune version
+            # TODO: for sbatch set log path into something like os.path.join(resource_dir_path, "job_logs.txt")
+            raise click.ClickException('Not implemented yet')
+        return experiment
+
+    code_digests = {}
+
+    def _get_code_digest(experiment):
+        # code is hashed once per distinct set of its paths (listed as backends do it); digest is passed to backend
+        paths = get_code_paths(exclude=experiment.get('exclude'),
+                               generated_neptune_config=experiment.get('generated_neptune_config'),
+                               paths_to_copy=experiment.get('paths_to_copy'),
+                               max_files=experiment.get('max_files_to_copy'),
+                               max_size=experiment.get('max_size_to_copy'))
+        if paths not in code_digests:
+            code_digests[paths] = get_paths_digest(paths)
+        return code_digests[paths]
+
+    # submitted experiments are recorded in journal kept next to mrunner config, so sweeps may be resumed
+    journal = SubmissionJournal(Path(ctx.obj['config_path']).parent / JOURNAL_FILE_NAME)
+    sweep = str(Path(script).abspath()) if script != STDIN_SCRIPT else STDIN_SCRIPT
+    Submission = attr.make_class('Submission', ['key', 'name', 'item'], frozen=True)
+
+    def _to_submissions(experiments):
+        seen_keys = set()
+        skipped = 0
+        for experiment in experiments:
+            code_digest = _get_code_digest(experiment)
+            key = experiment_key(experiment, code_digest)
+            if (dedupe and key in seen_keys) or (resume and journal.is_submitted(key)):
+                skipped += 1
+                continue
+            if dedupe:
+                seen_keys.add(key)
+            experiment['code_digest'] = code_digest
+            yield Submission(key=key, name=experiment['name'], item=experiment)
+        if skipped:
+            LOGGER.info('Skipped {} experiments (already submitted or duplicated)'.format(skipped))
+
+    def _record(submission, job_id):
+        journal.record(submission.key, sweep=sweep, context=context['context_name'], name=submission.name,
+                       backend_type=context['backend_type'], job_id=str(job_id) if job_id else None)
+
+    def _result_job_id(result):
+        # local backend reports results of experiments by their directories (which are their job ids)
+        return str(getattr(result, 'job_id', None) or result.log_path.parent)
+
+    def _stage(fun):
+        return lambda submission: attr.evolve(submission, item=fun(submission.item))
+
     neptune_dir = None
     try:
         # prepare neptune directory in case if neptune yamls shall be generated
         if neptune_support and not neptune:
-            script_path = Path(script)
+            script_path = Path(script) if script != STDIN_SCRIPT else Path('stdin')
             neptune_dir = script_path.parent / 'neptune_{}'.format(script_path.stem)
             neptune_dir.makedirs_p()
 
-        for neptune_path, experiment in generate_experiments(script, neptune, context, spec=spec,
-                                                             neptune_dir=neptune_dir):
-
-            experiment.update({'base_image': base_image, 'requirements': requirements})
-
-            if neptune_support:
-                script = experiment.pop('script')
-                cmd = ' '.join([script] + list(params))
-                # tags from neptune.yaml will be extracted by neptune
-                additional_tags = context.get('tags', []) + list(tags)
-
-                remote_neptune_token = None
-                if NEPTUNE_LOCAL_VERSION.version[0] == 2:
-                    experiment['local_neptune_token'] = NeptuneToken()
-                    assert experiment['local_neptune_token'].path.expanduser().exists(), \
-                        'Login to neptune first with `neptune account login` command'
-
-                    remote_neptune_token = {
-                        'kubernetes': NeptuneToken,
-                        'slurm': lambda: SlurmNeptuneToken(experiment)
-                    }[experiment['backend_type']]()
-
-                neptune_profile_name = remote_neptune_token.profile_name if remote_neptune_token else None
-                experiment['cmd'] = NeptuneWrapperCmd(cmd=cmd, experiment_config_path=neptune_path,
-                                                      neptune_storage=context['storage_dir'],
-                                                      paths_to_dump=None,
-                                                      additional_tags=additional_tags,
-                                                      neptune_profile=neptune_profile_name)
-                experiment.setdefault('paths_to_copy', [])
-            else:
-                # TODO: implement no neptune version
-                # TODO: for sbatch set log path into something like os.path.join(resource_dir_path, "job_logs.txt")
-                raise click.ClickException('Not implemented yet')
-
-            run_kwargs = {'experiment': experiment}
-            backend = {
-                'kubernetes': KubernetesBackend,
-                'slurm': SlurmBackend
-            }[experiment['backend_type']]()
-            # TODO: add calling experiments in parallel
-            backend.run(**run_kwargs)
+        experiments = (_prepare_experiment(neptune_path, experiment)
+                       for neptune_path, experiment in generate_experiments(script, neptune, context, spec=spec,
+                                                                            neptune_dir=neptune_dir))
+        submissions = _to_submissions(experiments)
+
+        try:
+            backend_class = get_backend_class(context['backend_type'])
+        except ValueError as e:
+            raise click.ClickException(e)
+        if wait and not hasattr(backend_class, 'wait'):
+            raise click.ClickException('Waiting for experiments is not supported by {} backend'.format(
+                context['backend_type']))
+        backend = backend_class()
+
+        # experiments are expanded lazily, so memory usage doesn't depend on size of sweep
+        throughput = ThroughputMeter()
+        if array:
+            # code is uploaded (image is built) once and each chunk of sweep is submitted as single job
+            try:
+                for submissions_chunk in chunks(submissions, chunk_size) if chunk_size else [list(submissions)]:
+                    job_ids = backend.run_array([s.item for s in submissions_chunk], parallelism=array_parallelism)
+                    for submission, job_id in zip(submissions_chunk, job_ids or []):
+                        _record(submission, job_id)
+                    throughput.update(len(submissions_chunk))
+            except ValueError as e:
+                raise click.ClickException(e)
+        else:
+            # each experiment goes through package->upload->submit stages
+            pipeline = Pipeline([Stage('package', _stage(backend.package), workers=parallel),
+                                 Stage('upload', _stage(backend.upload), workers=parallel),
+                                 Stage('submit', _stage(backend.submit), workers=parallel)])
+            for submission in pipeline.run(submissions):
+                _record(submission, submission.item)
+                throughput.update()
+        throughput.log()
+
+        # local experiments are run in background processes (and use generated neptune configs), thus local
+        # backend always waits for them
+        if wait or context['backend_type'] == 'local':
+            results = backend.wait() or []
+            journal.update_states(context['context_name'], {_result_job_id(r): DONE if r.returncode == 0 else FAILED
+                                                            for r in results})
+            failed = [r for r in results if r.returncode != 0]
+            if wait and failed:
+                raise click.ClickException('{} of {} experiments failed'.format(len(failed), len(results)))
     finally:
+        journal.close()
         if neptune_dir:
             neptune_dir.rmtree_p()
 
 
+@cli.command()
+@click.option('--sweep', default=None, help='Show only given sweep (path of experiment script)')
+@click.option('--watch', is_flag=True, help='Poll backends until all experiments are finished')
+@click.option('--interval', default=30, type=click.IntRange(min=1), help='Seconds between polls (with --watch)')
+@click.pass_context
+def status(ctx, sweep, watch, interval):
+    """Shows per-sweep counts of experiments states (backends are queried once per poll for all jobs)"""
+    import time
+    from mrunner.utils.journal import SubmissionJournal, JOURNAL_FILE_NAME, FINAL_STATES, STATES, UNKNOWN, \
+        count_states, refresh_states
+
+    context = ctx.obj['context']
+    if sweep and sweep != '-':  # experiments read from stdin are recorded as `-` sweep
+        sweep = str(Path(sweep).abspath())
+
+    journal = SubmissionJournal(Path(ctx.obj['config_path']).parent / JOURNAL_FILE_NAME)
+    try:
+        while True:
+            try:
+                entries = refresh_states(journal, context, sweep=sweep)
+            except (RuntimeError, ValueError) as e:
+                raise click.ClickException(e)
+
+            click.echo('{:<60} {}'.format('sweep', ' '.join('{:>9}'.format(state) for state in STATES)))
+            for sweep_name, counts in count_states(entries).items():
+                click.echo('{:<60} {}'.format(sweep_name, ' '.join('{:>9}'.format(counts[state])
+                                                                   for state in STATES)))
+
+            # experiments in unknown state won't change it, so they are not waited for
+            if not watch or all(entry.state in FINAL_STATES + (UNKNOWN,) for entry in entries):
+                break
+            time.sleep(interval)
+    finally:
+        journal.close()
+
+
 cli.add_command(context_cli)
 
 if __name__ == '__main__':
@@ -1,19 +1,27 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import json
 import logging
 import random
 import re
+import sys
 import warnings
 
 import attr
 import six
 from path import Path
 
-from mrunner.utils.namesgenerator import id_generator, get_random_name
 from mrunner.utils.neptune import NeptuneConfigFileV1, NeptuneConfigFileV2, load_neptune_config, NEPTUNE_LOCAL_VERSION, \
     NeptuneToken
+from mrunner.sweep import Space, Grid, Random, Sobol, Halton, Uniform, LogUniform, IntUniform, Choice  # noqa: F401
+from mrunner.utils.spec_cache import SpecCache
 
 LOGGER = logging.getLogger(__name__)
 
+# script argument meaning that experiments are read from stdin (one json object per line)
+STDIN_SCRIPT = '-'
+_NAME_SEPARATORS_RE = re.compile(r'[ .,_-]+')
+
 COMMON_EXPERIMENT_MANDATORY_FIELDS = [
     ('backend_type', dict()),
     ('name', dict()),
@@ -25,11 +33,17 @@ COMMON_EXPERIMENT_OPTIONAL_FIELDS = [
     ('project', dict(default='sandbox')),
     ('requirements', dict(default=attr.Factory(list), type=list)),
     ('exclude', dict(default=None, type=list)),
+    ('max_files_to_copy', dict(default=None)),  # limits of code size (ex. 500M); exceeding them is an error
+    ('max_size_to_copy', dict(default=None)),
     ('paths_to_copy', dict(default=attr.Factory(list), type=list)),
     ('env', dict(default=attr.Factory(dict), type=dict)),
     ('resources', dict(default=attr.Factory(dict), type=dict)),
     ('cwd', dict(default=attr.Factory(Path.getcwd))),
     ('local_neptune_token', dict(default=None, type=NeptuneToken)),
+    # neptune config generated from python experiment spec; it is not part of code and is deployed separately
+    ('generated_neptune_config', dict(default=None)),
+    # digest of code (see get_paths_digest) computed by CLI, so backends don't hash code again
+    ('code_digest', dict(default=None)),
 ]
 
 
@@ -89,18 +103,32 @@ def merge_experiment_parameters(cli_kwargs, neptune_config, context):
         else:
             if isinstance(config[k], (list, tuple)):
                 LOGGER.debug('Extending config["{}"]: {} with {}'.format(k, config[k], v))
-                if isinstance(v, (list, tuple)):
-                    config[k].extend(v)
-                else:
-                    config[k].append(v)
+                # new list - context lists are shared by all experiments
+                config[k] = list(config[k]) + (list(v) if isinstance(v, (list, tuple)) else [v])
             else:
                 LOGGER.debug('Overwriting config["{}"]: {} -> {}'.format(k, config[k], v))
                 config[k] = v
     return config
 
 
-def _load_py_experiment_and_generate_neptune_yamls(script, spec, *, neptune_dir, neptune_version=None):
-    LOGGER.info('Found {} function in {}; will use it as experiments configuration generator'.format(spec, script))
+def read_ndjson_experiments(lines):
+    """Lazily parses experiments given as json objects (with Experiment arguments), one per line"""
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield Experiment(**json.loads(line))
+        except (ValueError, TypeError) as e:
+            raise ValueError('Invalid experiment in line {}: {}'.format(line_no, e))
+
+
+def _load_py_experiment_and_generate_neptune_yamls(script, spec, *, neptune_dir, neptune_version=None,
+                                                   experiments=None):
+    if experiments is None:
+        LOGGER.info('Found {} function in {}; will use it as experiments configuration generator'.format(
+            spec, script))
+        experiments = get_experiments_spec_handle(script, spec)()
     neptune_support = bool(neptune_dir)
     if neptune_support:
         if neptune_version and NEPTUNE_LOCAL_VERSION < neptune_version:
@@ -111,16 +139,16 @@ def _load_py_experiment_and_generate_neptune_yamls(script, spec, *, neptune_dir,
         NeptuneConfigFile = {'1': NeptuneConfigFileV1, '2': NeptuneConfigFileV2}[str(NEPTUNE_LOCAL_VERSION.version[0])]
 
     def _dump_to_neptune(cli_params, neptune_dir):
-        neptune_path = None
-        while not neptune_path or neptune_path.exists():
-            neptune_path = neptune_dir / 'neptune-{}-{}.yaml'.format(get_random_name(), id_generator(4))
-        with neptune_path.open('w') as neptune_file:
-            NeptuneConfigFile(**cli_params).dump(neptune_file)
-        LOGGER.debug('Generated neptune file {}: {}'.format(neptune_path, Path(neptune_path).text()))
+        # configs are named by hash of content, so identical configs of sweep are written (and shipped) once; file
+        # system is asked whether config was already written, so memory usage doesn't grow with size of sweep
+        content = NeptuneConfigFile(**cli_params).dumps().encode('utf-8')
+        neptune_path = neptune_dir / 'neptune-{}.yaml'.format(hashlib.sha1(content).hexdigest()[:16])
+        if not neptune_path.exists():
+            neptune_path.write_bytes(content)
+            LOGGER.debug('Generated neptune file {}: {}'.format(neptune_path, content.decode('utf-8')))
         return neptune_path
 
-    spec_fun = get_experiments_spec_handle(script, spec)
-    for experiment in spec_fun():
+    for experiment in experiments:
         if isinstance(experiment, dict):
             experiment = NeptuneExperiment(**experiment)
         elif not hasattr(experiment, 'to_dict'):
@@ -141,8 +169,13 @@ def _load_py_experiment_and_generate_neptune_yamls(script, spec, *, neptune_dir,
 
 def generate_experiments(script, neptune, context, *, spec='spec',
                          neptune_dir=None, neptune_version=None, **cli_kwargs):
-    spec_fun = get_experiments_spec_handle(script, spec)
-    if spec_fun:
+    if script == STDIN_SCRIPT:
+        LOGGER.info('Reading experiments from stdin')
+        experiments = _load_py_experiment_and_generate_neptune_yamls(script, spec=spec,
+                                                                     neptune_dir=neptune_dir,
+                                                                     neptune_version=neptune_version,
+                                                                     experiments=read_ndjson_experiments(sys.stdin))
+    elif get_experiments_spec_handle(script, spec):
         experiments = _load_py_experiment_and_generate_neptune_yamls(script, spec=spec,
                                                                      neptune_dir=neptune_dir,
                                                                      neptune_version=neptune_version)
@@ -150,9 +183,10 @@ def generate_experiments(script, neptune, context, *, spec='spec',
         neptune_config = load_neptune_config(neptune)
         experiments = [(neptune, {'script': script, 'name': neptune_config['name']})]
 
+    cwd = Path.getcwd()
     for neptune_path, cli_kwargs_ in experiments:
-        cli_kwargs_['name'] = re.sub(r'[ .,_-]+', '-', cli_kwargs_['name'].lower())
-        cli_kwargs_['cwd'] = Path.getcwd()
+        cli_kwargs_['name'] = _NAME_SEPARATORS_RE.sub('-', cli_kwargs_['name'].lower())
+        cli_kwargs_['cwd'] = cwd
 
         # neptune_config = load_neptune_config(neptune_path) if neptune_path else {}
         # del neptune_config['storage']
@@ -164,21 +198,9 @@ def generate_experiments(script, neptune, context, *, spec='spec',
         yield neptune_path, experiment
 
 
-_spec_fun = None
+_spec_cache = SpecCache()
+
 
 def get_experiments_spec_handle(script, spec):
-    global _spec_fun
-    if _spec_fun is not None:
-        return _spec_fun
-
-    vars = {
-        'script':  str(Path(script).name),
-        '__file__': str(Path(script)),
-    }
-    exec(open(script).read(), vars)
-    spec_fun = vars.get(spec, None)
-    if not callable(spec_fun):
-        spec_fun = None
-
-    _spec_fun = spec_fun
-    return spec_fun
+    """Returns experiments spec function defined in script (None if there is no such one)"""
+    return _spec_cache.get_spec(script, spec)
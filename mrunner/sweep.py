@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""Lazy spaces of experiments parameters, to be used in spec functions
+
+    from mrunner.experiment import Grid, Sobol, LogUniform
+
+    def spec():
+        space = Grid(model=['cnn', 'mlp'], batch_size=[32, 64]) * Sobol(64, lr=LogUniform(1e-5, 1e-1), seed=1)
+        space = space.branch('model', cnn=Grid(kernel=[3, 5]))
+        space = space.where(lambda p: p['batch_size'] * p.get('kernel', 1) < 300)
+        return space.shuffle(seed=0)[:1000].experiments(project='sandbox', name='sweep', script='train.py')
+
+Spaces are index addressable - their points are computed on demand, so they may be sliced, sharded and
+shuffled without materializing them. Constraints (`where`) are applied while iterating over space.
+"""
+import bisect
+import logging
+import math
+import random
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Space(object):
+    """Base class of parameters spaces; point(index) returns dict with parameters (or None when point
+    doesn't satisfy constraints)"""
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def point(self, index):
+        raise NotImplementedError
+
+    def __iter__(self):
+        for index in range(len(self)):
+            point = self.point(index)
+            if point is not None:
+                yield point
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return _Indexed(self, range(len(self))[item])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('Point {} out of space of {} points'.format(item, len(self)))
+        return self.point(item)
+
+    def __add__(self, other):
+        return _Concatenation(self, other)
+
+    def __mul__(self, other):
+        return _Product(self, other)
+
+    def where(self, *constraints):
+        """Space of points for which all constraints (callables taking parameters dict) are true"""
+        return _Constrained(self, constraints)
+
+    def branch(self, key, **subspaces):
+        """Conditional subspaces: each point is extended with points of subspace selected by value of key
+        (subspaces are given by str of value; points with other values are left as they are)"""
+        return _Conditional(self, key, subspaces)
+
+    def shard(self, index, count):
+        """index-th of count disjoint parts of space"""
+        if not 0 <= index < count:
+            raise ValueError('Shard index shall be in range [0, {})'.format(count))
+        return self[index::count]
+
+    def shuffle(self, seed=0):
+        """Same points in pseudo random order (determined by seed)"""
+        return _Indexed(self, IndexPermutation(len(self), seed=seed))
+
+    def experiments(self, project, name, script, **kwargs):
+        """Lazily yields Experiment for each point of space; name may contain parameters placeholders
+        (ex. 'lr-{lr}')"""
+        from mrunner.experiment import Experiment
+        for parameters in self:
+            yield Experiment(project=project, name=name.format(**parameters), script=script,
+                             parameters=parameters, **kwargs)
+
+
+class Grid(Space):
+    """Cartesian product of values of all axes (last axis changes fastest)"""
+
+    def __init__(self, *axes, **kwargs_axes):
+        self._axes = []
+        for axes_dict in axes + (kwargs_axes,):
+            self._axes.extend((k, list(v)) for k, v in axes_dict.items())
+        self._size = 1
+        for _, values in self._axes:
+            self._size *= len(values)
+
+    def __len__(self):
+        return self._size
+
+    def point(self, index):
+        point = {}
+        for key, values in reversed(self._axes):
+            index, value_index = divmod(index, len(values))
+            point[key] = values[value_index]
+        return {key: point[key] for key, _ in self._axes}
+
+
+class Uniform(object):
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self, u):
+        return self.low + (self.high - self.low) * u
+
+
+class LogUniform(Uniform):
+
+    def sample(self, u):
+        return math.exp(math.log(self.low) + (math.log(self.high) - math.log(self.low)) * u)
+
+
+class IntUniform(Uniform):
+    """Integers from low to high (inclusive)"""
+
+    def sample(self, u):
+        return min(self.low + int(u * (self.high - self.low + 1)), self.high)
+
+
+class Choice(object):
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def sample(self, u):
+        return self.values[min(int(u * len(self.values)), len(self.values) - 1)]
+
+
+def _as_distribution(value):
+    if hasattr(value, 'sample'):
+        return value
+    if isinstance(value, (list, tuple)):
+        return Choice(value)
+    return Choice([value])
+
+
+class _Sampled(Space):
+    """Space of size points, each one drawn from distributions given unit cube point"""
+
+    def __init__(self, size, seed=None, **distributions):
+        self._size = size
+        self._seed = seed
+        self._distributions = [(k, _as_distribution(v)) for k, v in distributions.items()]
+
+    def __len__(self):
+        return self._size
+
+    def point(self, index):
+        unit_point = self._unit_point(index)
+        return {key: distribution.sample(u) for (key, distribution), u in zip(self._distributions, unit_point)}
+
+    def _unit_point(self, index):
+        raise NotImplementedError
+
+
+class Random(_Sampled):
+    """Points sampled independently at random; each point depends only on seed and its index"""
+
+    def __init__(self, size, seed=0, **distributions):
+        super(Random, self).__init__(size, seed=seed, **distributions)
+
+    def _unit_point(self, index):
+        rng = random.Random('{}:{}'.format(self._seed, index))
+        return [rng.random() for _ in self._distributions]
+
+
+SOBOL_BITS = 32
+# direction numbers (dimension, s, a, m_1..m_s) from Joe and Kuo (new-joe-kuo-6.21201); first dimension
+# is van der Corput sequence
+SOBOL_DIRECTIONS = [
+    (1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1]), (3, 2, [1, 1, 1]), (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]), (5, 2, [1, 1, 5, 5, 17]), (5, 4, [1, 1, 5, 5, 5]), (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]), (5, 13, [1, 1, 1, 3, 11]), (5, 14, [1, 3, 5, 5, 31]),
+    (6, 1, [1, 3, 3, 9, 7, 49]), (6, 13, [1, 1, 1, 15, 21, 21]), (6, 16, [1, 3, 1, 13, 27, 49]),
+    (6, 19, [1, 1, 1, 15, 7, 5]), (6, 22, [1, 3, 1, 15, 13, 25]), (6, 25, [1, 1, 5, 5, 19, 61]),
+    (7, 1, [1, 3, 7, 11, 23, 15, 103]), (7, 4, [1, 3, 7, 13, 13, 15, 69]),
+]
+
+
+def _sobol_direction_vectors(s, a, m):
+    v = [m_j << (SOBOL_BITS - 1 - j) for j, m_j in enumerate(m)]
+    for j in range(s, SOBOL_BITS):
+        value = v[j - s] ^ (v[j - s] >> s)
+        for k in range(1, s):
+            if (a >> (s - 1 - k)) & 1:
+                value ^= v[j - k]
+        v.append(value)
+    return v
+
+
+class Sobol(_Sampled):
+    """Sobol low-discrepancy sequence (best with size being power of 2); with seed, points are scrambled
+    with random digital shift"""
+
+    def __init__(self, size, seed=None, **distributions):
+        super(Sobol, self).__init__(size, seed=seed, **distributions)
+        if len(self._distributions) > len(SOBOL_DIRECTIONS) + 1:
+            raise ValueError('Sobol sequence supports up to {} parameters'.format(len(SOBOL_DIRECTIONS) + 1))
+        if size > 2 ** SOBOL_BITS:
+            raise ValueError('Sobol sequence supports up to 2^{} points'.format(SOBOL_BITS))
+        self._directions = [[1 << (SOBOL_BITS - 1 - j) for j in range(SOBOL_BITS)]]
+        self._directions += [_sobol_direction_vectors(*direction)
+                             for direction in SOBOL_DIRECTIONS[:len(self._distributions) - 1]]
+        rng = random.Random(seed)
+        self._shifts = [rng.getrandbits(SOBOL_BITS) if seed is not None else 0 for _ in self._distributions]
+
+    def _unit_point(self, index):
+        gray_code = index ^ (index >> 1)
+        unit_point = []
+        for directions, shift in zip(self._directions, self._shifts):
+            value = shift
+            code, bit = gray_code, 0
+            while code:
+                if code & 1:
+                    value ^= directions[bit]
+                code >>= 1
+                bit += 1
+            unit_point.append(value / 2. ** SOBOL_BITS)
+        return unit_point
+
+
+def _primes(count):
+    primes = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % p for p in primes if p * p <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+class Halton(_Sampled):
+    """Halton low-discrepancy sequence; with seed, points are randomly shifted (modulo 1)"""
+
+    def __init__(self, size, seed=None, **distributions):
+        super(Halton, self).__init__(size, seed=seed, **distributions)
+        self._bases = _primes(len(self._distributions))
+        rng = random.Random(seed)
+        self._shifts = [rng.random() if seed is not None else 0. for _ in self._distributions]
+
+    def _unit_point(self, index):
+        unit_point = []
+        for base, shift in zip(self._bases, self._shifts):
+            value, denominator, n = 0., 1., index
+            while n:
+                n, digit = divmod(n, base)
+                denominator *= base
+                value += digit / denominator
+            unit_point.append((value + shift) % 1.)
+        return unit_point
+
+
+class _Product(Space):
+
+    def __init__(self, first, second):
+        self._first = first
+        self._second = second
+
+    def __len__(self):
+        return len(self._first) * len(self._second)
+
+    def point(self, index):
+        first_index, second_index = divmod(index, len(self._second))
+        first = self._first.point(first_index)
+        second = self._second.point(second_index)
+        if first is None or second is None:
+            return None
+        return dict(first, **second)
+
+
+class _Concatenation(Space):
+
+    def __init__(self, *spaces):
+        self._spaces = spaces
+
+    def __len__(self):
+        return sum(len(space) for space in self._spaces)
+
+    def point(self, index):
+        for space in self._spaces:
+            if index < len(space):
+                return space.point(index)
+            index -= len(space)
+        raise IndexError(index)
+
+
+class _Constrained(Space):
+
+    def __init__(self, space, constraints):
+        self._space = space
+        self._constraints = constraints
+
+    def __len__(self):
+        return len(self._space)
+
+    def point(self, index):
+        point = self._space.point(index)
+        if point is None or not all(constraint(point) for constraint in self._constraints):
+            return None
+        return point
+
+
+class _Conditional(Space):
+    """Each point of base space extended with points of subspace selected by its value of key; offsets
+    of base points are computed once (memory is proportional to size of base space only)"""
+
+    def __init__(self, base, key, subspaces):
+        self._base = base
+        self._key = key
+        self._subspaces = subspaces
+        self._offsets = None
+
+    def _subspace(self, base_point):
+        return self._subspaces.get(str(base_point.get(self._key))) if base_point is not None else None
+
+    def _get_offsets(self):
+        if self._offsets is None:
+            offsets, total = [], 0
+            for base_index in range(len(self._base)):
+                offsets.append(total)
+                subspace = self._subspace(self._base.point(base_index))
+                total += len(subspace) if subspace is not None else 1
+            self._offsets = offsets + [total]
+        return self._offsets
+
+    def __len__(self):
+        return self._get_offsets()[-1]
+
+    def point(self, index):
+        offsets = self._get_offsets()
+        base_index = bisect.bisect_right(offsets, index) - 1
+        base_point = self._base.point(base_index)
+        subspace = self._subspace(base_point)
+        if subspace is None:
+            return base_point
+        subspace_point = subspace.point(index - offsets[base_index])
+        return dict(base_point, **subspace_point) if subspace_point is not None else None
+
+
+class _Indexed(Space):
+    """View on space with points selected (and ordered) by sequence of indexes"""
+
+    def __init__(self, space, indexes):
+        self._space = space
+        self._indexes = indexes
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def point(self, index):
+        return self._space.point(self._indexes[index])
+
+
+class IndexPermutation(object):
+    """Pseudo random permutation of range(size) computed on demand (Feistel network with cycle walking),
+    so permutation of huge range doesn't need memory"""
+    ROUNDS = 4
+
+    def __init__(self, size, seed=0):
+        self._size = size
+        self._half_bits = max((size - 1).bit_length() + 1, 2) // 2
+        self._mask = (1 << self._half_bits) - 1
+        rng = random.Random(seed)
+        self._keys = [rng.getrandbits(32) for _ in range(self.ROUNDS)]
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(self._size)[index]]
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        # permutation of range(4^half_bits) >= size; values out of range are permuted again
+        value = self._permute(index)
+        while value >= self._size:
+            value = self._permute(value)
+        return value
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield self[index]
+
+    def _permute(self, value):
+        left, right = value >> self._half_bits, value & self._mask
+        for key in self._keys:
+            left, right = right, left ^ (((right * 0x9E3779B1) ^ key) * 0x85EBCA6B >> 7 & self._mask)
+        return (left << self._half_bits) | right
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import logging
+import tarfile
+import time
+
+import attr
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 3
+
+ArchiveStats = attr.make_class('ArchiveStats', ['raw_bytes', 'compressed_bytes', 'seconds'], frozen=True)
+
+
+class _CountingWriter(object):
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self._fileobj.write(data)
+
+    def flush(self):
+        self._fileobj.flush()
+
+
+class ArchiveCodec(object):
+    """Compression used while streaming archive; given as `none`, `gzip[:level]` or `zstd[:level[:threads]]`"""
+
+    def __init__(self, name, level=None, threads=None):
+        if name not in ['none', 'gzip', 'zstd']:
+            raise ValueError('Unknown archive codec: {}'.format(name))
+        self.name = name
+        self.level = level
+        self.threads = threads
+
+    @classmethod
+    def parse(cls, spec, link_speed=None, remote_zstd=None):
+        """Parses codec spec; for `auto` spec codec is chosen based on link speed (in Mbit/s). remote_zstd is
+        callable checking if `zstd` is available on remote end - without it `auto` never chooses zstd"""
+        if spec in [None, 'auto']:
+            return cls.choose(link_speed, remote_zstd=remote_zstd)
+        items = str(spec).split(':')
+        name, args = items[0], [int(i) for i in items[1:]]
+        return cls(name, *args)
+
+    @classmethod
+    def choose(cls, link_speed=None, remote_zstd=None):
+        # on fast links compression is slower than network transfer; on slow ones spend more CPU
+        link_speed = float(link_speed) if link_speed else None
+        if link_speed and link_speed >= 1000:
+            return cls('none')
+        # archive is decompressed on remote end, so zstd has to be available on both of them
+        codec = 'zstd' if _zstd_available() and remote_zstd is not None and remote_zstd() else 'gzip'
+        fast_link = link_speed and link_speed >= 100
+        if codec == 'zstd':
+            return cls(codec, 1 if fast_link else DEFAULT_ZSTD_LEVEL, -1)
+        return cls(codec, 1 if fast_link else DEFAULT_GZIP_LEVEL)
+
+    def open(self, fileobj):
+        """Returns writable file object which compresses data into fileobj"""
+        if self.name == 'gzip':
+            return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=self.level or DEFAULT_GZIP_LEVEL)
+        elif self.name == 'zstd':
+            if not _zstd_available():
+                raise RuntimeError('Install zstandard package to use zstd archive codec')
+            import zstandard
+            compressor = zstandard.ZstdCompressor(level=self.level or DEFAULT_ZSTD_LEVEL, threads=self.threads or 0)
+            return compressor.stream_writer(fileobj)
+        return fileobj
+
+    def close(self, compressed_fileobj):
+        """Flushes remaining compressed data; underlying file object is left open"""
+        if self.name == 'gzip':
+            compressed_fileobj.close()
+        elif self.name == 'zstd':
+            import zstandard
+            compressed_fileobj.flush(zstandard.FLUSH_FRAME)
+
+    def extract_cmd(self, directory):
+        """Shell command which extracts archive streamed on its stdin"""
+        decompress = {'none': '', 'gzip': 'gzip -dc | ', 'zstd': 'zstd -qdc | '}[self.name]
+        return 'mkdir -p {dir} && {decompress}tar xf - -C {dir}'.format(dir=directory, decompress=decompress)
+
+    def __str__(self):
+        return ':'.join(str(i) for i in [self.name, self.level, self.threads] if i is not None)
+
+
+def stream_archive(paths_to_dump, fileobj, codec, files=None):
+    """Writes tar archive with given paths (as returned by get_paths_to_copy) into fileobj; nothing is buffered
+    on disk, so fileobj may be i.a. stdin of remote `tar x` process. Additional in-memory files may be passed
+    as {archive_name: bytes} dict"""
+    start_time = time.time()
+    compressed_counter = _CountingWriter(fileobj)
+    compressed = codec.open(compressed_counter)
+    raw_counter = _CountingWriter(compressed)
+    with tarfile.open(fileobj=raw_counter, mode='w|') as tar_file:
+        for name, payload in sorted((files or {}).items()):
+            info = tarfile.TarInfo(name)
+            info.size, info.mode, info.mtime = len(payload), 0o644, time.time()
+            tar_file.addfile(info, io.BytesIO(payload))
+        for p in sorted(paths_to_dump, key=lambda p: str(p.rel_remote_path)):
+            LOGGER.debug('Adding "{}" to deployment archive'.format(p.rel_remote_path))
+            tar_file.add(p.local_path, arcname=p.rel_remote_path)
+    codec.close(compressed)
+    fileobj.flush()
+
+    stats = ArchiveStats(raw_bytes=raw_counter.bytes_written, compressed_bytes=compressed_counter.bytes_written,
+                         seconds=time.time() - start_time)
+    LOGGER.info('Archive streamed ({}): {:.1f}MB -> {:.1f}MB in {:.1f}s ({:.1f}MB/s)'.format(
+        codec, stats.raw_bytes / 2. ** 20, stats.compressed_bytes / 2. ** 20, stats.seconds,
+        stats.compressed_bytes / 2. ** 20 / max(stats.seconds, 1e-3)))
+    return stats
+
+
+def _zstd_available():
+    try:
+        import zstandard  # noqa
+        return True
+    except ImportError:
+        return False
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from path import Path
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_BUILD_CACHE_PATH = '~/.cache/mrunner/docker_builds.json'
+
+
+def build_key(**inputs):
+    """Content hash of image build inputs (all of them shall be json serializable)"""
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class BuildCache(object):
+    """Local cache of published images keyed by content hash of build inputs; additionally tracks when base
+    images were pulled, so they are not pulled on each build"""
+
+    def __init__(self, path=DEFAULT_BUILD_CACHE_PATH):
+        self._path = Path(path).expanduser()
+        self._lock = threading.Lock()
+
+    def get_image(self, key):
+        with self._lock:
+            entry = self._load()['images'].get(key)
+        return entry['image'] if entry else None
+
+    def put_image(self, key, image_name):
+        with self._lock:
+            data = self._load()
+            data['images'][key] = {'image': image_name, 'created': time.time()}
+            self._save(data)
+
+    def get_base_image(self, name, max_age):
+        """Returns id of base image if it was pulled not earlier than max_age seconds ago"""
+        with self._lock:
+            entry = self._load()['base_images'].get(name)
+        if entry and time.time() - entry['pulled'] <= max_age:
+            return entry['id']
+        return None
+
+    def put_base_image(self, name, image_id):
+        with self._lock:
+            data = self._load()
+            data['base_images'][name] = {'id': image_id, 'pulled': time.time()}
+            self._save(data)
+
+    def _load(self):
+        try:
+            with open(self._path) as cache_file:
+                data = json.load(cache_file)
+        except (IOError, ValueError):
+            data = {}
+        data.setdefault('images', {})
+        data.setdefault('base_images', {})
+        return data
+
+    def _save(self, data):
+        # write atomically - cache may be shared by concurrently running mrunner processes
+        self._path.parent.makedirs_p()
+        tmp_path = self._path + '.{}.{}.tmp'.format(os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(data, cache_file, indent=1, sort_keys=True)
+        Path(tmp_path).rename(self._path)
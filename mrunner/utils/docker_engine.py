@@ -1,58 +1,139 @@
 # -*- coding: utf-8 -*-
+import hashlib
 import logging
 import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
 from subprocess import call
 
 import attr
-from docker.errors import ImageNotFound
+from docker.errors import APIError
 from path import Path
 
-from mrunner.utils.utils import GeneratedTemplateFile, get_paths_to_copy
+from mrunner.utils.archive import ArchiveCodec, stream_archive
+from mrunner.utils.build_cache import BuildCache, build_key
+from mrunner.utils.utils import GeneratedTemplateFile, PathToDump, get_code_paths, get_paths_digest
 
 LOGGER = logging.getLogger(__name__)
 
+# build context larger than this is spooled to disk
+BUILD_CONTEXT_MAX_MEMORY_SIZE = 64 * 2 ** 20
 
-class RequirementsFile(object):
+# code is copied into image in few layers; rarely changed ones are first
+LAYERS = ['vendored', 'configs', 'source']
+VENDORED_DIRS = {'vendor', 'vendored', 'third_party', 'thirdparty', 'external', 'externals', 'lib', 'libs', 'deps'}
+CONFIG_SUFFIXES = {'.yaml', '.yml', '.json', '.toml', '.ini', '.cfg', '.conf', '.txt'}
+LAYERS_DIR = 'layers'
 
-    def __init__(self, path, requirements):
-        self._path = Path(path)
-        with open(path, 'w') as requirements_file:
-            payload = '\n'.join(requirements)
-            requirements_file.writelines(payload)
 
-    def __del__(self):
-        self._path.remove_p()
-
-    @property
-    def path(self):
-        return self._path
+def rewrite_paths(cwd, argv):
+    """Makes paths in command line relative to cwd (which is experiment directory in image)"""
+    updated_argv = []
+    for item in argv:
+        if Path(item).exists():
+            item = str(Path(cwd).relpathto(item))
+        updated_argv.append(item)
+    return updated_argv
 
 
 StaticCmd = attr.make_class('StaticCmd', ['command', 'env'], frozen=True)
+# published_image is set when image was found in build cache (thus it is already built and published)
+BuiltImage = attr.make_class('BuiltImage', ['repository_name', 'image', 'cache_key', 'published_image'], frozen=True)
+
+
+def plan_layers(paths_to_copy):
+    """Groups paths (as returned by get_paths_to_copy) into layers: vendored libraries, configs and source;
+    returns (layer name, paths) pairs. Order of layers and of paths in layers is stable, so unchanged layers
+    are reused between builds"""
+
+    def _layer_name(path_to_dump):
+        rel_path = Path(path_to_dump.rel_remote_path)
+        if path_to_dump.local_path != path_to_dump.rel_remote_path or rel_path.splitall()[1] in VENDORED_DIRS:
+            return 'vendored'
+        if rel_path.ext in CONFIG_SUFFIXES and not Path(path_to_dump.local_path).isdir():
+            return 'configs'
+        return 'source'
+
+    layers = {name: [] for name in LAYERS}
+    for path_to_dump in sorted(paths_to_copy, key=lambda p: str(p.rel_remote_path)):
+        layers[_layer_name(path_to_dump)].append(path_to_dump)
+    return [(name, layers[name]) for name in LAYERS if layers[name]]
 
 
 class DockerFile(GeneratedTemplateFile):
+    """Dockerfile which refers to paths in build context (see DockerEngine.create_build_context)"""
     DEFAULT_DOCKERFILE_TEMPLATE = 'Dockerfile.jinja2'
 
-    def __init__(self, experiment, requirements_file):
+    def __init__(self, experiment, requirements_file, buildkit=False):
         experiment_data = attr.asdict(experiment)
         # paths in command shall be relative
         cmd = experiment_data.pop('cmd')
-        updated_cmd = self._rewrite_paths(experiment.cwd, cmd.command)
-        paths_to_copy = get_paths_to_copy(exclude=experiment.exclude, paths_to_copy=experiment.paths_to_copy)
+        updated_cmd = ' '.join(rewrite_paths(experiment.cwd, cmd.command.split(' ')))
+        # generated neptune config is not part of code (it is passed by job), so image may be shared by experiments
+        paths_to_copy = get_code_paths(exclude=experiment.exclude,
+                                       generated_neptune_config=experiment.generated_neptune_config,
+                                       paths_to_copy=experiment.paths_to_copy, max_files=experiment.max_files_to_copy,
+                                       max_size=experiment.max_size_to_copy)
         experiment = attr.evolve(experiment, cmd=StaticCmd(command=updated_cmd, env=cmd.env))
-
+        self.paths_to_copy = paths_to_copy
+
+        # in build context paths are placed in directories of their layers: layers/<name>/<remote path>
+        self.context_paths = []
+        layers = []
+        for name, layer in plan_layers(paths_to_copy):
+            layer_dir = '{}/{}'.format(LAYERS_DIR, name)
+            layers.append(layer_dir)
+            self.context_paths.extend(PathToDump(p.local_path, Path(layer_dir) / p.rel_remote_path) for p in layer)
         super(DockerFile, self).__init__(template_filename=self.DEFAULT_DOCKERFILE_TEMPLATE,
                                          experiment=experiment, requirements_file=requirements_file,
-                                         paths_to_copy=paths_to_copy)
+                                         layers=layers, buildkit=buildkit,
+                                         # command with generated config differs between experiments of sweep
+                                         entrypoint=not experiment.generated_neptune_config)
+
+
+class PushProgress(object):
+    """Tracks progress of image push based on stream of docker push events"""
+    REPORT_INTERVAL = 5  # seconds
+
+    def __init__(self, image_name):
+        self._image_name = image_name
+        self._start_time = self._last_report_time = time.time()
+        self.layers = {}  # layer id -> (status, bytes sent, layer size)
+        self.digest = None
+
+    def update(self, event):
+        if 'error' in event:
+            raise RuntimeError('Push of {} failed: {}'.format(self._image_name,
+                                                             event.get('errorDetail', {}).get('message', event)))
+        if 'aux' in event and 'Digest' in event['aux']:
+            self.digest = event['aux']['Digest']
+        elif 'id' in event and 'status' in event:
+            _, current, total = self.layers.get(event['id'], (None, 0, 0))
+            details = event.get('progressDetail') or {}
+            self.layers[event['id']] = (event['status'], details.get('current', current), details.get('total', total))
+            LOGGER.debug('[{}] layer {}: {}'.format(self._image_name, event['id'], event['status']))
+
+        if time.time() - self._last_report_time > self.REPORT_INTERVAL:
+            self._last_report_time = time.time()
+            pushing = {k: v for k, v in self.layers.items() if v[0] == 'Pushing'}
+            LOGGER.info('[{}] pushing {} layers: {:.1f}/{:.1f}MB'.format(
+                self._image_name, len(pushing), sum(v[1] for v in pushing.values()) / 2. ** 20,
+                sum(v[2] for v in pushing.values()) / 2. ** 20))
+
+    @property
+    def pushed_bytes(self):
+        return sum(total or current for status, current, total in self.layers.values() if status == 'Pushed')
 
-    def _rewrite_paths(self, cwd, cmd):
-        updated_cmd = []
-        for item in cmd.split(' '):
-            if Path(item).exists():
-                item = Path(cwd).relpathto(item)
-            updated_cmd.append(item)
-        return ' '.join(updated_cmd)
+    def log_summary(self):
+        seconds = time.time() - self._start_time
+        statuses = [status for status, _, _ in self.layers.values()]
+        LOGGER.info('[{}] pushed {} layers ({} already in registry): {:.1f}MB in {:.1f}s ({:.1f}MB/s); '
+                    'digest: {}'.format(self._image_name, statuses.count('Pushed'),
+                                        statuses.count('Layer already exists'), self.pushed_bytes / 2. ** 20,
+                                        seconds, self.pushed_bytes / 2. ** 20 / max(seconds, 1e-3), self.digest))
 
 
 class DockerEngine(object):
@@ -60,7 +141,12 @@ class DockerEngine(object):
     def __init__(self, docker_url=None):
         import docker
         base_url = docker_url if docker_url else os.environ.get('DOCKER_HOST', 'unix://var/run/docker.sock')
+        self._docker_url = docker_url
         self._client = docker.DockerClient(base_url=base_url)
+        self._lock = threading.Lock()
+        self._logged_in_registries = set()
+        self._build_cache = BuildCache()
+        self._futures = {}
 
     def _login_with_docker(self, experiment):
         self._client.login(registry=experiment.registry_url, username=experiment.registry_username,
@@ -70,61 +156,175 @@ class DockerEngine(object):
         call('gcloud auth configure-docker'.split(' '))
 
     def build_and_publish_image(self, experiment):
+        return self.publish_image(self.build_image(experiment))
+
+    def build_image(self, experiment):
+        """Builds image with experiment code; images are keyed by content, so experiments of sweep which share
+        code and requirements share also image (it is built only once per engine session)"""
         registry_url = experiment.registry_url
         self._is_gcr = registry_url and registry_url.startswith('https://gcr.io')
         if registry_url:
-            _login = self._login_with_gcloud if self._is_gcr else self._login_with_docker
-            _login(experiment)
-
-        # requirements filename shall be constant for experiment, to use docker cache during build;
-        # thus we don't use dynamic/temporary file names
-        file_path = self._generate_requirements_name(experiment)
-        requirements = RequirementsFile(file_path, experiment.requirements)
+            # login once per engine session
+            with self._lock:
+                if registry_url not in self._logged_in_registries:
+                    _login = self._login_with_gcloud if self._is_gcr else self._login_with_docker
+                    _login(experiment)
+                    self._logged_in_registries.add(registry_url)
+
+        # requirements file is named after its content, so dependencies layer is reused by all experiments
+        # with same requirements
+        requirements = '\n'.join(experiment.requirements)
+        requirements_name = self._generate_requirements_name(requirements)
         LOGGER.debug('Requirements file created:')
-        LOGGER.debug(Path(file_path).text())
+        LOGGER.debug(requirements)
 
-        dockerfile = DockerFile(experiment=experiment, requirements_file=requirements.path)
+        buildkit = experiment.buildkit or os.environ.get('DOCKER_BUILDKIT') == '1'
+        dockerfile = DockerFile(experiment=experiment, requirements_file=requirements_name, buildkit=buildkit)
         LOGGER.debug('Dockerfile created:')
-        dockerfile_rel_path = Path(experiment.cwd).relpathto(dockerfile.path)
 
-        # obtain old image for comparison if there where any changes
+        # skip build and push if image with same content was already published
         repository_name = self._generate_repository_name(experiment)
-        try:
-            old_image = self._client.images.get(repository_name + ':latest')
-        except ImageNotFound:
-            old_image = None
-
-        # build image; use cache if possible
-        LOGGER.debug(Path(dockerfile.path).text())
-        LOGGER.debug('Building docker image')
         neptune_build_args = self._get_neptune_build_args(experiment)
-        image, _ = self._client.images.build(path=experiment.cwd, tag=repository_name,
-                                             buildargs=neptune_build_args,
-                                             dockerfile=dockerfile_rel_path, pull=True, rm=True, forcerm=True)
-
-        is_image_updated = not old_image or old_image.id != image.id
-        LOGGER.debug('Docker image built (updated={})'.format(is_image_updated))
-        if is_image_updated:
-            # if new image is generated - tag it and push to repository
-            tag = self._get_tag()
+        base_image_id = self._once(('pull', experiment.base_image), self._ensure_base_image, experiment.base_image,
+                                   experiment.base_image_refresh, force=experiment.rebuild)
+        cache_key = build_key(repository_name=repository_name, base_image_id=base_image_id,
+                              requirements=experiment.requirements, dockerfile=Path(dockerfile.path).text(),
+                              paths_digest=experiment.code_digest or self._get_paths_digest(dockerfile.paths_to_copy),
+                              build_args=neptune_build_args)
+        published_image = None if experiment.rebuild else self._build_cache.get_image(cache_key)
+        if published_image:
+            LOGGER.info('Docker image {} is up to date (build cache hit)'.format(published_image))
+            return BuiltImage(repository_name=repository_name, image=None, cache_key=cache_key,
+                              published_image=published_image)
+
+        def _build():
+            LOGGER.debug(Path(dockerfile.path).text())
+            LOGGER.debug('Building docker image')
+            # base image is pulled (refreshed) above
+            with self.create_build_context(dockerfile, {requirements_name: requirements}) as context:
+                if buildkit:
+                    image = self._build_with_buildkit(context, repository_name, neptune_build_args)
+                else:
+                    image, _ = self._client.images.build(fileobj=context, custom_context=True, tag=repository_name,
+                                                         buildargs=neptune_build_args, pull=False, rm=True,
+                                                         forcerm=True)
+            LOGGER.debug('Docker image built ({})'.format(image.id))
+            return image
+
+        image = self._once(('build', cache_key), _build)
+        return BuiltImage(repository_name=repository_name, image=image, cache_key=cache_key, published_image=None)
+
+    def _build_with_buildkit(self, context, tag, build_args):
+        """Builds image with docker CLI, as BuildKit (required by cache mounts) is not available through
+        docker API client"""
+        env = dict(os.environ, DOCKER_BUILDKIT='1', **build_args)
+        if self._docker_url:
+            env['DOCKER_HOST'] = self._docker_url
+        with tempfile.NamedTemporaryFile(prefix='mrunner_iid_') as iid_file:
+            # build args values are passed by env, thus they are not visible on processes list
+            cmd = ['docker', 'build', '--tag', tag, '--iidfile', iid_file.name, '--rm', '--force-rm'] + \
+                  ['--build-arg={}'.format(k) for k in sorted(build_args)] + ['-']
+            process = subprocess.Popen(cmd, stdin=context, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+            output, _ = process.communicate()
+            if process.returncode:
+                raise RuntimeError('Docker build failed: {}'.format(output.decode('utf-8', 'replace')))
+            LOGGER.debug(output.decode('utf-8', 'replace'))
+            image_id = Path(iid_file.name).text().strip()
+        return self._client.images.get(image_id)
+
+    @staticmethod
+    def create_build_context(dockerfile, files):
+        """Returns tar archive (spooled in memory) which contains only Dockerfile, given files
+        ({name: content} dict) and paths copied by Dockerfile"""
+        context = tempfile.SpooledTemporaryFile(max_size=BUILD_CONTEXT_MAX_MEMORY_SIZE)
+        files = {name: content.encode('utf-8') for name, content in files.items()}
+        files['Dockerfile'] = Path(dockerfile.path).bytes()
+        stream_archive(dockerfile.context_paths, context, ArchiveCodec('none'), files=files)
+        context.seek(0)
+        return context
+
+    def publish_image(self, built_image):
+        if built_image.published_image:
+            return built_image.published_image
+        return self._once(('publish', built_image.cache_key), self._publish_image, built_image)
+
+    def _publish_image(self, built_image):
+        # tag is derived from content, so all experiments with same code and requirements use same image
+        repository_name, image, tag = built_image.repository_name, built_image.image, built_image.cache_key[:16]
+        image_name = '{}:{}'.format(repository_name, tag)
+
+        digest = self._get_registry_digest(image_name)
+        if digest:
+            LOGGER.info('Docker image {} already published ({})'.format(image_name, digest))
+        else:
             image.tag(repository_name, tag=tag)
             LOGGER.debug('Docker image tagged: {}'.format(tag))
-            result = self._client.images.push(repository_name, tag=tag)
+            digest = self._push_image(repository_name, tag)
             LOGGER.debug('Docker image published: {}'.format(tag))
-            if 'errorDetail' in result:
-                raise RuntimeError(result)
-            image = self._client.images.get(repository_name)
 
-        # obtain image name with our tag
-        image_name = [tag for tag in image.tags if not tag.endswith('latest')][0]
+        # pin image by digest, so all jobs run exactly same image
+        image_name = '{}@{}'.format(image_name, digest) if digest else image_name
         LOGGER.debug('Docker image {} ready'.format(image_name))
+        self._build_cache.put_image(built_image.cache_key, image_name)
         return image_name
 
-    def _generate_requirements_name(self, experiment):
-        return 'requirements_{}_{}.txt'.format(experiment.project, experiment.name)
+    def _push_image(self, repository_name, tag):
+        """Pushes image (layers are pushed concurrently by docker daemon) reporting progress; returns manifest
+        digest as soon as it is committed in registry"""
+        progress = PushProgress('{}:{}'.format(repository_name, tag))
+        for event in self._client.api.push(repository_name, tag=tag, stream=True, decode=True):
+            progress.update(event)
+            if progress.digest:
+                break
+        progress.log_summary()
+        return progress.digest
+
+    def _get_registry_digest(self, image_name):
+        """Returns digest of image manifest if it is already present in registry"""
+        try:
+            return self._client.images.get_registry_data(image_name).id
+        except APIError:
+            return None
+
+    def _once(self, key, fun, *args, **kwargs):
+        """Calls fun only once per engine session for given key; concurrent callers wait for its result"""
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            future.set_result(fun(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+            # allow to retry failed operation
+            with self._lock:
+                del self._futures[key]
+        return future.result()
+
+    def _get_paths_digest(self, paths_to_copy):
+        return self._once(('digest', paths_to_copy), get_paths_digest, paths_to_copy)
+
+    def _ensure_base_image(self, base_image, refresh_interval, force=False):
+        """Pulls base image if it wasn't pulled during last refresh_interval seconds; returns its id"""
+        image_id = None if force else self._build_cache.get_base_image(base_image, refresh_interval)
+        if image_id:
+            return image_id
+
+        LOGGER.debug('Pulling base image {}'.format(base_image))
+        image = self._client.images.pull(base_image)
+        self._build_cache.put_base_image(base_image, image.id)
+        return image.id
+
+    def _generate_requirements_name(self, requirements):
+        return 'requirements_{}.txt'.format(hashlib.sha1(requirements.encode('utf-8')).hexdigest()[:12])
 
     def _generate_repository_name(self, experiment):
-        image_name = '{}/{}'.format(experiment.project, experiment.name)
+        # repository is shared by all experiments of project; images are distinguished by content tags
+        image_name = '{}/{}'.format(experiment.project, experiment.project)
 
         # while publishing images there is need to prefix them with repository hostname
         if experiment.registry_url:
@@ -138,10 +338,6 @@ class DockerEngine(object):
 
         return image_name
 
-    def _get_tag(self):
-        from datetime import datetime
-        return datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-
     def _get_neptune_build_args(self, experiment):
         args = {}
         if experiment.local_neptune_token:
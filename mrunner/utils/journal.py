@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+import attr
+from path import Path
+
+LOGGER = logging.getLogger(__name__)
+
+JOURNAL_FILE_NAME = 'journal.sqlite'
+
+# states of experiments recorded in journal; experiments in FAILED state are submitted again on resume
+SUBMITTED = 'submitted'
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINAL_STATES = (DONE, FAILED)
+# reported (never recorded) for not finished experiments which states can't be queried - without job id (ex. srun
+# submissions) or submitted with backend which doesn't support queries (ex. local run interrupted before its end)
+UNKNOWN = 'unknown'
+STATES = (SUBMITTED, PENDING, RUNNING, DONE, FAILED, UNKNOWN)
+
+JournalEntry = attr.make_class('JournalEntry', ['key', 'sweep', 'context', 'name', 'backend_type', 'job_id',
+                                                'state', 'submitted', 'updated'], frozen=True)
+
+
+def _canonical(value):
+    # commands are identified by what is run, not by identity of wrapper objects
+    if hasattr(value, 'command'):
+        return {'command': value.command, 'env': getattr(value, 'env', {})}
+    if attr.has(type(value)):
+        return attr.asdict(value)
+    return str(value)
+
+
+# fields which don't change what is run: credentials, flags controlling delivery of code and digest of code itself
+KEY_IGNORED_FIELDS = ('local_neptune_token', 'force_upload', 'rebuild', 'code_digest')
+
+
+def experiment_key(experiment, code_digest, ignore=KEY_IGNORED_FIELDS):
+    """Canonical hash of merged experiment configuration and code it is run with"""
+    payload = json.dumps({k: v for k, v in experiment.items() if k not in ignore}, sort_keys=True,
+                         default=_canonical)
+    return hashlib.sha1('{}:{}'.format(payload, code_digest).encode('utf-8')).hexdigest()
+
+
+class SubmissionJournal(object):
+    """Local sqlite journal of submitted experiments (keyed by experiment_key) with their backend job ids
+    and last known state; makes resubmission of sweeps idempotent"""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS experiments (
+            key TEXT PRIMARY KEY,
+            sweep TEXT NOT NULL,
+            context TEXT,
+            name TEXT,
+            backend_type TEXT,
+            job_id TEXT,
+            state TEXT NOT NULL,
+            submitted REAL,
+            updated REAL
+        );
+        CREATE INDEX IF NOT EXISTS experiments_sweep ON experiments (sweep);
+    '''
+
+    def __init__(self, path):
+        self._path = Path(path).expanduser()
+        self._path.parent.makedirs_p()
+        self._lock = threading.Lock()
+        # connection is shared by pipeline threads (access is serialized with lock)
+        self._connection = sqlite3.connect(str(self._path), timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript(self.SCHEMA)
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute('SELECT * FROM experiments WHERE key = ?', (key,)).fetchone()
+        return JournalEntry(*row) if row else None
+
+    def is_submitted(self, key):
+        entry = self.get(key)
+        return entry is not None and entry.state != FAILED
+
+    def record(self, key, sweep, context, name, backend_type, job_id, state=SUBMITTED):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO experiments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (key, sweep, context, name, backend_type, job_id, state, now, now))
+
+    def update_states(self, context, states):
+        """Updates states of experiments submitted in context; states are given as {job id: state}"""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'UPDATE experiments SET state = ?, updated = ? WHERE context = ? AND job_id = ? AND state != ?',
+                [(state, now, context, str(job_id), state) for job_id, state in states.items()])
+
+    def entries(self, sweep=None, context=None):
+        conditions = [(column, value) for column, value in [('sweep', sweep), ('context', context)]
+                      if value is not None]
+        query = 'SELECT * FROM experiments'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join('{} = ?'.format(column) for column, _ in conditions)
+        with self._lock:
+            rows = self._connection.execute(query + ' ORDER BY submitted',
+                                            [value for _, value in conditions]).fetchall()
+        return [JournalEntry(*row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def refresh_states(journal, context, sweep=None):
+    """Queries backends for states of not finished experiments submitted in context (single query per backend)
+    and records them in journal; experiments in final states are not queried again. Returns journal entries; not
+    finished experiments which states can't be queried are returned in UNKNOWN state"""
+    from mrunner.backends import get_backend_class
+
+    context_name = context['context_name']
+    active_jobs = defaultdict(list)
+    for entry in journal.entries(sweep=sweep, context=context_name):
+        if entry.state not in FINAL_STATES and entry.job_id:
+            active_jobs[entry.backend_type].append(entry.job_id)
+
+    queried_backends = set()
+    for backend_type, job_ids in active_jobs.items():
+        backend_class = get_backend_class(backend_type)
+        if not hasattr(backend_class, 'query_states'):
+            continue
+        states = backend_class.query_states(context, job_ids)
+        LOGGER.debug('Got states of {} of {} {} jobs'.format(len(states), len(job_ids), backend_type))
+        journal.update_states(context_name, states)
+        queried_backends.add(backend_type)
+
+    return [entry if entry.state in FINAL_STATES or (entry.job_id and entry.backend_type in queried_backends)
+            else attr.evolve(entry, state=UNKNOWN)
+            for entry in journal.entries(sweep=sweep, context=context_name)]
+
+
+def count_states(entries):
+    """Returns {sweep: Counter of states} of given journal entries"""
+    counts = OrderedDict()
+    for entry in entries:
+        counts.setdefault(entry.sweep, Counter())[entry.state] += 1
+    return counts
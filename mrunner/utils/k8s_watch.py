@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+import attr
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+LOGGER = logging.getLogger(__name__)
+
+COMPLETION_INDEX_ANNOTATION = 'batch.kubernetes.io/job-completion-index'
+HTTP_NOT_FOUND = 404
+HTTP_GONE = 410
+
+JobResult = attr.make_class('JobResult', ['job_id', 'returncode', 'started', 'finished', 'seconds'], frozen=True)
+
+
+def pod_job_id(pod):
+    """Id of job (namespace/job) or sweep task (namespace/job/index) run by pod; None for pods not run by jobs"""
+    job_name = (pod.metadata.labels or {}).get('job-name')
+    if not job_name:
+        return None
+    index = (pod.metadata.annotations or {}).get(COMPLETION_INDEX_ANNOTATION)
+    return '/'.join([pod.metadata.namespace, job_name] + ([index] if index is not None else []))
+
+
+def _pod_result(job_id, pod):
+    terminated = None
+    for container_status in pod.status.container_statuses or []:
+        terminated = container_status.state.terminated if container_status.state else None
+    if terminated is not None:
+        returncode = terminated.exit_code
+    else:
+        # ex. evicted or deleted pods
+        returncode = 0 if pod.status.phase == 'Succeeded' else None
+    started = terminated.started_at if terminated is not None and terminated.started_at else pod.status.start_time
+    finished = terminated.finished_at if terminated is not None else None
+    seconds = (finished - started).total_seconds() if started and finished else None
+    return JobResult(job_id=job_id, returncode=returncode, started=started, finished=finished, seconds=seconds)
+
+
+class JobsTracker(object):
+    """Completion state of awaited jobs built from events of their pods
+
+    Only the newest pod of each job (sweep task) counts. Failure of single job pod is final (such jobs are not
+    retried), while failed sweep task may still be retried - it is final only once its job is finished. Finished
+    sweep may also leave tasks which never got pods (ex. when its backoffLimit is reached before they start).
+    """
+
+    def __init__(self, job_ids):
+        self.results = {}
+        self.phases = {}  # job id -> phase of its newest pod
+        self._pending = set(job_ids)
+        self._newest_pods = {}  # job id -> (creation timestamp, pod name)
+        self._failed_tasks = {}  # job id -> result of failed pod of sweep task (which may be retried)
+
+    @property
+    def pending(self):
+        return self._pending - set(self._failed_tasks)
+
+    @property
+    def finished(self):
+        return not self._pending
+
+    def unresolved_jobs(self):
+        """(namespace, job name) of sweeps which state can't be told from their pods - ones with failed tasks or
+        with tasks which haven't got any pod yet"""
+        return {tuple(job_id.split('/')[:2]) for job_id in self._pending
+                if job_id.count('/') == 2 and (job_id in self._failed_tasks or job_id not in self._newest_pods)}
+
+    def on_pod(self, pod, deleted=False):
+        job_id = pod_job_id(pod)
+        if job_id not in self._pending:
+            return
+        pod_key = (pod.metadata.creation_timestamp, pod.metadata.name)
+        if job_id in self._newest_pods and pod_key < self._newest_pods[job_id]:
+            return  # event of pod replaced by retry
+        self._newest_pods[job_id] = pod_key
+
+        phase = pod.status.phase
+        self.phases[job_id] = phase
+        if phase == 'Succeeded':
+            self._finish(job_id, _pod_result(job_id, pod))
+        elif phase == 'Failed' or deleted:
+            result = _pod_result(job_id, pod)
+            if job_id.count('/') == 2:
+                self._failed_tasks[job_id] = result
+            else:
+                self._finish(job_id, result)
+        else:
+            self._failed_tasks.pop(job_id, None)
+
+    def on_job_finished(self, namespace, job_name, succeeded=False):
+        """All tasks of finished sweep are final: failures of failed ones, as well as of ones still awaited (pods of
+        failed sweep are terminated, never started tasks won't start); tasks of succeeded sweep whose pods weren't
+        seen (ex. already garbage collected) are done"""
+        for job_id in [j for j in self._pending if tuple(j.split('/')[:2]) == (namespace, job_name)]:
+            result = self._failed_tasks.get(job_id) or JobResult(job_id=job_id, returncode=0 if succeeded else None,
+                                                                 started=None, finished=None, seconds=None)
+            self._finish(job_id, result)
+
+    def _finish(self, job_id, result):
+        self._failed_tasks.pop(job_id, None)
+        self._pending.discard(job_id)
+        self.results[job_id] = result
+        log = LOGGER.info if result.returncode == 0 else LOGGER.warning
+        log('{} finished with code {}{}'.format(
+            job_id, result.returncode, ' in {:.1f}s'.format(result.seconds) if result.seconds is not None else ''))
+
+
+class JobsWatcher(object):
+    """Waits for jobs created by mrunner using single watch stream of their pods
+
+    Pods are listed once, then watched from resourceVersion of that list. Version is kept up to date with
+    bookmarks, thus stream reconnects (watches are closed by server after a while) don't replay events; only when
+    version is too old (410 Gone) pods are listed again.
+    """
+    WATCH_TIMEOUT = 300
+    LIST_PAGE_SIZE = 500
+
+    def __init__(self, core_api, batch_api, label_selector):
+        self.core_api = core_api
+        self.batch_api = batch_api
+        self.label_selector = label_selector
+        self.api_calls = 0
+
+    def snapshot(self, job_ids):
+        """Current state of jobs without watching them (pods are listed once per namespace); returns JobsTracker"""
+        tracker = JobsTracker(job_ids)
+        for namespace in sorted({job_id.split('/')[0] for job_id in job_ids}):
+            self._list(tracker, namespace)
+        self._resolve_jobs(tracker)
+        return tracker
+
+    def wait(self, job_ids, timeout=None):
+        """Waits for jobs (namespace/job or namespace/job/index ids); returns {job id: JobResult} of jobs finished
+        before timeout (in seconds)"""
+        tracker = JobsTracker(job_ids)
+        namespaces = {job_id.split('/')[0] for job_id in job_ids}
+        # single namespace needs only namespaced permissions
+        namespace = namespaces.pop() if len(namespaces) == 1 else None
+        deadline = time.time() + timeout if timeout is not None else None
+
+        resource_version = self._list(tracker, namespace)
+        while not tracker.finished:
+            # also when deadline is reached - tasks of finished sweeps are resolved before giving up
+            self._resolve_jobs(tracker)
+            remaining = deadline - time.time() if deadline is not None else self.WATCH_TIMEOUT
+            if tracker.finished or remaining <= 0:
+                break
+            try:
+                resource_version = self._watch(tracker, namespace, resource_version,
+                                               int(max(1, min(remaining, self.WATCH_TIMEOUT))))
+            except ApiException as e:
+                if e.status != HTTP_GONE:
+                    raise
+                LOGGER.debug('Watched resource version expired; listing pods again')
+                resource_version = self._list(tracker, namespace)
+
+        if not tracker.finished:
+            LOGGER.warning('{} jobs not finished in {}s'.format(len(job_ids) - len(tracker.results), timeout))
+        LOGGER.debug('Kubernetes API calls while waiting: {}'.format(self.api_calls))
+        return tracker.results
+
+    def _list(self, tracker, namespace):
+        """Feeds tracker with current pods; returns resource version to watch from"""
+        continue_token = None
+        while True:
+            kwargs = dict(label_selector=self.label_selector, limit=self.LIST_PAGE_SIZE)
+            if continue_token:
+                kwargs['_continue'] = continue_token
+            self.api_calls += 1
+            if namespace:
+                pods = self.core_api.list_namespaced_pod(namespace, **kwargs)
+            else:
+                pods = self.core_api.list_pod_for_all_namespaces(**kwargs)
+            for pod in pods.items:
+                tracker.on_pod(pod)
+            continue_token = pods.metadata._continue
+            if not continue_token:
+                return pods.metadata.resource_version
+
+    def _watch(self, tracker, namespace, resource_version, timeout_seconds):
+        """Feeds tracker with pods events till stream is closed (or all jobs are finished); returns last seen
+        resource version"""
+        for event in self._stream(namespace, resource_version, timeout_seconds):
+            if event['type'] == 'BOOKMARK':
+                # bookmarks carry only resource version (not tracked by watch client itself)
+                resource_version = event['raw_object']['metadata']['resourceVersion']
+                self._resolve_jobs(tracker)
+            else:
+                pod = event['object']
+                resource_version = pod.metadata.resource_version
+                tracker.on_pod(pod, deleted=event['type'] == 'DELETED')
+            if tracker.finished:
+                break
+        return resource_version
+
+    def _stream(self, namespace, resource_version, timeout_seconds):
+        self.api_calls += 1
+        kwargs = dict(label_selector=self.label_selector, resource_version=resource_version,
+                      allow_watch_bookmarks=True, timeout_seconds=timeout_seconds)
+        # with timeout_seconds watch client doesn't reconnect by itself - it is done (from our version) by caller
+        if namespace:
+            return watch.Watch().stream(self.core_api.list_namespaced_pod, namespace, **kwargs)
+        return watch.Watch().stream(self.core_api.list_pod_for_all_namespaces, **kwargs)
+
+    def _resolve_jobs(self, tracker):
+        # job status is read only for sweeps which can't be resolved from their pods
+        for namespace, job_name in sorted(tracker.unresolved_jobs()):
+            self.api_calls += 1
+            try:
+                job = self.batch_api.read_namespaced_job_status(job_name, namespace)
+            except ApiException as e:
+                if e.status != HTTP_NOT_FOUND:
+                    raise
+                job = None  # deleted jobs are not retried
+            conditions = {c.type for c in (job.status.conditions or []) if c.status == 'True'} if job else set()
+            if job is None or conditions & {'Complete', 'Failed'}:
+                tracker.on_job_finished(namespace, job_name, succeeded='Complete' in conditions)
@@ -36,19 +36,24 @@ class NeptuneConfigFileBase(object):
             else:
                 type = 'string'
                 value = str(value)
-            return NeptuneConfigFileBase.Parameter(name, type, value, False)
+            return NeptuneConfigFileBase.Parameter(str(name), type, value, False)
 
     def __init__(self, project, name, parameters, tags=None, description=None, **kwargs):
-        self._project = project
-        self._name = name
+        self._project = str(project)
+        self._name = str(name)
         self._parameters = [self.Parameter.create(k, v) for k, v in parameters.items()]
-        self._description = description
-        self._tags = tags
-        self._exclude = kwargs.get('exclude', [])
+        self._description = str(description) if description else description
+        self._tags = [str(tag) for tag in tags] if tags else tags
+        self._exclude = [str(path) for path in kwargs.get('exclude', None) or []]
 
-    def dump(self, fh):
+    def dumps(self):
+        """Renders config in memory (with libyaml emitter if available)"""
         import yaml
-        yaml.dump(self._format_data(), fh, default_flow_style=False)
+        dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+        return yaml.dump(self._format_data(), Dumper=dumper, default_flow_style=False)
+
+    def dump(self, fh):
+        fh.write(self.dumps())
 
     def _format_data(self):
         raise NotImplementedError()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+from six.moves import queue
+
+LOGGER = logging.getLogger(__name__)
+
+# marks end of items stream in queue between stages
+_END = object()
+
+
+class Stage(object):
+
+    def __init__(self, name, fun, workers=1):
+        self.name = name
+        self.fun = fun
+        self.workers = max(int(workers), 1)
+        self.processed = 0
+        self.busy_time = 0.0
+
+
+class Pipeline(object):
+    """Pushes items through chain of stages
+
+    Each stage has its own pool of worker threads and is connected with next stage by bounded queue, thus
+    processing of item k+1 in one stage overlaps with processing of item k in following one. Total time is limited
+    by slowest stage and not by sum of all of them.
+    """
+
+    def __init__(self, stages, queue_size=None):
+        self._stages = stages
+        self._queue_size = queue_size or 2 * max(stage.workers for stage in stages)
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        self._error = None
+
+    def run(self, items):
+        """Generator yielding results of last stage (in order of completion, not in order of items)"""
+        self._abort.clear()
+        self._error = None
+        queues = [queue.Queue(maxsize=self._queue_size) for _ in self._stages] + [queue.Queue()]
+
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], self._stages[0].workers),
+                                    name='mrunner-expand')]
+        for idx, stage in enumerate(self._stages):
+            next_workers = self._stages[idx + 1].workers if idx + 1 < len(self._stages) else 1
+            running = [stage.workers]
+            for worker_idx in range(stage.workers):
+                threads.append(threading.Thread(target=self._work,
+                                                args=(stage, queues[idx], queues[idx + 1], running, next_workers),
+                                                name='mrunner-{}-{}'.format(stage.name, worker_idx)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        start_time = time.time()
+        results_queue = queues[-1]
+        result = None
+        try:
+            while True:
+                result = results_queue.get()
+                if result is _END:
+                    break
+                yield result
+        finally:
+            # in case if consumer stopped iteration - drain items and let workers finish
+            if result is not _END:
+                self._abort.set()
+                while results_queue.get() is not _END:
+                    pass
+            for thread in threads:
+                thread.join()
+            self._log_stats(time.time() - start_time)
+
+        if self._error is not None:
+            raise self._error
+
+    def _feed(self, items, out_queue, next_workers):
+        try:
+            for item in items:
+                if self._abort.is_set():
+                    break
+                out_queue.put(item)
+        except Exception as e:
+            self._fail('expand', e)
+        finally:
+            for _ in range(next_workers):
+                out_queue.put(_END)
+
+    def _work(self, stage, in_queue, out_queue, running, next_workers):
+        while True:
+            item = in_queue.get()
+            if item is _END:
+                break
+            if self._abort.is_set():
+                # just drain queue, so previous stage is not blocked
+                continue
+
+            start_time = time.time()
+            try:
+                result = stage.fun(item)
+            except Exception as e:
+                self._fail(stage.name, e)
+                continue
+            finally:
+                with self._lock:
+                    stage.processed += 1
+                    stage.busy_time += time.time() - start_time
+            out_queue.put(result)
+
+        # last finishing worker notifies next stage
+        with self._lock:
+            running[0] -= 1
+            is_last = running[0] == 0
+        if is_last:
+            for _ in range(next_workers):
+                out_queue.put(_END)
+
+    def _fail(self, stage_name, error):
+        with self._lock:
+            if self._error is None:
+                LOGGER.debug('Stage {} failed: {}'.format(stage_name, error))
+                self._error = error
+        self._abort.set()
+
+    def _log_stats(self, total_time):
+        for stage in self._stages:
+            LOGGER.debug('Stage {}: {} items processed by {} workers; busy {:.2f}s'.format(
+                stage.name, stage.processed, stage.workers, stage.busy_time))
+        LOGGER.debug('Pipeline finished in {:.2f}s'.format(total_time))
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import logging
+import multiprocessing
+import os
+import runpy
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import attr
+
+LOGGER = logging.getLogger(__name__)
+
+SHELL_METACHARACTERS = '$`|&;<>(){}*?~\\'
+
+TaskResult = attr.make_class('TaskResult', ['name', 'returncode', 'seconds', 'log_path'], frozen=True)
+
+
+class ResourceSlots(object):
+    """Counting semaphore over several resources (ex. cpu=16, mem=64G); acquire blocks until all requested
+    amounts are available"""
+
+    def __init__(self, **capacity):
+        self.capacity = capacity
+        self._available = dict(capacity)
+        self._condition = threading.Condition()
+
+    def acquire(self, **amounts):
+        for name, amount in amounts.items():
+            if amount > self.capacity.get(name, 0):
+                raise ValueError('Requested {}={} exceeds available {}'.format(name, amount,
+                                                                              self.capacity.get(name, 0)))
+        with self._condition:
+            self._condition.wait_for(lambda: all(self._available.get(k, 0) >= v for k, v in amounts.items()))
+            for name, amount in amounts.items():
+                self._available[name] = self._available.get(name, 0) - amount
+
+    def release(self, **amounts):
+        with self._condition:
+            for name, amount in amounts.items():
+                self._available[name] = self._available.get(name, 0) + amount
+            self._condition.notify_all()
+
+
+def _is_python(executable):
+    return os.path.basename(executable).startswith('python')
+
+
+def _is_python_script(path):
+    try:
+        with open(path, 'rb') as script:
+            first_line = script.readline(256)
+    except IOError:
+        return False
+    return path.endswith('.py') or (first_line.startswith(b'#!') and b'python' in first_line)
+
+
+def _forkable_argv(command, cwd):
+    """Returns argv of python command which can be run in forked process (None for other commands; they
+    are run with shell)"""
+    if any(c in command for c in SHELL_METACHARACTERS):
+        return None
+    argv = shlex.split(command)
+    if not argv:
+        return None
+    if _is_python(argv[0]):
+        # interpreter options other than -m can't be applied to already running forkserver
+        flags = [arg for arg in argv[1:2] if arg.startswith('-')]
+        return argv if len(argv) > 1 and flags in ([], ['-m']) else None
+    script = shutil.which(argv[0]) or os.path.join(cwd, argv[0])
+    return [script] + argv[1:] if _is_python_script(script) else None
+
+
+def _run_in_forked_process(argv, env, cwd, log_path):
+    """Runs python command in process forked from forkserver (with modules already preloaded by it)"""
+    os.chdir(cwd)
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.environ.update(env)
+
+    python_path = [p for p in env.get('PYTHONPATH', '').split(':') if p]
+    try:
+        if _is_python(argv[0]):
+            argv = argv[1:]
+            if argv[0] == '-m':
+                sys.argv = argv[1:]
+                sys.path[:0] = [cwd] + python_path
+                runpy.run_module(argv[1], run_name='__main__', alter_sys=True)
+                return
+
+        sys.argv = argv
+        sys.path[:0] = [os.path.dirname(os.path.abspath(argv[0]))] + python_path
+        runpy.run_path(argv[0], run_name='__main__')
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+class ProcessPool(object):
+    """Runs commands in background processes, as long as there are free resource slots
+
+    With preload (list of module names), commands are started from forkserver which has these modules
+    already imported; python commands (`python script.py`, `python -m module` or python console scripts)
+    thus don't pay interpreter and imports startup. Other commands are run with shell.
+    """
+
+    def __init__(self, slots, preload=None):
+        self._slots = slots
+        self._context = None
+        if preload is not None:
+            self._context = multiprocessing.get_context('forkserver')
+            self._context.set_forkserver_preload(list(preload))
+        self._lock = threading.Lock()
+        self._threads = []
+        self.results = []
+
+    def submit(self, name, command, env, cwd, log_path, resources):
+        """Starts command when requested resources are available (blocks till then); output is written
+        into log_path"""
+        self._slots.acquire(**resources)
+        try:
+            start_time = time.time()
+            wait = self._start(command, env, cwd, log_path)
+        except Exception:
+            self._slots.release(**resources)
+            raise
+        LOGGER.debug('Started {}: {}'.format(name, command))
+
+        def _watch():
+            try:
+                returncode = wait()
+            finally:
+                self._slots.release(**resources)
+            result = TaskResult(name=name, returncode=returncode, seconds=time.time() - start_time, log_path=log_path)
+            log = LOGGER.info if returncode == 0 else LOGGER.warning
+            log('{} finished with code {} in {:.1f}s (output: {})'.format(name, returncode, result.seconds, log_path))
+            with self._lock:
+                self.results.append(result)
+
+        thread = threading.Thread(target=_watch, name='watch-{}'.format(name), daemon=True)
+        thread.start()
+        with self._lock:
+            self._threads.append(thread)
+
+    def wait(self):
+        """Waits for all submitted commands; returns their results"""
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+        with self._lock:
+            return list(self.results)
+
+    def _start(self, command, env, cwd, log_path):
+        argv = _forkable_argv(command, cwd) if self._context is not None else None
+        if argv is not None:
+            process = self._context.Process(target=_run_in_forked_process, args=(argv, env, cwd, log_path))
+            process.start()
+
+            def _wait():
+                process.join()
+                return process.exitcode
+
+            return _wait
+
+        with open(log_path, 'wb') as log_file:
+            process = subprocess.Popen(command, shell=True, env=dict(os.environ, **env), cwd=cwd, stdout=log_file,
+                                       stderr=subprocess.STDOUT)
+        return process.wait
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import importlib.util
+import logging
+import marshal
+import os
+import threading
+
+from path import Path
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SPEC_CACHE_DIR = '~/.cache/mrunner/specs'
+
+
+class SpecCache(object):
+    """Cache of experiments spec scripts: compiled code objects are stored on disk (keyed by script path
+    and content hash), and executed scripts are kept in memory, so each of them is evaluated once per process
+    in its own namespace"""
+
+    def __init__(self, cache_dir=DEFAULT_SPEC_CACHE_DIR):
+        self._cache_dir = Path(cache_dir).expanduser()
+        self._lock = threading.RLock()
+        self._namespaces = {}
+
+    def get_spec(self, script, spec):
+        """Returns callable named spec from script (None if script doesn't define one)"""
+        script = Path(script).abspath()
+        source = script.bytes()
+        digest = hashlib.sha1(source).hexdigest()
+        with self._lock:
+            key = (str(script), digest)
+            if key not in self._namespaces:
+                self._namespaces[key] = self._execute(script, source, digest)
+            spec_fun = self._namespaces[key].get(spec, None)
+        return spec_fun if callable(spec_fun) else None
+
+    def _execute(self, script, source, digest):
+        namespace = {
+            'script': str(script.name),
+            '__file__': str(script),
+        }
+        exec(self._get_code(script, source, digest), namespace)
+        return namespace
+
+    def _get_code(self, script, source, digest):
+        # code objects are specific to python version (checked with magic number)
+        code_path = self._cache_dir / '{}.pyc'.format(hashlib.sha1(
+            '{}:{}'.format(script, digest).encode('utf-8')).hexdigest())
+        magic = importlib.util.MAGIC_NUMBER
+        try:
+            data = code_path.bytes()
+            if data.startswith(magic):
+                return marshal.loads(data[len(magic):])
+        except (IOError, ValueError, EOFError, TypeError):
+            pass
+
+        LOGGER.debug('Compiling {}'.format(script))
+        code = compile(source, str(script), 'exec')
+        try:
+            # write atomically - cache may be shared by concurrently running mrunner processes
+            code_path.parent.makedirs_p()
+            tmp_path = code_path + '.{}.{}.tmp'.format(os.getpid(), threading.get_ident())
+            with open(tmp_path, 'wb') as code_file:
+                code_file.write(magic + marshal.dumps(code))
+            Path(tmp_path).rename(code_path)
+        except (IOError, OSError) as e:
+            LOGGER.debug('Could not cache compiled {}: {}'.format(script, e))
+        return code
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import atexit
+import logging
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from path import Path
+
+LOGGER = logging.getLogger(__name__)
+
+CONTROL_PERSIST_SECONDS = 600
+
+
+class SSHTransport(object):
+    """Persistent, multiplexed ssh connection to remote host
+
+    Uses OpenSSH ControlMaster, thus there is only one authenticated session per host; commands, rsync and scp
+    calls are just new channels of it. Each operation is separate ssh client process, so transport may be safely
+    used from multiple threads.
+    """
+
+    def __init__(self, url, control_persist=CONTROL_PERSIST_SECONDS):
+        self.url = url
+        self._control_persist = control_persist
+        # keep control socket path short - unix sockets paths are limited to ~100 chars
+        self._control_dir = Path(tempfile.mkdtemp(prefix='mrunner_ssh_', dir='/tmp'))
+        self._control_path = self._control_dir / 'cm'
+        self._lock = threading.Lock()
+        self._master_started = False
+        self._latencies = defaultdict(list)
+
+    @property
+    def ssh_options(self):
+        return ['-o', 'ControlMaster=auto', '-o', 'ControlPath={}'.format(self._control_path),
+                '-o', 'ControlPersist={}'.format(self._control_persist), '-o', 'BatchMode=yes']
+
+    def run(self, cmd, stdin=None):
+        """Runs shell command on remote host and returns its output; stdin may be file object streamed to command"""
+        self._ensure_master()
+        LOGGER.debug('[{}] run: {}'.format(self.url, cmd))
+        with self._measure('run'):
+            process = subprocess.Popen(['ssh'] + self.ssh_options + [self.url, cmd],
+                                       stdin=stdin if stdin is not None else subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = process.communicate()
+        if process.returncode:
+            raise RuntimeError('Command "{}" failed on {} (exit code {}): {}'.format(
+                cmd, self.url, process.returncode, stderr.decode('utf-8', 'replace').strip()))
+        return stdout.decode('utf-8', 'replace').strip()
+
+    def stream(self, cmd, writer):
+        """Runs remote command and feeds its stdin with data written by writer(fileobj); returns writer result"""
+        self._ensure_master()
+        LOGGER.debug('[{}] stream: {}'.format(self.url, cmd))
+        with tempfile.TemporaryFile() as stderr, self._measure('stream'):
+            process = subprocess.Popen(['ssh'] + self.ssh_options + [self.url, cmd],
+                                       stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+            try:
+                result = writer(process.stdin)
+                process.stdin.close()
+            except BrokenPipeError:
+                # remote command failed - error is reported below
+                result = None
+            process.wait()
+            if process.returncode:
+                stderr.seek(0)
+                raise RuntimeError('Command "{}" failed on {} (exit code {}): {}'.format(
+                    cmd, self.url, process.returncode, stderr.read().decode('utf-8', 'replace').strip()))
+        return result
+
+    def put(self, local_path, remote_path, quiet=True):
+        """Copies local file or directory to remote path with rsync tunneled through shared connection"""
+        self._ensure_master()
+        rsh = ' '.join(['ssh'] + self.ssh_options)
+        cmd = ['rsync', '-pthrz', '--rsh', rsh] + (['-q'] if quiet else []) + \
+              [str(local_path), '{}:{}'.format(self.url, remote_path)]
+        LOGGER.debug('[{}] put: {} -> {}'.format(self.url, local_path, remote_path))
+        with self._measure('put'):
+            subprocess.check_call(cmd)
+
+    def close(self):
+        with self._lock:
+            if self._master_started:
+                subprocess.call(['ssh'] + self.ssh_options + ['-O', 'exit', self.url],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                self._master_started = False
+            self._control_dir.rmtree_p()
+        for operation, latencies in sorted(self.stats.items()):
+            LOGGER.debug('[{}] {}: {} calls; avg {:.3f}s; max {:.3f}s'.format(
+                self.url, operation, len(latencies), sum(latencies) / len(latencies), max(latencies)))
+
+    @property
+    def stats(self):
+        """Latencies (in seconds) of performed operations grouped by operation type"""
+        with self._lock:
+            return {k: list(v) for k, v in self._latencies.items()}
+
+    def _ensure_master(self):
+        with self._lock:
+            if not self._master_started:
+                start_time = time.time()
+                subprocess.check_call(['ssh', '-M', '-N', '-f'] + self.ssh_options + [self.url])
+                self._master_started = True
+                self._latencies['connect'].append(time.time() - start_time)
+                LOGGER.debug('[{}] connected in {:.3f}s'.format(self.url, time.time() - start_time))
+
+    @contextmanager
+    def _measure(self, operation):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._latencies[operation].append(time.time() - start_time)
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(url):
+    """Returns transport shared by all users of given [user@]host"""
+    with _transports_lock:
+        if url not in _transports:
+            _transports[url] = SSHTransport(url)
+        return _transports[url]
+
+
+@atexit.register
+def close_transports():
+    with _transports_lock:
+        transports = list(_transports.values())
+        _transports.clear()
+    for transport in transports:
+        transport.close()
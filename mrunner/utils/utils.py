@@ -1,13 +1,20 @@
 import datetime
+import hashlib
+import itertools
 import logging
+import os
+import re
+import shlex
+import time
 from collections import namedtuple, OrderedDict
+from functools import lru_cache
 from tempfile import NamedTemporaryFile
 
 import attr
-from jinja2 import Environment, PackageLoader, StrictUndefined
 from path import Path
 
 from mrunner.utils.namesgenerator import id_generator
+from mrunner.utils.walker import IgnoreRules, Walker
 
 LOGGER = logging.getLogger(__name__)
 
@@ -28,10 +35,14 @@ def parse_argv(parser, argv):
     return parser.parse_args(args=mrunner_argv), rest_argv
 
 
-template_env = Environment(
-    loader=PackageLoader('mrunner', 'templates'),
-    undefined=StrictUndefined
-)
+@lru_cache(maxsize=1)
+def get_template_env():
+    # jinja2 is imported on first use - it noticeably slows down CLI startup
+    from jinja2 import Environment, PackageLoader, StrictUndefined
+    return Environment(
+        loader=PackageLoader('mrunner', 'templates'),
+        undefined=StrictUndefined
+    )
 
 
 class TempFile(object):
@@ -52,42 +63,51 @@ class GeneratedTemplateFile(TempFile):
 
     def __init__(self, template_filename=None, **kwargs):
         super(GeneratedTemplateFile, self).__init__()
-        template = template_env.get_template(template_filename)
+        template = get_template_env().get_template(template_filename)
         payload = template.render(**kwargs).encode(encoding='utf-8')
         self.write(payload)
 
 
 PathToDump = namedtuple('PathToDump', 'local_path rel_remote_path')
 
+DEFAULT_EXCLUDE = ['.git', '.gitignore', '.gitmodules']
 
-def get_paths_to_copy(paths_to_copy=None, exclude=None):
-    """Lists paths to copy from current working directory, after excluding paths from exclude list;
-    additionally paths_to_copy are copied"""
+
+def get_paths_to_copy(paths_to_copy=None, exclude=None, max_files=None, max_size=None):
+    """Lists paths to copy from current working directory, after excluding paths from exclude list and ones ignored
+    by .gitignore/.mrunnerignore files; additionally paths_to_copy are copied. Result is memoized, so it may be
+    called for each experiment of sweep; call get_paths_to_copy.cache_clear() when files may have changed since
+    (it is done at start of each run and backend session)."""
 
     if paths_to_copy is None:
         paths_to_copy = []
     if exclude is None:
-        exclude = ['.git', '.gitignore', '.gitmodules']
-    exclude = [Path(e).abspath() for e in exclude]
-
-    def _list_dir(d):
-        directories = []
-        for p in Path(d).listdir():
-            p = p.abspath()
-            excluded = False
-            for e in exclude:
-                e = e.abspath()
-                if not e.relpath(p).startswith('..'):
-                    excluded = True
-                    # if excluded subdir - not whole current
-                    if e != p:
-                        directories += _list_dir(p)
-                    break
-            if not excluded:
-                directories.append(PathToDump(p.relpath('.'), p.relpath('.')))
-        return directories
-
-    result = _list_dir(Path('.'))
+        exclude = DEFAULT_EXCLUDE
+    return _get_paths_to_copy(Path.getcwd(), tuple(str(p) for p in paths_to_copy), tuple(str(e) for e in exclude),
+                              parse_size(max_files), parse_size(max_size))
+
+
+def get_code_paths(exclude=None, generated_neptune_config=None, paths_to_copy=None, max_files=None, max_size=None):
+    """Lists paths of experiment code (see get_paths_to_copy); directory of generated neptune configs is excluded,
+    as configs are not part of code and are deployed separately"""
+    exclude = list(exclude if exclude is not None else DEFAULT_EXCLUDE)
+    if generated_neptune_config:
+        exclude.append(Path(generated_neptune_config).parent)
+    return get_paths_to_copy(paths_to_copy=paths_to_copy, exclude=exclude, max_files=max_files, max_size=max_size)
+
+
+@lru_cache(maxsize=32)
+def _get_paths_to_copy(cwd, paths_to_copy, exclude, max_files, max_size):
+    # exclude list contains paths (or globs) relative to cwd
+    exclude_patterns = []
+    for e in exclude:
+        rel_path = Path(cwd).relpathto(Path(e).abspath())
+        if not rel_path.startswith('..'):
+            exclude_patterns.append('/' + rel_path)
+    rules = IgnoreRules().extend(exclude_patterns)
+    walker = Walker(cwd, rules=rules, max_files=max_files, max_size=max_size)
+    result = [PathToDump(Path(p), Path(p)) for p in walker.list_top_paths()]
+
     for external in paths_to_copy:
         if ':' in external:
             src, rel_dst = external.split(':')
@@ -97,13 +117,66 @@ def get_paths_to_copy(paths_to_copy=None, exclude=None):
             rel_dst = '/'.join([item for item in Path(external).relpath('.').splitall() if item and item != '..'])
         result.append(PathToDump(Path(src).relpath('.'), Path(rel_dst).relpath('.')))
 
-    result = set(result)
-    LOGGER.debug('get_paths_to_copy(paths_to_copy={}, exclude={}) result={}'.format(
-        paths_to_copy, exclude, [str(s) for s, d in result]
+    result = frozenset(result)
+    LOGGER.debug('get_paths_to_copy(paths_to_copy={}, exclude={}) result={} ({} files, {} bytes)'.format(
+        paths_to_copy, exclude, [str(s) for s, d in result], walker.files_count, walker.total_size
     ))
     return result
 
 
+get_paths_to_copy.cache_clear = _get_paths_to_copy.cache_clear
+
+
+def parse_size(size):
+    """Parses size given as number or string with K/M/G/T suffix (ex. 500M)"""
+    if size is None or isinstance(size, int):
+        return size
+    size = str(size).strip().upper().rstrip('BI')
+    multipliers = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+    if size[-1:] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def get_paths_digest(paths_to_dump):
+    """Content hash of all files from given paths (as returned by get_paths_to_copy); doesn't depend on
+    paths order nor on files timestamps"""
+
+    def _list_files(local_path, rel_path):
+        if not os.path.isdir(local_path) or os.path.islink(local_path):
+            yield rel_path, local_path
+            return
+        for root, dirs, files in os.walk(local_path):
+            dirs.sort()
+            rel_root = os.path.join(rel_path, os.path.relpath(root, local_path))
+            # symlinks to directories are not followed, but included as links
+            for name in sorted(files + [d for d in dirs if os.path.islink(os.path.join(root, d))]):
+                yield os.path.join(rel_root, name), os.path.join(root, name)
+
+    digest = hashlib.sha1()
+    for path_to_dump in sorted(paths_to_dump, key=lambda p: str(p.rel_remote_path)):
+        for rel_path, file_path in _list_files(str(path_to_dump.local_path), str(path_to_dump.rel_remote_path)):
+            rel_path = os.path.normpath(rel_path)
+            if os.path.islink(file_path):
+                digest.update('{}\0->{}\0'.format(rel_path, os.readlink(file_path)).encode('utf-8'))
+                continue
+            stat = os.stat(file_path)
+            digest.update('{}\0{}\0{}\0'.format(rel_path, stat.st_size, stat.st_mode & 0o111).encode('utf-8'))
+            with open(file_path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def shell_export(name, value):
+    """Shell command exporting env variable; value is quoted, only references to previous value of variable
+    (ex. PYTHONPATH=$PYTHONPATH:src) are expanded"""
+    reference = re.compile(r'\$(?:{name}(?![A-Za-z0-9_])|\{{{name}\}})'.format(name=re.escape(name)))
+    parts = reference.split(str(value))
+    quoted = '"${{{}}}"'.format(name).join(shlex.quote(part) if part else '' for part in parts)
+    return 'export {}={};'.format(name, quoted or "''")
+
+
 def make_attr_class(class_name, fields, **class_kwargs):
     fields = OrderedDict([(k, attr.ib(**kwargs) if isinstance(kwargs, dict) else kwargs) for k, kwargs in fields])
     return attr.make_class(class_name, fields, **class_kwargs)
@@ -116,3 +189,40 @@ def filter_only_attr(AttrClass, d):
             continue
         LOGGER.debug('Ignoring argument {}={}'.format(k, v))
     return {k: v for k, v in d.items() if k in available_fields}
+
+
+def chunks(iterable, size):
+    """Splits iterable into lists of at most size items; consumes it lazily"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ThroughputMeter(object):
+    """Counts processed items and periodically logs throughput (items per second)"""
+
+    def __init__(self, what='experiments', interval=10.0, clock=time.time):
+        self.what = what
+        self.count = 0
+        self._interval = interval
+        self._clock = clock
+        self._start_time = clock()
+        self._last_log_time = self._start_time
+
+    @property
+    def rate(self):
+        elapsed = self._clock() - self._start_time
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def update(self, count=1):
+        self.count += count
+        now = self._clock()
+        if now - self._last_log_time >= self._interval:
+            self._last_log_time = now
+            self.log()
+
+    def log(self):
+        LOGGER.info('{} {} submitted ({:.1f} {}/s)'.format(self.count, self.what, self.rate, self.what))
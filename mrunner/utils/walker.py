@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import re
+
+LOGGER = logging.getLogger(__name__)
+
+# files with patterns (in .gitignore format) of paths which shall not be deployed
+IGNORE_FILES = ['.gitignore', '.mrunnerignore']
+
+
+def _translate(pattern):
+    """Translates gitignore glob into regexp (without anchors)"""
+    i, n, result = 0, len(pattern), ''
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            result += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == n:
+            result += '/.*'
+            i += 3
+        elif pattern.startswith('**', i):
+            result += '.*'
+            i += 2
+        elif c == '*':
+            result += '[^/]*'
+            i += 1
+        elif c == '?':
+            result += '[^/]'
+            i += 1
+        elif c == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            chars = pattern[i + 1:end]
+            if chars[0] == '!':
+                chars = '^' + chars[1:]
+            result += '[{}]'.format(chars.replace('\\', '\\\\'))
+            i = end + 1
+        elif c == '\\' and i + 1 < n:
+            result += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            result += re.escape(c)
+            i += 1
+    return result
+
+
+class IgnorePattern(object):
+
+    def __init__(self, pattern, base=''):
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # patterns with slash (other than trailing one) are relative to directory of ignore file
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        prefix = re.escape(base + '/') if base else ''
+        self._regexp = re.compile('^{}{}{}$'.format(prefix, '' if anchored else '(?:.*/)?', _translate(pattern)))
+
+    def match(self, rel_path, is_dir):
+        return (is_dir or not self.dir_only) and self._regexp.match(rel_path) is not None
+
+
+class IgnoreRules(object):
+    """Compiled set of ignore patterns with .gitignore semantics (last matching pattern decides)"""
+
+    def __init__(self, patterns=()):
+        self._patterns = list(patterns)
+
+    def extend(self, lines, base=''):
+        """Returns rules extended with patterns from ignore file placed in base directory"""
+        patterns = []
+        for line in lines:
+            line = line.rstrip('\n')
+            if not line.endswith('\\ '):
+                line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            patterns.append(IgnorePattern(line, base=base))
+        return IgnoreRules(self._patterns + patterns) if patterns else self
+
+    def is_ignored(self, rel_path, is_dir=False):
+        for pattern in reversed(self._patterns):
+            if pattern.match(rel_path, is_dir):
+                return not pattern.negate
+        return False
+
+
+class LimitExceeded(ValueError):
+    pass
+
+
+class Walker(object):
+    """Walks directory tree using os.scandir; ignored directories are pruned (never listed)"""
+
+    def __init__(self, root, rules=None, max_files=None, max_size=None):
+        self._root = root
+        self._rules = rules or IgnoreRules()
+        self._max_files = max_files
+        self._max_size = max_size
+        self.files_count = 0
+        self.total_size = 0
+
+    def list_top_paths(self):
+        """Lists minimal set of (relative) paths covering all not ignored files: directories without
+        any ignored entries are listed as a whole, other ones are replaced by their content"""
+        paths, _ = self._scan('', self._rules)
+        return paths
+
+    def _scan(self, rel_dir, rules):
+        abs_dir = os.path.join(self._root, rel_dir)
+        with os.scandir(abs_dir) as it:
+            entries = sorted(it, key=lambda e: e.name)
+
+        for entry in entries:
+            if entry.name in IGNORE_FILES and entry.is_file():
+                with open(entry.path) as ignore_file:
+                    rules = rules.extend(ignore_file.readlines(), base=rel_dir)
+
+        paths, complete = [], True
+        for entry in entries:
+            rel_path = entry.name if not rel_dir else '{}/{}'.format(rel_dir, entry.name)
+            # don't follow symlinks (they are archived as links)
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if rules.is_ignored(rel_path, is_dir):
+                complete = False
+                continue
+            if is_dir:
+                sub_paths, sub_complete = self._scan(rel_path, rules)
+                if sub_complete:
+                    paths.append(rel_path)
+                else:
+                    complete = False
+                    paths.extend(sub_paths)
+            else:
+                self._add_file(rel_path, entry)
+                paths.append(rel_path)
+        return paths, complete
+
+    def _add_file(self, rel_path, entry):
+        self.files_count += 1
+        self.total_size += entry.stat(follow_symlinks=False).st_size
+        if self._max_files is not None and self.files_count > self._max_files:
+            raise LimitExceeded('More than {} files to copy (found i.a. {}); '
+                                'ignore unnecessary ones in {} file'.format(self._max_files, rel_path,
+                                                                            IGNORE_FILES[-1]))
+        if self._max_size is not None and self.total_size > self._max_size:
+            raise LimitExceeded('More than {} bytes to copy (found i.a. {}); '
+                                'ignore unnecessary files in {} file'.format(self._max_size, rel_path,
+                                                                             IGNORE_FILES[-1]))
@@ -5,11 +5,20 @@ setup(
     version='0.2.2',
     packages=find_packages(),
     include_package_data=True,
-    install_requires=['PyYAML', 'fabric3', 'path.py', 'jinja2', 'six', 'attrs>=17.3', 'click',
-                      'docker', 'kubernetes>=5.0.0', 'google-cloud'],
+    install_requires=['PyYAML', 'paramiko', 'path.py', 'jinja2', 'six', 'attrs>=17.3', 'click',
+                      'docker', 'kubernetes>=21.7.0', 'google-cloud'],
+    extras_require={
+        # legacy slurm tests connect to localhost with fabric
+        'test': ['fabric3'],
+    },
     entry_points={
         'console_scripts': [
             'mrunner=mrunner.cli.mrunner_cli:cli'
         ],
+        'mrunner.backends': [
+            'kubernetes=mrunner.backends.k8s:KubernetesBackend',
+            'local=mrunner.backends.local:LocalBackend',
+            'slurm=mrunner.backends.slurm:SlurmBackend'
+        ],
     },
 )
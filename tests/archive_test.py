@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import io
+import subprocess
+import tarfile
+import unittest
+
+from path import tempdir, Path
+
+from mrunner.utils.archive import ArchiveCodec, stream_archive
+from mrunner.utils.utils import get_paths_to_copy
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def test_parse_codec(self):
+        codec = ArchiveCodec.parse('gzip:1')
+        self.assertEqual((codec.name, codec.level), ('gzip', 1))
+        codec = ArchiveCodec.parse('zstd:5:4')
+        self.assertEqual((codec.name, codec.level, codec.threads), ('zstd', 5, 4))
+        self.assertEqual(ArchiveCodec.parse('auto', link_speed=10000).name, 'none')
+        # zstd is chosen only if it is available on remote end
+        self.assertEqual(ArchiveCodec.parse('auto').name, 'gzip')
+        self.assertEqual(ArchiveCodec.parse('auto', remote_zstd=lambda: False).name, 'gzip')
+        self.assertRaises(ValueError, ArchiveCodec.parse, 'bzip2')
+
+    def test_stream_archive(self):
+        with tempdir() as tmp:
+            tmp.chdir()
+            (tmp / 'a/1').makedirs()
+            (tmp / 'a/1/file_a1_1').write_text('file_a1_1' * 1000)
+            (tmp / 'file1').write_text('file1')
+
+            for codec in [ArchiveCodec('none'), ArchiveCodec('gzip', 1)]:
+                output = io.BytesIO()
+                stats = stream_archive(get_paths_to_copy(), output, codec)
+                self.assertEqual(stats.compressed_bytes, len(output.getvalue()))
+
+                output.seek(0)
+                with tarfile.open(fileobj=output, mode='r:*') as tar_file:
+                    self.assertEqual({'a', 'a/1', 'a/1/file_a1_1', 'file1'}, set(tar_file.getnames()))
+                    self.assertEqual(b'file1', tar_file.extractfile('file1').read())
+
+    def test_stream_archive_with_in_memory_files(self):
+        with tempdir() as tmp:
+            tmp.chdir()
+            (tmp / 'file1').write_text('file1')
+
+            output = io.BytesIO()
+            stream_archive(get_paths_to_copy(), output, ArchiveCodec('none'), files={'Dockerfile': b'FROM python:3'})
+            output.seek(0)
+            with tarfile.open(fileobj=output, mode='r:') as tar_file:
+                self.assertEqual(['Dockerfile', 'file1'], tar_file.getnames())
+                self.assertEqual(b'FROM python:3', tar_file.extractfile('Dockerfile').read())
+
+    def test_extract_cmd(self):
+        with tempdir() as tmp:
+            tmp.chdir()
+            (tmp / 'src').makedirs()
+            (tmp / 'src/file1').write_text('file1')
+            (tmp / 'src').chdir()
+
+            codec = ArchiveCodec('gzip')
+            process = subprocess.Popen(codec.extract_cmd(tmp / 'dst'), shell=True, stdin=subprocess.PIPE)
+            stream_archive(get_paths_to_copy(), process.stdin, codec)
+            process.stdin.close()
+            self.assertEqual(0, process.wait())
+            self.assertEqual('file1', Path(tmp / 'dst/file1').text())
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from path import tempdir
+
+from mrunner.utils.build_cache import BuildCache, build_key
+
+
+class BuildCacheTestCase(unittest.TestCase):
+
+    def test_build_key_depends_on_content_only(self):
+        key = build_key(requirements=['numpy'], dockerfile='FROM python:3', build_args={'A': '1', 'B': '2'})
+        self.assertEqual(key, build_key(dockerfile='FROM python:3', build_args={'B': '2', 'A': '1'},
+                                        requirements=['numpy']))
+        self.assertNotEqual(key, build_key(requirements=['numpy', 'scipy'], dockerfile='FROM python:3',
+                                           build_args={'A': '1', 'B': '2'}))
+
+    def test_images_are_persisted(self):
+        with tempdir() as tmp_dir:
+            cache_path = tmp_dir / 'cache' / 'builds.json'
+            BuildCache(cache_path).put_image('key1', 'gcr.io/project/exp:20180101_000000')
+
+            cache = BuildCache(cache_path)
+            self.assertEqual(cache.get_image('key1'), 'gcr.io/project/exp:20180101_000000')
+            self.assertIsNone(cache.get_image('key2'))
+
+    def test_base_image_expires(self):
+        with tempdir() as tmp_dir:
+            cache = BuildCache(tmp_dir / 'builds.json')
+            cache.put_base_image('python:3', 'sha256:1234')
+            self.assertEqual(cache.get_base_image('python:3', max_age=60), 'sha256:1234')
+            time.sleep(0.01)
+            self.assertIsNone(cache.get_base_image('python:3', max_age=0))
+            self.assertIsNone(cache.get_base_image('python:2', max_age=60))
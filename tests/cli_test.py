@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+import unittest
+
+from mrunner.backends import get_backend_class
+
+HEAVY_MODULES = ['kubernetes', 'docker', 'paramiko', 'fabric', 'jinja2', 'mrunner.utils.neptune',
+                 'mrunner.backends.k8s', 'mrunner.backends.slurm']
+
+
+def _run_python(*args):
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run([sys.executable] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True, cwd=project_dir)
+
+
+class CliStartupTestCase(unittest.TestCase):
+    # cumulative import time of CLI module (in seconds); it is generous, but catches eagerly imported backends
+    IMPORT_TIME_BUDGET = 0.25
+
+    def test_help_doesnt_import_backends(self):
+        script = ('import sys; from click.testing import CliRunner; from mrunner.cli.mrunner_cli import cli; '
+                  'result = CliRunner().invoke(cli, ["--help"]); assert result.exit_code == 0, result.output; '
+                  'print(" ".join(sorted(sys.modules)))')
+        modules = set(_run_python('-c', script).stdout.split())
+        self.assertEqual([], [m for m in HEAVY_MODULES if m in modules])
+
+    def test_import_time(self):
+        # best of few runs, to not fail on noisy machines
+        import_times = []
+        for _ in range(3):
+            stderr = _run_python('-X', 'importtime', '-c', 'import mrunner.cli.mrunner_cli').stderr
+            line = [l for l in stderr.splitlines() if l.rstrip().endswith('| mrunner.cli.mrunner_cli')][0]
+            import_times.append(int(line.split('|')[1]) / 1e6)
+        self.assertLess(min(import_times), self.IMPORT_TIME_BUDGET)
+
+    def test_unknown_backend(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown backend type: foo'):
+            get_backend_class('foo')
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import itertools
+import unittest
+
+from mrunner.cli.deprecated.command_gen_cli import generate_commands, expand_argument
+
+
+class CommandGenTestCase(unittest.TestCase):
+
+    def test_expand_argument(self):
+        self.assertEqual(['--lr'], expand_argument('--lr'))
+        self.assertEqual(['--lr=0.1', '--lr=0.2'], expand_argument('--lr={{0.1,0.2}}'))
+        self.assertEqual(['a1x', 'a1y', 'a2x', 'a2y'], expand_argument('a{{1,2}}{{x,y}}'))
+
+    def test_generate_commands(self):
+        args = ['train.py', '--lr', '{{0.1,0.2}}', '--opt={{sgd,adam}}']
+        self.assertEqual(['train.py --lr 0.1 --opt=sgd', 'train.py --lr 0.1 --opt=adam',
+                          'train.py --lr 0.2 --opt=sgd', 'train.py --lr 0.2 --opt=adam'],
+                         list(generate_commands(args)))
+        self.assertEqual(['train.py --lr 0.1 --opt=sgd', 'train.py --lr 0.1 --opt=adam'],
+                         list(generate_commands(args, limit=2)))
+        self.assertEqual(8, len(list(generate_commands(args, repeat=2))))
+
+        shuffled = list(generate_commands(args, repeat=2, shuffle=True, seed=1))
+        self.assertEqual(sorted(list(generate_commands(args)) * 2), sorted(shuffled))
+        self.assertEqual(shuffled, list(generate_commands(args, repeat=2, shuffle=True, seed=1)))
+        self.assertEqual([], list(generate_commands([])))
+
+    def test_huge_grid_is_streamed(self):
+        args = ['train.py'] + ['--p{}={{{{{}}}}}'.format(i, ','.join(map(str, range(10)))) for i in range(12)]
+        commands = generate_commands(args, shuffle=True, seed=0)
+        self.assertEqual(3, len(list(itertools.islice(commands, 3))))
+        self.assertEqual(5, len(list(generate_commands(args, limit=5))))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from path import tempdir, Path
+
+from mrunner.utils.docker_engine import PushProgress, plan_layers
+from mrunner.utils.utils import PathToDump, get_paths_to_copy
+
+
+class PlanLayersTestCase(unittest.TestCase):
+
+    def test_layers_order(self):
+        with tempdir() as tmp:
+            tmp.chdir()
+            (tmp / 'third_party/lib1').makedirs()
+            (tmp / 'third_party/lib1/lib.py').write_text('lib')
+            (tmp / 'src').makedirs()
+            (tmp / 'src/model.py').write_text('model')
+            (tmp / 'experiment.py').write_text('experiment')
+            (tmp / 'config.yaml').write_text('config')
+
+            paths = get_paths_to_copy() | {PathToDump(Path('../external'), Path('external'))}
+            layers = [(name, [str(p.rel_remote_path) for p in layer]) for name, layer in plan_layers(paths)]
+            self.assertEqual([('vendored', ['external', 'third_party']), ('configs', ['config.yaml']),
+                              ('source', ['experiment.py', 'src'])], layers)
+
+    def test_empty_layers_are_skipped(self):
+        paths = {PathToDump(Path('b.py'), Path('b.py')), PathToDump(Path('a.py'), Path('a.py'))}
+        self.assertEqual([('source', [Path('a.py'), Path('b.py')])],
+                         [(name, [p.rel_remote_path for p in layer]) for name, layer in plan_layers(paths)])
+
+
+class PushProgressTestCase(unittest.TestCase):
+
+    def test_push_events(self):
+        progress = PushProgress('registry/project:1234')
+        for event in [{'status': 'The push refers to repository [registry/project]'},
+                      {'status': 'Preparing', 'progressDetail': {}, 'id': 'a'},
+                      {'status': 'Preparing', 'progressDetail': {}, 'id': 'b'},
+                      {'status': 'Layer already exists', 'progressDetail': {}, 'id': 'a'},
+                      {'status': 'Pushing', 'progressDetail': {'current': 512, 'total': 1024}, 'id': 'b'},
+                      {'status': 'Pushed', 'progressDetail': {}, 'id': 'b'},
+                      {'status': '1234: digest: sha256:abcd size: 1234'},
+                      {'progressDetail': {}, 'aux': {'Tag': '1234', 'Digest': 'sha256:abcd', 'Size': 1234}}]:
+            progress.update(event)
+        self.assertEqual('sha256:abcd', progress.digest)
+        self.assertEqual(1024, progress.pushed_bytes)
+
+    def test_push_error(self):
+        progress = PushProgress('registry/project:1234')
+        with self.assertRaisesRegex(RuntimeError, 'denied'):
+            progress.update({'errorDetail': {'message': 'denied: access forbidden'}, 'error': 'denied'})
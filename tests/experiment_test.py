@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import yaml
+from path import tempdir
+
+from mrunner.experiment import merge_experiment_parameters, read_ndjson_experiments, Experiment, \
+    _load_py_experiment_and_generate_neptune_yamls
+
+
+class ExperimentTestCase(unittest.TestCase):
+
+    def test_merge_doesnt_modify_context(self):
+        context = {'tags': ['a'], 'storage_dir': '/storage'}
+        first = merge_experiment_parameters({'tags': ['b']}, {}, context)
+        second = merge_experiment_parameters({'tags': 'c'}, {}, context)
+
+        self.assertEqual(['a', 'b'], first['tags'])
+        self.assertEqual(['a', 'c'], second['tags'])
+        self.assertEqual({'tags': ['a'], 'storage_dir': '/storage'}, context)
+
+    def test_read_ndjson_experiments(self):
+        lines = ['{"project": "p", "name": "n1", "script": "train.py", "parameters": {"lr": 0.1}}\n',
+                 '\n',
+                 '{"project": "p", "name": "n2", "script": "train.py", "parameters": {"lr": 0.2}}\n']
+        experiments = [e.to_dict() for e in read_ndjson_experiments(lines)]
+        self.assertEqual(['n1', 'n2'], [e['name'] for e in experiments])
+        self.assertEqual({'lr': 0.2}, experiments[1]['parameters'])
+
+        with self.assertRaisesRegex(ValueError, 'line 2'):
+            list(read_ndjson_experiments(lines[:1] + ['{"name": "missing script"}']))
+
+    def test_identical_neptune_configs_are_generated_once(self):
+        experiments = [Experiment(project='p', name='n', script='train.py', parameters={'lr': lr}, tags=['t'])
+                       for lr in [0.1, 0.2, 0.1]]
+        with tempdir() as neptune_dir:
+            paths = [path for path, _ in _load_py_experiment_and_generate_neptune_yamls(
+                'spec.py', 'spec', neptune_dir=neptune_dir, experiments=experiments)]
+
+            self.assertEqual(paths[0], paths[2])
+            self.assertNotEqual(paths[0], paths[1])
+            self.assertEqual(2, len(neptune_dir.files()))
+            config = yaml.safe_load(paths[1].text())
+            self.assertEqual({'lr': 0.2}, config['parameters'])
+            self.assertEqual(['t'], config['tags'])
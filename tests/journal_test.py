@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from path import tempdir
+
+from mrunner.utils.journal import SubmissionJournal, experiment_key, count_states, refresh_states, SUBMITTED, FAILED, \
+    DONE, UNKNOWN
+
+
+class Cmd(object):
+
+    def __init__(self, command):
+        self.command = command
+        self.env = {'A': '1'}
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def test_experiment_key(self):
+        experiment = {'name': 'n', 'cmd': Cmd('python train.py'), 'resources': {'cpu': 1}, 'local_neptune_token': 1}
+        key = experiment_key(experiment, 'code1')
+        self.assertEqual(key, experiment_key(dict(experiment, cmd=Cmd('python train.py'), local_neptune_token=2),
+                                             'code1'))
+        self.assertNotEqual(key, experiment_key(experiment, 'code2'))
+        self.assertNotEqual(key, experiment_key(dict(experiment, cmd=Cmd('python train.py --lr 1')), 'code1'))
+        self.assertNotEqual(key, experiment_key(dict(experiment, resources={'cpu': 2}), 'code1'))
+
+    def test_resume_with_delivery_flags_submits_nothing(self):
+        experiments = [{'name': 'n', 'cmd': Cmd('python train.py --lr {}'.format(lr)), 'force_upload': False,
+                        'rebuild': False} for lr in range(3)]
+        with tempdir() as tmp:
+            journal = SubmissionJournal(tmp / 'journal.sqlite')
+            for i, experiment in enumerate(experiments):
+                journal.record(experiment_key(experiment, 'code'), sweep='s', context='c', name='n',
+                               backend_type='kubernetes', job_id=str(i))
+
+            # run --resume --rebuild --force_upload
+            rerun = [dict(e, force_upload=True, rebuild=True, code_digest='code') for e in experiments]
+            self.assertEqual([], [e for e in rerun if not journal.is_submitted(experiment_key(e, 'code'))])
+            journal.close()
+
+    def test_journal(self):
+        with tempdir() as tmp:
+            journal = SubmissionJournal(tmp / 'journal.sqlite')
+            journal.record('k1', sweep='s', context='c', name='n1', backend_type='slurm', job_id='12_0')
+            journal.record('k2', sweep='s', context='c', name='n2', backend_type='slurm', job_id='12_1')
+            journal.record('k3', sweep='other', context='c', name='n3', backend_type='slurm', job_id='13')
+            journal.update_states('c', {'12_1': FAILED, '13': DONE})
+            journal.update_states('other', {'12_0': DONE})
+            journal.close()
+
+            # journal is persistent
+            journal = SubmissionJournal(tmp / 'journal.sqlite')
+            self.assertTrue(journal.is_submitted('k1'))
+            self.assertFalse(journal.is_submitted('k2'))
+            self.assertFalse(journal.is_submitted('missing'))
+            self.assertEqual('12_0', journal.get('k1').job_id)
+            self.assertEqual([('k1', SUBMITTED), ('k2', FAILED)],
+                             [(e.key, e.state) for e in journal.entries(sweep='s')])
+            self.assertEqual(3, len(journal.entries()))
+            self.assertEqual(0, len(journal.entries(context='other')))
+            self.assertEqual({'s': {SUBMITTED: 1, FAILED: 1}, 'other': {DONE: 1}}, count_states(journal.entries()))
+            journal.close()
+
+    def test_refresh_reports_not_queryable_experiments_as_unknown(self):
+        with tempdir() as tmp:
+            journal = SubmissionJournal(tmp / 'journal.sqlite')
+            # srun submissions have no job ids
+            journal.record('k1', sweep='s', context='c', name='n1', backend_type='slurm', job_id=None)
+            journal.record('k2', sweep='s', context='c', name='n2', backend_type='slurm', job_id=None, state=DONE)
+            entries = refresh_states(journal, {'context_name': 'c'})
+            self.assertEqual([UNKNOWN, DONE], [e.state for e in entries])
+            self.assertEqual(SUBMITTED, journal.get('k1').state)
+            journal.close()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+from collections import Counter
+
+import attr
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from path import tempdir
+
+from mrunner.backends.k8s import ExperimentRunOnKubernetes, Job, KubernetesBackend, KubernetesDeployment, \
+    NEPTUNE_CONFIG_ENV, TasksConfigMap, tracked_states
+from mrunner.utils.docker_engine import StaticCmd
+from mrunner.utils.journal import PENDING, RUNNING, DONE, FAILED
+from mrunner.utils.k8s_watch import JobsTracker
+from mrunner.utils.utils import filter_only_attr
+from tests.k8s_watch_test import make_pod
+
+
+class KubernetesStatesTestCase(unittest.TestCase):
+
+    def test_never_started_tasks_of_failed_sweep_are_failed(self):
+        tracker = JobsTracker(['ns/s/0', 'ns/s/1', 'ns/s/2', 'ns/a'])
+        tracker.on_pod(make_pod('s', 'Failed', index=0, exit_code=1))
+        tracker.on_pod(make_pod('a', 'Running'))
+        self.assertEqual({'ns/s/0': PENDING, 'ns/a': RUNNING}, tracked_states(tracker))  # task may be retried
+
+        tracker.on_pod(make_pod('s', 'Succeeded', index=1, exit_code=0))
+        tracker.on_job_finished('ns', 's')
+        self.assertEqual({'ns/s/0': FAILED, 'ns/s/1': DONE, 'ns/s/2': FAILED, 'ns/a': RUNNING},
+                         tracked_states(tracker))
+
+
+class FakeApi(object):
+    """Fake of kubernetes API clients: resources are kept in memory, creating existing one fails with 409"""
+
+    def __init__(self):
+        self.api_client = client.ApiClient()
+        self.resources = {}
+        self.calls = []
+
+    def __getattr__(self, name):
+        verb, _, kind = name.partition('_')
+        kind = kind.replace('namespaced_', '')
+
+        def _call(name=None, namespace=None, body=None, **kwargs):
+            self.calls.append((verb, kind))
+            key = (kind, namespace, name or body.metadata.name)
+            if verb == 'create':
+                if key in self.resources:
+                    raise ApiException(status=409)
+                body.metadata.uid = 'uid-{}'.format(len(self.resources))
+                if kind == 'service':
+                    body.spec.cluster_ip = '10.0.0.1'
+                self.resources[key] = body
+            elif verb == 'patch':
+                self.resources[key].metadata.owner_references = body['metadata']['ownerReferences']
+            return self.resources[key]
+        return _call
+
+
+class FakeKubernetesBackend(KubernetesBackend):
+    """Backend talking to FakeApi; images are not built"""
+
+    def __init__(self, api):
+        self.cluster_name = 'cluster'
+        self.core_api = self.batch_api = self.apps_api = api
+        self._lock = threading.Lock()
+        self._projects_locks = {}
+        self._configured_projects = set()
+        self._submitted_jobs = []
+        self.api_calls = Counter()
+
+    def package(self, experiment):
+        experiment = ExperimentRunOnKubernetes(**filter_only_attr(ExperimentRunOnKubernetes, experiment))
+        return KubernetesDeployment(experiment=experiment, built_image=None, image=None)
+
+    def upload(self, deployment):
+        return attr.evolve(deployment, image='gcr.io/p/img@sha256:1')
+
+
+def make_experiment(tmp, index=0, **kwargs):
+    config = tmp / 'neptune_exp' / 'neptune-{}.yaml'.format(index)
+    config.parent.makedirs_p()
+    config.write_text('parameters: {}'.format(index))
+    experiment = dict(backend_type='kubernetes', name='exp {}'.format(index), storage_dir='/storage',
+                      cmd=StaticCmd(command='python train.py -- --lr {}'.format(index), env={'B': 'b'}),
+                      registry_url='gcr.io', base_image='python:3', env={'A': 'x y'}, resources={'cpu': '1'},
+                      cwd=tmp, generated_neptune_config=config, project='p')
+    experiment.update(kwargs)
+    return experiment
+
+
+class KubernetesJobTestCase(unittest.TestCase):
+
+    def test_indexed_job_spec(self):
+        with tempdir() as tmp:
+            experiment = ExperimentRunOnKubernetes(**make_experiment(tmp))
+            job = Job('img', experiment, tasks_count=3, parallelism=2)
+            default_parallelism_job = Job('img', experiment, tasks_count=3)
+
+        self.assertEqual('Indexed', job.spec.completion_mode)
+        self.assertEqual((3, 2, 3), (job.spec.completions, job.spec.parallelism, job.spec.backoff_limit))
+        container = job.spec.template.spec.containers[0]
+        self.assertEqual(['sh', '-c', '. /etc/mrunner/tasks/"$JOB_COMPLETION_INDEX"'], container.command)
+        self.assertEqual([], container.env)  # env is set by task script
+        self.assertEqual(job.metadata.name, job.spec.template.spec.volumes[-1].config_map.name)
+        self.assertEqual(3, default_parallelism_job.spec.parallelism)
+
+    def test_single_job_spec(self):
+        with tempdir() as tmp:
+            job = Job('img', ExperimentRunOnKubernetes(**make_experiment(tmp)))
+        self.assertIsNone(job.spec.completion_mode)
+        self.assertEqual((None, 0), (job.spec.completions, job.spec.backoff_limit))
+        self.assertEqual({'A': 'x y', 'B': 'b'}, {e.name: e.value for e in job.spec.template.spec.containers[0].env
+                                                  if e.name != NEPTUNE_CONFIG_ENV})
+
+    def test_tasks_config_map(self):
+        with tempdir() as tmp:
+            experiments = [ExperimentRunOnKubernetes(**make_experiment(tmp, index=i)) for i in range(2)]
+            experiments.append(attr.evolve(experiments[1], env={'A': 'z'}))  # same generated config
+            config_map = TasksConfigMap('sweep', experiments)
+
+        self.assertEqual('sweep', config_map.metadata.name)
+        self.assertEqual({'0', '1', '2', 'neptune-0.yaml', 'neptune-1.yaml'}, set(config_map.data))
+        self.assertEqual('parameters: 1', config_map.data['neptune-1.yaml'])
+        self.assertEqual('export A=\'x y\'; export B=b; mkdir -p "$(dirname neptune_exp/neptune-1.yaml)" && '
+                         'cp /etc/mrunner/tasks/neptune-1.yaml neptune_exp/neptune-1.yaml; '
+                         'exec python train.py -- --lr 1', config_map.data['1'])
+        self.assertTrue(config_map.data['2'].startswith('export A=z; export B=b;'))
+
+    def test_tasks_config_map_size_is_limited(self):
+        with tempdir() as tmp:
+            experiment = ExperimentRunOnKubernetes(**make_experiment(tmp, env={'A': 'x' * TasksConfigMap.MAX_SIZE}))
+            with self.assertRaisesRegex(ValueError, 'too large'):
+                TasksConfigMap('sweep', [experiment])
+
+    def test_tasks_are_owned_by_job(self):
+        api = FakeApi()
+        backend = FakeKubernetesBackend(api)
+        with tempdir() as tmp:
+            job_ids = backend.run_array([make_experiment(tmp, index=i) for i in range(3)], parallelism=2)
+
+        job_name = job_ids[0].split('/')[1]
+        self.assertEqual(['p/{}/{}'.format(job_name, i) for i in range(3)], job_ids)
+        job = api.resources[('job', 'p', job_name)]
+        self.assertEqual((3, 2), (job.spec.completions, job.spec.parallelism))
+        config_map = api.resources[('config_map', 'p', job_name)]
+        self.assertEqual({'0', '1', '2', 'neptune-0.yaml', 'neptune-1.yaml', 'neptune-2.yaml'}, set(config_map.data))
+        self.assertEqual([{'apiVersion': 'batch/v1', 'kind': 'Job', 'name': job_name, 'uid': job.metadata.uid}],
+                         config_map.metadata.owner_references)
+
+    def test_api_calls_of_repeated_submissions(self):
+        api = FakeApi()
+        with tempdir() as tmp:
+            backend = FakeKubernetesBackend(api)
+            for index in range(2):
+                backend.submit(backend.upload(backend.package(make_experiment(tmp, index=index))))
+            # namespace and storage (6 resources) are created once per session; jobs (with unique names) are just
+            # created
+            self.assertEqual({'create': 8}, dict(backend.api_calls))
+
+            # in next session existing resources are read only when they are needed (NFS service and volume)
+            backend = FakeKubernetesBackend(api)
+            backend.submit(backend.upload(backend.package(make_experiment(tmp))))
+            self.assertEqual({'create': 7, 'read': 2}, dict(backend.api_calls))
+        self.assertEqual(17, len(api.calls))
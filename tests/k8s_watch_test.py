@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+from mrunner.utils.k8s_watch import JobsTracker, JobsWatcher, COMPLETION_INDEX_ANNOTATION
+
+START = datetime.datetime(2020, 1, 1)
+
+
+def make_pod(job_name, phase, index=None, name=None, created=0, exit_code=None, seconds=10, resource_version='1'):
+    annotations = {COMPLETION_INDEX_ANNOTATION: str(index)} if index is not None else None
+    container_statuses = None
+    if exit_code is not None:
+        terminated = client.V1ContainerStateTerminated(exit_code=exit_code, started_at=START,
+                                                       finished_at=START + datetime.timedelta(seconds=seconds))
+        container_statuses = [client.V1ContainerStatus(name='c', image='i', image_id='i', ready=False,
+                                                       restart_count=0,
+                                                       state=client.V1ContainerState(terminated=terminated))]
+    metadata = client.V1ObjectMeta(name=name or '{}-{}'.format(job_name, created), namespace='ns',
+                                   labels={'job-name': job_name}, annotations=annotations,
+                                   creation_timestamp=START + datetime.timedelta(seconds=created),
+                                   resource_version=resource_version)
+    return client.V1Pod(metadata=metadata, status=client.V1PodStatus(phase=phase, start_time=START,
+                                                                      container_statuses=container_statuses))
+
+
+def make_job(condition=None):
+    conditions = [client.V1JobCondition(type=condition, status='True')] if condition else None
+    return client.V1Job(status=client.V1JobStatus(conditions=conditions))
+
+
+class FakeCoreApi(object):
+
+    def __init__(self, pods):
+        self.pods = pods
+        self.list_calls = []
+
+    def list_namespaced_pod(self, namespace, **kwargs):
+        self.list_calls.append((namespace, kwargs))
+        return client.V1PodList(items=self.pods, metadata=client.V1ListMeta(resource_version='10'))
+
+
+class FakeBatchApi(object):
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def read_namespaced_job_status(self, name, namespace):
+        return self.jobs[name]
+
+
+class ScriptedEvents(object):
+
+    def __init__(self, events, on_end):
+        self.events = events
+        self.on_end = on_end
+
+    def __iter__(self):
+        for event in self.events:
+            yield event
+        self.on_end()
+
+
+class ScriptedWatcher(JobsWatcher):
+    """Watcher fed with scripted streams of events instead of API server watches"""
+
+    def __init__(self, core_api, batch_api, streams):
+        super(ScriptedWatcher, self).__init__(core_api, batch_api, 'app.kubernetes.io/managed-by=mrunner')
+        self.streams = list(streams)
+        self.watched_versions = []
+
+    def _stream(self, namespace, resource_version, timeout_seconds):
+        self.watched_versions.append(resource_version)
+        events = self.streams.pop(0)
+        if isinstance(events, Exception):
+            raise events
+        return iter(events)
+
+
+class JobsTrackerTestCase(unittest.TestCase):
+
+    def test_single_job_results(self):
+        tracker = JobsTracker(['ns/a', 'ns/b'])
+        tracker.on_pod(make_pod('a', 'Running'))
+        tracker.on_pod(make_pod('a', 'Succeeded', exit_code=0, seconds=12))
+        tracker.on_pod(make_pod('b', 'Failed', exit_code=3))
+        tracker.on_pod(make_pod('other', 'Failed', exit_code=3))
+
+        self.assertTrue(tracker.finished)
+        self.assertEqual(0, tracker.results['ns/a'].returncode)
+        self.assertEqual(12, tracker.results['ns/a'].seconds)
+        self.assertEqual(3, tracker.results['ns/b'].returncode)
+
+    def test_failed_sweep_task_may_be_retried(self):
+        tracker = JobsTracker(['ns/s/0', 'ns/s/1'])
+        tracker.on_pod(make_pod('s', 'Succeeded', index=0, exit_code=0))
+        tracker.on_pod(make_pod('s', 'Failed', index=1, exit_code=1))
+        self.assertFalse(tracker.finished)
+        self.assertEqual({('ns', 's')}, tracker.unresolved_jobs())
+
+        # retry is started; late event of replaced pod doesn't count
+        tracker.on_pod(make_pod('s', 'Pending', index=1, created=5))
+        tracker.on_pod(make_pod('s', 'Failed', index=1, exit_code=1))
+        self.assertEqual(set(), tracker.unresolved_jobs())
+        tracker.on_pod(make_pod('s', 'Failed', index=1, created=5, exit_code=2))
+        tracker.on_job_finished('ns', 's')
+
+        self.assertTrue(tracker.finished)
+        self.assertEqual(2, tracker.results['ns/s/1'].returncode)
+
+
+class JobsWatcherTestCase(unittest.TestCase):
+
+    def test_wait_resumes_watch_from_bookmarks(self):
+        core_api = FakeCoreApi([make_pod('a', 'Running')])
+        watcher = ScriptedWatcher(core_api, FakeBatchApi({}), [
+            [{'type': 'BOOKMARK', 'raw_object': {'metadata': {'resourceVersion': '15'}}}],
+            [{'type': 'MODIFIED', 'object': make_pod('b', 'Succeeded', exit_code=0, resource_version='17')},
+             {'type': 'BOOKMARK', 'raw_object': {'metadata': {'resourceVersion': '20'}}}],
+            ApiException(status=410),
+            [{'type': 'MODIFIED', 'object': make_pod('a', 'Failed', exit_code=1, resource_version='30')}],
+        ])
+
+        results = watcher.wait(['ns/a', 'ns/b'])
+
+        self.assertEqual({'ns/a': 1, 'ns/b': 0}, {k: r.returncode for k, r in results.items()})
+        self.assertEqual(['10', '15', '20', '10'], watcher.watched_versions)
+        self.assertEqual(2, len(core_api.list_calls))  # pods are listed again only when version expired
+
+    def test_wait_resolves_failed_tasks_with_job_status(self):
+        core_api = FakeCoreApi([make_pod('s', 'Failed', index=0, exit_code=1)])
+        batch_api = FakeBatchApi({'s': make_job()})
+
+        def _fail_job():
+            batch_api.jobs['s'] = make_job('Failed')
+        bookmark = {'type': 'BOOKMARK', 'raw_object': {'metadata': {'resourceVersion': '11'}}}
+        watcher = ScriptedWatcher(core_api, batch_api, [ScriptedEvents([bookmark], on_end=_fail_job)])
+
+        results = watcher.wait(['ns/s/0'])
+
+        self.assertEqual(1, results['ns/s/0'].returncode)
+        self.assertEqual(['10'], watcher.watched_versions)
+
+    def test_snapshot_resolves_failed_tasks_with_job_status(self):
+        core_api = FakeCoreApi([make_pod('s', 'Failed', index=0, exit_code=1),
+                                make_pod('s', 'Running', index=1)])
+        batch_api = FakeBatchApi({'s': make_job()})
+        watcher = ScriptedWatcher(core_api, batch_api, [])
+
+        tracker = watcher.snapshot(['ns/s/0', 'ns/s/1'])
+        self.assertEqual({}, tracker.results)  # failed task of active sweep may still be retried
+        self.assertEqual({'ns/s/0': 'Failed', 'ns/s/1': 'Running'}, tracker.phases)
+
+        batch_api.jobs['s'] = make_job('Failed')
+        tracker = watcher.snapshot(['ns/s/0', 'ns/s/1'])
+        self.assertEqual({'ns/s/0': 1, 'ns/s/1': None}, {k: r.returncode for k, r in tracker.results.items()})
+        self.assertEqual([], watcher.watched_versions)
+
+    def test_never_started_tasks_of_failed_sweep_are_failed(self):
+        # backoffLimit reached before tasks 2 and 3 got any pods
+        core_api = FakeCoreApi([make_pod('s', 'Succeeded', index=0, exit_code=0),
+                                make_pod('s', 'Failed', index=1, exit_code=1)])
+        batch_api = FakeBatchApi({'s': make_job('Failed')})
+        job_ids = ['ns/s/0', 'ns/s/1', 'ns/s/2', 'ns/s/3']
+
+        tracker = ScriptedWatcher(core_api, batch_api, []).snapshot(job_ids)
+        self.assertEqual({'ns/s/0': 0, 'ns/s/1': 1, 'ns/s/2': None, 'ns/s/3': None},
+                         {k: r.returncode for k, r in tracker.results.items()})
+        self.assertNotIn('ns/s/2', tracker.phases)
+
+        watcher = ScriptedWatcher(core_api, batch_api, [])
+        results = watcher.wait(job_ids[2:])  # failures of other tasks were already seen
+        self.assertEqual({'ns/s/2': None, 'ns/s/3': None}, {k: r.returncode for k, r in results.items()})
+        self.assertEqual([], watcher.watched_versions)
+
+    def test_unseen_tasks_of_complete_sweep_are_done(self):
+        watcher = ScriptedWatcher(FakeCoreApi([]), FakeBatchApi({'s': make_job('Complete')}), [])
+        results = watcher.wait(['ns/s/0'], timeout=0)
+        self.assertEqual(0, results['ns/s/0'].returncode)
+
+    def test_wait_timeout(self):
+        watcher = ScriptedWatcher(FakeCoreApi([make_pod('a', 'Running')]), FakeBatchApi({}), [])
+        self.assertEqual({}, watcher.wait(['ns/a'], timeout=0))
+
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from mrunner.utils.pipeline import Pipeline, Stage
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def test_all_items_pass_all_stages(self):
+        pipeline = Pipeline([Stage('add', lambda x: x + 1, workers=3),
+                             Stage('mul', lambda x: x * 2, workers=2)])
+        self.assertEqual(sorted(pipeline.run(range(100))), [(x + 1) * 2 for x in range(100)])
+
+    def test_stages_overlap(self):
+        def _slow(x):
+            time.sleep(0.05)
+            return x
+
+        pipeline = Pipeline([Stage('a', _slow), Stage('b', _slow), Stage('c', _slow)])
+        start = time.time()
+        self.assertEqual(list(pipeline.run(range(10))), list(range(10)))
+        # sequential processing would take 10 * 3 * 0.05s
+        self.assertLess(time.time() - start, 1.0)
+
+    def test_queues_are_bounded(self):
+        fed = []
+
+        def _items():
+            for x in range(100):
+                fed.append(x)
+                yield x
+
+        gate = threading.Event()
+        fed_when_processed = []
+
+        def _wait(x):
+            gate.wait()
+            fed_when_processed.append(len(fed))
+            return x
+
+        threading.Timer(0.2, gate.set).start()
+        pipeline = Pipeline([Stage('wait', _wait)], queue_size=2)
+        self.assertEqual(len(list(pipeline.run(_items()))), 100)
+        self.assertLess(fed_when_processed[0], 10)
+
+    def test_error_is_raised(self):
+        def _fail_on_5(x):
+            if x == 5:
+                raise ValueError('failed on 5')
+            return x
+
+        pipeline = Pipeline([Stage('fail', _fail_on_5, workers=2), Stage('id', lambda x: x)])
+        with self.assertRaisesRegex(ValueError, 'failed on 5'):
+            list(pipeline.run(range(100)))
+
+    def test_error_in_items_generator_is_raised(self):
+        def _items():
+            yield 1
+            raise RuntimeError('spec error')
+
+        pipeline = Pipeline([Stage('id', lambda x: x)])
+        with self.assertRaisesRegex(RuntimeError, 'spec error'):
+            list(pipeline.run(_items()))
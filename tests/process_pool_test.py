@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import threading
+import time
+import unittest
+
+from path import tempdir
+
+from mrunner.utils.process_pool import ProcessPool, ResourceSlots
+
+
+class ResourceSlotsTestCase(unittest.TestCase):
+
+    def test_acquire_blocks_till_release(self):
+        slots = ResourceSlots(cpu=2, mem=100)
+        slots.acquire(cpu=2, mem=10)
+        acquired = threading.Event()
+
+        def _acquire():
+            slots.acquire(cpu=1, mem=10)
+            acquired.set()
+
+        threading.Thread(target=_acquire, daemon=True).start()
+        self.assertFalse(acquired.wait(0.1))
+        slots.release(cpu=2, mem=10)
+        self.assertTrue(acquired.wait(1))
+
+    def test_request_exceeding_capacity(self):
+        slots = ResourceSlots(cpu=2, mem=100)
+        with self.assertRaises(ValueError):
+            slots.acquire(cpu=3)
+        with self.assertRaises(ValueError):
+            slots.acquire(gpu=1)
+
+
+class ProcessPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # forkserver needs existing cwd; other tests may leave it in removed temporary directory
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    def _run(self, pool, commands, cpu=1):
+        with tempdir() as tmp_dir:
+            for name, command in commands:
+                pool.submit(name, command, env={'GREETING': name}, cwd=tmp_dir, log_path=tmp_dir / name + '.log',
+                            resources={'cpu': cpu})
+            results = sorted(pool.wait(), key=lambda result: result.name)
+            return [(r.name, r.returncode, r.log_path.text()) for r in results]
+
+    def test_captures_output_and_exit_code(self):
+        pool = ProcessPool(ResourceSlots(cpu=2))
+        results = self._run(pool, [('a', 'echo $GREETING'), ('b', 'echo $GREETING >&2; exit 3')])
+        self.assertEqual([('a', 0, 'a\n'), ('b', 3, 'b\n')], results)
+
+    def test_respects_slots(self):
+        pool = ProcessPool(ResourceSlots(cpu=2))
+        start_time = time.time()
+        command = '{} -c "import time; time.sleep(0.3)"'.format(sys.executable)
+        self._run(pool, [(str(i), command) for i in range(4)], cpu=2)
+        self.assertGreaterEqual(time.time() - start_time, 1.2)
+
+    def test_forkserver_with_preload(self):
+        pool = ProcessPool(ResourceSlots(cpu=2), preload=['json'])
+        script = 'import os, sys; print(os.environ["GREETING"], sys.argv[1:]); sys.exit(int(sys.argv[1]))'
+        with tempdir() as tmp_dir:
+            (tmp_dir / 'script.py').write_text(script)
+            for name, command in [('ok', 'python script.py 0'), ('failed', 'python script.py 2'),
+                                  ('shell', 'echo $GREETING')]:
+                pool.submit(name, command, env={'GREETING': name}, cwd=tmp_dir,
+                            log_path=tmp_dir / name + '.log', resources={'cpu': 1})
+            results = {r.name: (r.returncode, r.log_path.text()) for r in pool.wait()}
+        self.assertEqual({'ok': (0, "ok ['0']\n"), 'failed': (2, "failed ['2']\n"), 'shell': (0, 'shell\n')},
+                         results)
+
+    def test_module_run_in_forkserver(self):
+        pool = ProcessPool(ResourceSlots(cpu=1), preload=[])
+        with tempdir() as tmp_dir:
+            (tmp_dir / 'module.py').write_text('import sys; print(sys.argv[1:])')
+            pool.submit('module', 'python -m module x', env={'PYTHONPATH': tmp_dir}, cwd=tmp_dir,
+                        log_path=tmp_dir / 'module.log', resources={'cpu': 1})
+            results = [(r.returncode, r.log_path.text()) for r in pool.wait()]
+        self.assertEqual([(0, "['x']\n")], results)
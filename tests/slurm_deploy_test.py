@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import attr
+from path import Path
+
+from mrunner.backends.slurm import _experiment_command, _remote_config_path, render_array_tasks, \
+    array_tasks_configs, ArrayExperimentScript, ExperimentRunOnSlurm, SBatchWrapperCmd
+
+Cmd = attr.make_class('Cmd', ['command', 'env'])
+Experiment = attr.make_class('Experiment', ['cmd', 'cwd', 'generated_neptune_config', 'env'])
+
+
+class SlurmDeployTestCase(unittest.TestCase):
+
+    def test_absolute_config_path_is_relative_to_cwd(self):
+        config = '/home/user/project/neptune_exp/neptune-1.yaml'
+        experiment = Experiment(cmd=Cmd('neptune run --config {} -- train.py'.format(config), {}),
+                                cwd='/home/user/project', generated_neptune_config=config, env={})
+        self.assertEqual('neptune_exp/neptune-1.yaml', _remote_config_path(experiment, config))
+        self.assertEqual('neptune run --config neptune_exp/neptune-1.yaml -- train.py',
+                         _experiment_command(experiment))
+
+    def test_relative_config_path_is_kept(self):
+        experiment = Experiment(cmd=Cmd('neptune run --config neptune_exp/n.yaml -- train.py', {}),
+                                cwd='.', generated_neptune_config='neptune_exp/n.yaml', env={})
+        self.assertEqual('neptune run --config neptune_exp/n.yaml -- train.py', _experiment_command(experiment))
+
+    def test_array_tasks_refer_to_configs_relative_to_cwd(self):
+        experiments = [Experiment(cmd=Cmd('neptune run --config /p/neptune_exp/{}.yaml -- train.py'.format(i), {}),
+                                  cwd='/p', generated_neptune_config='/p/neptune_exp/{}.yaml'.format(i),
+                                  env={'A': i}) for i in range(2)]
+        self.assertEqual(b'export A=0; neptune run --config neptune_exp/0.yaml -- train.py\n'
+                         b'export A=1; neptune run --config neptune_exp/1.yaml -- train.py\n',
+                         render_array_tasks(experiments))
+
+    def test_array_tasks_env_is_quoted(self):
+        experiment = Experiment(cmd=Cmd('python train.py', {'PYTHONPATH': '$PYTHONPATH:src'}), cwd='/p',
+                                generated_neptune_config=None, env={'A': 'x $(id)'})
+        self.assertEqual(b'export A=\'x $(id)\'; export PYTHONPATH="${PYTHONPATH}":src; python train.py\n',
+                         render_array_tasks([experiment]))
+
+    def test_array_tasks_configs_are_placed_in_task_directories(self):
+        experiments = [Experiment(cmd=Cmd('neptune run -- train.py', {}), cwd='/p', env={},
+                                  generated_neptune_config='/p/neptune_exp/{}.yaml'.format(i) if i != 1 else None)
+                       for i in range(3)]
+        self.assertEqual([('/p/neptune_exp/0.yaml', '0/neptune_exp/0.yaml'),
+                          ('/p/neptune_exp/2.yaml', '2/neptune_exp/2.yaml')],
+                         [(str(p.local_path), str(p.rel_remote_path)) for p in array_tasks_configs(experiments)])
+
+    def test_array_tasks_are_run_in_their_directories(self):
+        sweep = ExperimentRunOnSlurm(backend_type='slurm', name='n', storage_dir='/storage', venv='/venv',
+                                     cmd=Cmd('python train.py', {}), user_id='u', slurm_scratch_dir='/scratch',
+                                     cmd_type='sbatch', experiment_scratch_dir=Path('/scratch/n_1'),
+                                     resources={'cpu': 1})
+        script = ArrayExperimentScript(sweep, tasks_file_name='tasks.sh')  # file is removed with the object
+        script_text = script.path.text()
+        self.assertIn('cd /scratch/n_1/"$SLURM_ARRAY_TASK_ID"\n', script_text)
+        self.assertIn('p" ../tasks.sh)"', script_text)
+
+        command = SBatchWrapperCmd(experiment=sweep, script_path='/scratch/n_1.sh', array='0-3').command
+        self.assertIn('-o /scratch/n_1/%a/slurm.log', command)
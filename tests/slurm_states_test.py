@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from mrunner.backends.slurm import parse_job_states
+from mrunner.utils.journal import PENDING, RUNNING, DONE, FAILED
+
+
+class SlurmStatesTestCase(unittest.TestCase):
+
+    def test_parse_sacct_output(self):
+        output = '\n'.join(['12|COMPLETED', '13|CANCELLED by 1001', '14_0|RUNNING', '14_1|FAILED', '14_2|TIMEOUT',
+                            '14_[3-5,8%2]|PENDING', '15|REQUEUED', ''])
+        states = parse_job_states(output)
+        self.assertEqual({'12': DONE, '13': FAILED, '14_0': RUNNING, '14_1': FAILED, '14_2': FAILED,
+                          '14_3': PENDING, '14_4': PENDING, '14_5': PENDING, '14_8': PENDING, '15': PENDING}, states)
+
+    def test_not_finished_states_are_not_final(self):
+        output = '\n'.join(['31|PREEMPTED', '32|REQUEUE_HOLD', '33|REQUEUE_FED', '34|SPECIAL_EXIT', '35|STOPPED',
+                            '36|SUSPENDED', '37|OUT_OF_MEMORY', '38|NEW_STATE'])
+        self.assertEqual({'31': PENDING, '32': PENDING, '33': PENDING, '34': PENDING, '35': RUNNING, '36': RUNNING,
+                          '37': FAILED}, parse_job_states(output))
+
+    def test_parse_squeue_output(self):
+        self.assertEqual({'21_7': RUNNING, '22': PENDING}, parse_job_states('21_7|RUNNING\n22|PENDING'))
+        self.assertEqual({}, parse_job_states(''))
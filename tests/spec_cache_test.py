@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from path import tempdir
+
+from mrunner.utils.spec_cache import SpecCache
+
+SPEC_TEMPLATE = '''
+calls = []
+
+def spec():
+    calls.append(1)
+    return [{value!r}, script]
+'''
+
+
+class SpecCacheTestCase(unittest.TestCase):
+
+    def test_specs_from_several_scripts_are_isolated(self):
+        with tempdir() as tmp:
+            (tmp / 'a.py').write_text(SPEC_TEMPLATE.format(value='a'))
+            (tmp / 'b.py').write_text(SPEC_TEMPLATE.format(value='b'))
+            cache = SpecCache(cache_dir=tmp / 'cache')
+
+            self.assertEqual(['a', 'a.py'], cache.get_spec(tmp / 'a.py', 'spec')())
+            self.assertEqual(['b', 'b.py'], cache.get_spec(tmp / 'b.py', 'spec')())
+            self.assertIsNone(cache.get_spec(tmp / 'a.py', 'other_spec'))
+            self.assertIsNone(cache.get_spec(tmp / 'a.py', 'calls'))
+
+    def test_script_is_executed_once_per_content(self):
+        with tempdir() as tmp:
+            script = tmp / 'a.py'
+            script.write_text(SPEC_TEMPLATE.format(value='a'))
+            cache = SpecCache(cache_dir=tmp / 'cache')
+
+            self.assertIs(cache.get_spec(script, 'spec'), cache.get_spec(script, 'spec'))
+            script.write_text(SPEC_TEMPLATE.format(value='changed'))
+            self.assertEqual(['changed', 'a.py'], cache.get_spec(script, 'spec')())
+
+    def test_compiled_code_is_stored_on_disk(self):
+        with tempdir() as tmp:
+            script = tmp / 'a.py'
+            script.write_text(SPEC_TEMPLATE.format(value='a'))
+            SpecCache(cache_dir=tmp / 'cache').get_spec(script, 'spec')
+            cached = (tmp / 'cache').files('*.pyc')
+            self.assertEqual(1, len(cached))
+
+            # next process uses cached code; corrupted cache entries are recompiled
+            self.assertEqual(['a', 'a.py'], SpecCache(cache_dir=tmp / 'cache').get_spec(script, 'spec')())
+            cached[0].write_bytes(b'garbage')
+            self.assertEqual(['a', 'a.py'], SpecCache(cache_dir=tmp / 'cache').get_spec(script, 'spec')())
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from mrunner.sweep import Grid, Random, Sobol, Halton, Uniform, LogUniform, IntUniform, IndexPermutation
+
+
+class SweepTestCase(unittest.TestCase):
+
+    def test_grid(self):
+        grid = Grid(a=[1, 2], b=['x', 'y', 'z'])
+        self.assertEqual(6, len(grid))
+        self.assertEqual([{'a': 1, 'b': 'x'}, {'a': 1, 'b': 'y'}, {'a': 1, 'b': 'z'},
+                          {'a': 2, 'b': 'x'}, {'a': 2, 'b': 'y'}, {'a': 2, 'b': 'z'}], list(grid))
+        self.assertEqual({'a': 2, 'b': 'z'}, grid[-1])
+
+    def test_huge_space_is_not_materialized(self):
+        grid = Grid(**{'p{}'.format(i): range(10) for i in range(12)})
+        self.assertEqual(10 ** 12, len(grid))
+        self.assertEqual(dict({'p{}'.format(i): 0 for i in range(10)}, p10=1, p11=2), grid[12])
+
+        shard = grid.shard(3, 7)
+        self.assertEqual(grid[3 + 7 * 1000], shard[1000])
+        self.assertEqual(3, len(list(grid.shuffle(seed=1)[:3])))
+
+    def test_product_branch_and_constraints(self):
+        space = Grid(model=['cnn', 'mlp']) * Grid(batch_size=[32, 64])
+        space = space.branch('model', cnn=Grid(kernel=[3, 5]))
+        self.assertEqual(6, len(space))
+        self.assertEqual([{'model': 'cnn', 'batch_size': 32, 'kernel': 3},
+                          {'model': 'cnn', 'batch_size': 32, 'kernel': 5},
+                          {'model': 'cnn', 'batch_size': 64, 'kernel': 3},
+                          {'model': 'cnn', 'batch_size': 64, 'kernel': 5},
+                          {'model': 'mlp', 'batch_size': 32},
+                          {'model': 'mlp', 'batch_size': 64}], list(space))
+
+        constrained = space.where(lambda p: p['batch_size'] * p.get('kernel', 1) < 300)
+        self.assertEqual(5, len(list(constrained)))
+        self.assertEqual(8, len(list(space + constrained[:2])))
+
+    def test_sampled_spaces_are_deterministic(self):
+        for space_class in [Random, Sobol, Halton]:
+            space = space_class(100, seed=5, lr=LogUniform(1e-5, 1e-1), layers=IntUniform(1, 3),
+                                dropout=Uniform(0, 0.5), optimizer=['sgd', 'adam'])
+            points = list(space)
+            self.assertEqual(points, list(space_class(100, seed=5, lr=LogUniform(1e-5, 1e-1), layers=IntUniform(1, 3),
+                                                      dropout=Uniform(0, 0.5), optimizer=['sgd', 'adam'])))
+            self.assertEqual(points[42], space[42])
+            for point in points:
+                self.assertTrue(1e-5 <= point['lr'] <= 1e-1)
+                self.assertIn(point['layers'], [1, 2, 3])
+                self.assertIn(point['optimizer'], ['sgd', 'adam'])
+
+    def test_sobol(self):
+        points = [(p['x'], p['y'], p['z']) for p in Sobol(4, x=Uniform(0, 1), y=Uniform(0, 1), z=Uniform(0, 1))]
+        self.assertEqual([(0, 0, 0), (0.5, 0.5, 0.5), (0.75, 0.25, 0.25), (0.25, 0.75, 0.75)], points)
+
+        # each of 2^k first points falls into different interval of length 2^-k (in each dimension)
+        space = Sobol(256, seed=1, **{'p{}'.format(i): Uniform(0, 1) for i in range(21)})
+        for i in range(21):
+            self.assertEqual(list(range(256)), sorted(int(p['p{}'.format(i)] * 256) for p in space))
+
+    def test_index_permutation(self):
+        for size in [1, 2, 7, 1000]:
+            self.assertEqual(list(range(size)), sorted(IndexPermutation(size, seed=3)))
+        self.assertNotEqual(list(range(1000)), list(IndexPermutation(1000, seed=3)))
+        self.assertNotEqual(list(IndexPermutation(1000, seed=3)), list(IndexPermutation(1000, seed=4)))
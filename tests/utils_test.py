@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import unittest
 
+import attr
 from path import tempdir, Path
 
 from mrunner.cli.config import ConfigParser
-from mrunner.utils.utils import get_paths_to_copy, PathToDump
+from mrunner.utils.utils import get_paths_to_copy, get_paths_digest, PathToDump, chunks, ThroughputMeter, \
+    GeneratedTemplateFile, shell_export
 
 
 class ConfigTestCase(unittest.TestCase):
@@ -81,3 +83,82 @@ class UtilsTestCase(unittest.TestCase):
                                                                         ('file2', 'file2'),
                                                                         ('file3', 'file3')}},
                              set(get_paths_to_copy(paths_to_copy=[tmp / '../external1'])))
+
+    def test_paths_digest(self):
+        with tempdir() as tmp:
+            tmp.chdir()
+            (tmp / 'a/1').makedirs()
+            (tmp / 'a/1/file_a1_1').write_text('file_a1_1')
+            (tmp / 'file1').write_text('file1')
+
+            digest = get_paths_digest(get_paths_to_copy())
+            self.assertEqual(digest, get_paths_digest(list(reversed(list(get_paths_to_copy())))))
+
+            # timestamps doesn't matter
+            (tmp / 'file1').touch()
+            self.assertEqual(digest, get_paths_digest(get_paths_to_copy()))
+
+            # but content and names does
+            (tmp / 'file1').write_text('file1 changed')
+            self.assertNotEqual(digest, get_paths_digest(get_paths_to_copy()))
+            (tmp / 'file1').write_text('file1')
+            (tmp / 'a/1/file_a1_1').rename(tmp / 'a/1/file_a1_2')
+            self.assertNotEqual(digest, get_paths_digest(get_paths_to_copy()))
+
+    def test_paths_to_copy_cache_clear(self):
+        with tempdir() as tmp:
+            tmp.chdir()
+            (tmp / 'file1').write_text('file1')
+            self.assertEqual({PathToDump(Path('file1'), Path('file1'))}, set(get_paths_to_copy()))
+
+            # listing is memoized till cache is cleared
+            (tmp / 'file2').write_text('file2')
+            self.assertEqual(1, len(get_paths_to_copy()))
+            get_paths_to_copy.cache_clear()
+            self.assertEqual(2, len(get_paths_to_copy()))
+
+    def test_chunks(self):
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], list(chunks(range(7), 3)))
+        self.assertEqual([], list(chunks([], 3)))
+
+        # input is consumed lazily
+        consumed = []
+        chunks_iter = chunks((consumed.append(i) or i for i in range(1000000)), 2)
+        self.assertEqual([0, 1], next(chunks_iter))
+        self.assertEqual([0, 1], consumed)
+
+    def test_throughput_meter(self):
+        now = [0.0]
+        meter = ThroughputMeter(interval=10, clock=lambda: now[0])
+        with self.assertLogs('mrunner.utils.utils', level='INFO') as logs:
+            for _ in range(50):
+                now[0] += 0.5
+                meter.update()
+        self.assertEqual(50, meter.count)
+        self.assertAlmostEqual(2.0, meter.rate)
+        self.assertEqual(2, len(logs.output))
+        self.assertIn('40 experiments submitted (2.0 experiments/s)', logs.output[-1])
+
+    def test_shell_export(self):
+        self.assertEqual("export A=1;", shell_export('A', 1))
+        self.assertEqual("export A='';", shell_export('A', ''))
+        self.assertEqual("export A='x\"$(rm -rf /)`y`';", shell_export('A', 'x"$(rm -rf /)`y`'))
+        # only previous value of variable itself is expanded
+        self.assertEqual("export PYTHONPATH=\"${PYTHONPATH}\"':src:$HOME';",
+                         shell_export('PYTHONPATH', '$PYTHONPATH:src:$HOME'))
+        self.assertEqual("export PYTHONPATH='$PYTHONPATHX:'\"${PYTHONPATH}\";",
+                         shell_export('PYTHONPATH', '$PYTHONPATHX:${PYTHONPATH}'))
+
+
+class GeneratedTemplateFileTestCase(unittest.TestCase):
+
+    def test_render_dockerfile(self):
+        Experiment = attr.make_class('Experiment', ['base_image', 'storage_dir', 'cmd_without_params'])
+        experiment = Experiment(base_image='python:3', storage_dir='/storage', cmd_without_params=['python', 'a.py'])
+        dockerfile = GeneratedTemplateFile(template_filename='Dockerfile.jinja2', experiment=experiment,
+                                           requirements_file='requirements.txt', layers=['layers/code'],
+                                           buildkit=False, entrypoint=True)
+        payload = dockerfile.path.text(encoding='utf-8')
+        self.assertIn('FROM python:3 AS dependencies', payload)
+        self.assertIn('COPY layers/code/ ${EXP_DIR}/', payload)
+        self.assertIn('ENTRYPOINT ["python", "a.py"]', payload)
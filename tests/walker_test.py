@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from path import tempdir
+
+from mrunner.utils.utils import get_paths_to_copy
+from mrunner.utils.walker import IgnoreRules, Walker, LimitExceeded
+
+
+class IgnoreRulesTestCase(unittest.TestCase):
+
+    def test_gitignore_semantics(self):
+        rules = IgnoreRules().extend(['# comment', '', '*.pyc', 'data/', '/checkpoints', 'logs/**/*.txt',
+                                      '!important.pyc', 'docs/*.md', 'file?.log', '[ab].tmp'])
+        self.assertTrue(rules.is_ignored('a.pyc'))
+        self.assertTrue(rules.is_ignored('src/module/a.pyc'))
+        self.assertFalse(rules.is_ignored('src/important.pyc'))
+
+        # directory only patterns
+        self.assertTrue(rules.is_ignored('data', is_dir=True))
+        self.assertTrue(rules.is_ignored('src/data', is_dir=True))
+        self.assertFalse(rules.is_ignored('data', is_dir=False))
+
+        # anchored patterns
+        self.assertTrue(rules.is_ignored('checkpoints', is_dir=True))
+        self.assertFalse(rules.is_ignored('src/checkpoints', is_dir=True))
+        self.assertTrue(rules.is_ignored('docs/index.md'))
+        self.assertFalse(rules.is_ignored('docs/api/index.md'))
+
+        # double asterisk, question mark, character classes
+        self.assertTrue(rules.is_ignored('logs/a.txt'))
+        self.assertTrue(rules.is_ignored('logs/a/b/c.txt'))
+        self.assertTrue(rules.is_ignored('file1.log'))
+        self.assertFalse(rules.is_ignored('file10.log'))
+        self.assertTrue(rules.is_ignored('b.tmp'))
+        self.assertFalse(rules.is_ignored('c.tmp'))
+
+    def test_rules_relative_to_ignore_file_dir(self):
+        rules = IgnoreRules().extend(['/out', 'a/b.txt'], base='sub')
+        self.assertTrue(rules.is_ignored('sub/out', is_dir=True))
+        self.assertFalse(rules.is_ignored('out', is_dir=True))
+        self.assertTrue(rules.is_ignored('sub/a/b.txt'))
+        self.assertFalse(rules.is_ignored('a/b.txt'))
+
+
+class WalkerTestCase(unittest.TestCase):
+
+    def test_ignore_files(self):
+        with tempdir() as tmp:
+            tmp.chdir()
+            for p in ['src/a.py', 'src/a.pyc', 'src/sub/b.py', 'data/big.bin', 'lib/c.py', 'lib/out/d.py',
+                      'file1']:
+                (tmp / p).parent.makedirs_p()
+                (tmp / p).write_text(p)
+            (tmp / '.gitignore').write_text('*.pyc\ndata/\n')
+            (tmp / 'lib/.mrunnerignore').write_text('out/\n')
+
+            self.assertEqual({'.gitignore', 'src/a.py', 'src/sub', 'lib/.mrunnerignore', 'lib/c.py', 'file1'},
+                             {str(p.local_path) for p in get_paths_to_copy(exclude=[])})
+            self.assertEqual({'src/a.py', 'src/sub', 'lib/.mrunnerignore', 'lib/c.py'},
+                             {str(p.local_path) for p in get_paths_to_copy(exclude=['.gitignore', 'file*'])})
+
+    def test_limits(self):
+        with tempdir() as tmp:
+            for idx in range(10):
+                (tmp / 'file{}'.format(idx)).write_text('1234567890')
+
+            walker = Walker(tmp, max_files=10, max_size=100)
+            self.assertEqual(10, len(walker.list_top_paths()))
+            self.assertEqual(100, walker.total_size)
+            self.assertRaises(LimitExceeded, Walker(tmp, max_files=9).list_top_paths)
+            self.assertRaises(LimitExceeded, Walker(tmp, max_size=99).list_top_paths)